@@ -0,0 +1,173 @@
+import os, io, csv, json, hashlib, sqlite3, logging
+from collections.abc import Mapping
+
+ALERTS_INDEX_FILE = 'alerts.sqlite'
+SCHEMA_VERSION = 2
+SIDES = {'vuln': '_out.csv', 'fix': '_out_fix.csv'}
+
+logger = logging.getLogger(__name__)
+
+
+def clean_filename(filename):
+    # Tool reports name files relative to different roots and with either separator
+    filename = filename.strip().replace('\\', '/')
+    if filename.startswith('/'):
+        filename = filename[1:]
+    if filename.startswith('org/'):
+        filename = 'java/{}'.format(filename)
+    return filename
+
+
+class AlertsIndex:
+    # On-disk index of the tool alerts found under tool_alerts/{vuln,fix}/<project>/<tool>/<vuln_id>_out[_fix].csv.
+    # Every alert file is fingerprinted by mtime and size, update() only reloads the files whose fingerprint
+    # changed and drops the ones that disappeared. Rows are kept as read plus their cleaned filename.
+    # Sources are recorded with the absolute alerts folder they were found in, so generators reading different
+    # folders can share one db_file without seeing or dropping each other's alerts.
+    def __init__(self, alerts_folder, db_file):
+        self.alerts_folder = alerts_folder
+        self.folder = os.path.abspath(alerts_folder)
+        self.db_file = db_file
+        self.updated = set()
+        self._connection = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        state['_pid'] = None
+        return state
+
+    @property
+    def connection(self):
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.db_file, timeout=60)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            if self._connection.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+                # Indexes built before the alert files were hashed or their folder recorded are rebuilt from the files
+                self._connection.execute('DROP TABLE IF EXISTS sources')
+                self._connection.execute('DROP TABLE IF EXISTS alerts')
+                self._connection.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+            self._connection.execute('CREATE TABLE IF NOT EXISTS sources '
+                                     '(path TEXT PRIMARY KEY, folder TEXT, side TEXT, project_vuln TEXT, '
+                                     'tool TEXT, mtime_ns INTEGER, size INTEGER, sha TEXT)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS sources_key ON sources (folder, side, project_vuln)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS alerts '
+                                     '(path TEXT, position INTEGER, row TEXT, file TEXT, PRIMARY KEY (path, position))')
+            self._connection.commit()
+            self._pid = os.getpid()
+        return self._connection
+
+    def scan(self, side):
+        # Yields (path, project_vuln, tool) of every alert file of a side
+        filename_end = SIDES[side]
+        for path, dirs, filenames in os.walk(os.path.join(self.folder, side)):
+            dirs.sort()
+            for filename in sorted(filenames):
+                if filename.endswith(filename_end):
+                    tool_name = os.path.basename(path)
+                    project_id = os.path.basename(os.path.dirname(path))
+                    vuln_id = filename.split(filename_end)[0]
+                    yield os.path.join(path, filename), '{}_{}'.format(project_id, vuln_id), tool_name
+
+    def update(self, side):
+        known = dict((row[0], (row[1], row[2])) for row in self.connection.execute(
+            'SELECT path, mtime_ns, size FROM sources WHERE folder = ? AND side = ?', (self.folder, side)))
+        reloaded = 0
+        with self.connection:
+            for path, project_vuln, tool in self.scan(side):
+                stat = os.stat(path)
+                fingerprint = known.pop(path, None)
+                if fingerprint == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                rows, sha = self.read_alerts(path)
+                self.connection.execute('DELETE FROM alerts WHERE path = ?', (path,))
+                self.connection.executemany('INSERT INTO alerts VALUES (?, ?, ?, ?)',
+                                            ((path, position, json.dumps(row), self.clean_row(path, row))
+                                             for position, row in enumerate(rows)))
+                self.connection.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                        (path, self.folder, side, project_vuln, tool, stat.st_mtime_ns, stat.st_size,
+                                         sha))
+                reloaded += 1
+            for path in known:
+                self.connection.execute('DELETE FROM alerts WHERE path = ?', (path,))
+                self.connection.execute('DELETE FROM sources WHERE path = ?', (path,))
+        logger.info('Alerts index for %s: %d files reloaded, %d removed', side, reloaded, len(known))
+        self.updated.add(side)
+
+    def read_alerts(self, path):
+        # Returns (rows, sha of the file contents)
+        logger.debug('Loading data from %s', path)
+        content = []
+        sha = ''
+        try:
+            with open(path, 'rb') as f_in:
+                data = f_in.read()
+            sha = hashlib.sha1(data).hexdigest()
+            content = list(csv.reader(io.StringIO(data.decode('utf8'), newline=None), delimiter=';'))
+        except Exception as e:
+            logger.error('An exception happened, while reading data from %s', path)
+            logger.error(str(e))
+        return content, sha
+
+    def clean_row(self, path, row):
+        if len(row) < 3:
+            logger.warning('An exception occurred, while cleaning filename for %s %s', path, row)
+            return None
+        return clean_filename(row[2])
+
+    def keys(self, side):
+        if side not in self.updated:
+            self.update(side)
+        return [row[0] for row in self.connection.execute(
+            'SELECT DISTINCT project_vuln FROM sources WHERE folder = ? AND side = ? ORDER BY project_vuln',
+            (self.folder, side))]
+
+    def hashes(self, side, project_vuln):
+        # {tool: sha of its alert file} for one project_vuln, what its alerts are fingerprinted by
+        if side not in self.updated:
+            self.update(side)
+        return dict(self.connection.execute('SELECT tool, sha FROM sources WHERE folder = ? AND side = ? '
+                                            'AND project_vuln = ? ORDER BY path',
+                                            (self.folder, side, project_vuln)).fetchall())
+
+    def get(self, side, project_vuln, clean_filenames=True):
+        # Returns {tool: [rows]} for one project_vuln, or None when no tool reported on it
+        if side not in self.updated:
+            self.update(side)
+        sources = self.connection.execute('SELECT path, tool FROM sources WHERE folder = ? AND side = ? '
+                                          'AND project_vuln = ? ORDER BY path',
+                                          (self.folder, side, project_vuln)).fetchall()
+        if len(sources) == 0:
+            return None
+        alerts = dict()
+        for path, tool in sources:
+            rows = []
+            for row, file in self.connection.execute('SELECT row, file FROM alerts WHERE path = ? '
+                                                     'ORDER BY position', (path,)):
+                row = json.loads(row)
+                if clean_filenames and file is not None:
+                    row[2] = file
+                rows.append(row)
+            alerts[tool] = rows
+        return alerts
+
+
+class AlertsView(Mapping):
+    # Read-only {project_vuln: {tool: [rows]}} over one side of the index, loaded on access
+    def __init__(self, index, side, clean_filenames=True):
+        self.index = index
+        self.side = side
+        self.clean_filenames = clean_filenames
+
+    def __getitem__(self, key):
+        alerts = self.index.get(self.side, key, clean_filenames=self.clean_filenames)
+        if alerts is None:
+            raise KeyError(key)
+        return alerts
+
+    def __iter__(self):
+        return iter(self.index.keys(self.side))
+
+    def __len__(self):
+        return len(self.index.keys(self.side))
@@ -0,0 +1,278 @@
+import os, sys, csv, json, time, random, shutil, logging, argparse, platform, tempfile, subprocess
+from scripts.dataset_generator import DatasetGenerator, DATA_FOLDER
+from scripts.raw_file_server import RawFileServer
+from scripts.git_reader import get_reader
+from scripts.metrics import metrics
+
+# Throughput benchmark of the pipeline stages on a synthetic project: a local git repository of generated Java
+# classes with one fix commit per CVE, the matching input, ground truth and tool_alerts fixtures, and raw files
+# served from a local folder or HTTP stand-in instead of GitHub. Results are saved as JSON so that runs can
+# be compared with --compare.
+BENCHMARK_FOLDER = os.path.join(DATA_FOLDER, 'benchmarks')
+PROJECT = 'benchproject'
+USER = 'bench'
+PACKAGE = 'org.apache.bench'
+TOOLS = ['Tool_A', 'Tool_B', 'Tool_C']
+SIZES = [10, 50, 200]
+TOLERANCE = 1.25
+
+logger = logging.getLogger(__name__)
+
+GIT_ENV = dict(os.environ, GIT_AUTHOR_NAME='bench', GIT_AUTHOR_EMAIL='bench@example.com',
+               GIT_COMMITTER_NAME='bench', GIT_COMMITTER_EMAIL='bench@example.com',
+               GIT_AUTHOR_DATE='2020-01-01T00:00:00Z', GIT_COMMITTER_DATE='2020-01-01T00:00:00Z')
+
+
+def git(repo_folder, *args):
+    result = subprocess.run(['git'] + list(args), cwd=repo_folder, env=GIT_ENV, check=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return result.stdout.decode().strip()
+
+
+def java_class(name, methods, rng):
+    lines = ['package {};'.format(PACKAGE), '', 'public class {} {{'.format(name), '']
+    for method in range(methods):
+        lines.append('    public int method{}(int value) {{'.format(method))
+        lines.append('        int result = value + {};'.format(rng.randint(0, 100)))
+        lines.append('        if (result > {}) {{'.format(rng.randint(0, 100)))
+        lines.append('            result = result - {};'.format(rng.randint(1, 10)))
+        lines.append('        }')
+        lines.append('        return result;')
+        lines.append('    }')
+        lines.append('')
+    lines.append('}')
+    return lines
+
+
+def write_lines(path, lines):
+    with open(path, 'w', encoding='utf8', newline='\n') as f_out:
+        f_out.write('\n'.join(lines) + '\n')
+
+
+def create_repository(repo_folder, cves, files, methods, seed=0):
+    # Returns [(vuln_id, fix commit, {path: changed lines in the fix revision})]
+    rng = random.Random(seed)
+    package_folder = os.path.join(repo_folder, *(['java'] + PACKAGE.split('.')))
+    os.makedirs(package_folder)
+    git(repo_folder, 'init', '-q')
+    contents = dict()
+    for n in range(files):
+        path = '/'.join(['java'] + PACKAGE.split('.') + ['Class{}.java'.format(n)])
+        contents[path] = java_class('Class{}'.format(n), methods, rng)
+        write_lines(os.path.join(repo_folder, path), contents[path])
+    git(repo_folder, 'add', '-A')
+    git(repo_folder, 'commit', '-q', '-m', 'Initial import')
+
+    fixes = []
+    paths = sorted(contents)
+    for n in range(cves):
+        vuln_id = 'CVE-BENCH-{}'.format(n)
+        changed = dict()
+        for path in rng.sample(paths, min(len(paths), rng.randint(1, 2))):
+            lines = contents[path]
+            # Guard a method: rewrite its first statement, add a check after it and drop a blank line
+            statements = [i for i, line in enumerate(lines) if line.strip().startswith('int result')]
+            i = rng.choice(statements)
+            lines[i] = lines[i].replace(' + ', ' + Math.abs(value) % 7 + ', 1)
+            lines.insert(i + 1, '        if (value < 0) {{ return 0; }} // {}'.format(vuln_id))
+            blanks = [j for j, line in enumerate(lines) if line == '' and j > i + 2]
+            if len(blanks) > 0:
+                del lines[rng.choice(blanks)]
+            changed[path] = [i + 1, i + 2]
+            write_lines(os.path.join(repo_folder, path), lines)
+        git(repo_folder, 'commit', '-q', '-a', '-m', 'Fix {}'.format(vuln_id))
+        fixes.append((vuln_id, git(repo_folder, 'rev-parse', 'HEAD'), changed))
+    return fixes
+
+
+def create_fixtures(data_folder, repo, fixes, files, seed=0):
+    # input_<project>.csv, ground_truth.csv and tool_alerts/{vuln,fix}/<project>/<tool>/<vuln_id>_out[_fix].csv
+    rng = random.Random(seed)
+    input_revisions = os.path.join(data_folder, 'input_{}.csv'.format(PROJECT))
+    ground_truth = os.path.join(data_folder, 'ground_truth.csv')
+    alerts_folder = os.path.join(data_folder, 'tool_alerts')
+    with open(input_revisions, 'w', newline='', encoding='utf8') as f_out:
+        writer = csv.writer(f_out)
+        writer.writerow(['project', 'repo', 'commit', 'vuln_id'])
+        for vuln_id, commit, changed in fixes:
+            writer.writerow([PROJECT, repo, commit, vuln_id])
+    with open(ground_truth, 'w', newline='', encoding='utf8') as f_out:
+        writer = csv.writer(f_out, delimiter=';')
+        writer.writerow(['project', 'vuln_id', 'file', 'lines'])
+        for vuln_id, commit, changed in fixes:
+            for path, lines in sorted(changed.items()):
+                writer.writerow([PROJECT, vuln_id, path, ','.join(str(line) for line in lines)])
+
+    paths = ['/'.join(['java'] + PACKAGE.split('.') + ['Class{}.java'.format(n)]) for n in range(files)]
+    for side, filename_end in [('vuln', '_out.csv'), ('fix', '_out_fix.csv')]:
+        for tool in TOOLS:
+            tool_folder = os.path.join(alerts_folder, side, PROJECT, tool)
+            os.makedirs(tool_folder)
+            for vuln_id, commit, changed in fixes:
+                with open(os.path.join(tool_folder, '{}{}'.format(vuln_id, filename_end)), 'w', newline='',
+                          encoding='utf8') as f_out:
+                    writer = csv.writer(f_out, delimiter=';')
+                    # Alerts on the fixed lines and elsewhere in the changed files, plus noise in other files
+                    for path, lines in sorted(changed.items()):
+                        for line in lines + [rng.randint(1, 40) for _ in range(3)]:
+                            writer.writerow([tool, 'warning', path, line])
+                    writer.writerow([tool, 'info', rng.choice(paths), rng.randint(1, 40)])
+    return input_revisions, ground_truth, alerts_folder
+
+
+def export_raw_files(raw_folder, repo_folder, fixes):
+    # Lays the files out as <user>/<project>/<commit>/<path>, the local folder form of the raw file URLs
+    reader = get_reader(repo_folder)
+    for vuln_id, commit, changed in fixes:
+        for revision in [commit, reader.previous_commit(commit)]:
+            for path in changed:
+                target = os.path.join(raw_folder, USER, PROJECT, revision, *path.split('/'))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, 'wb') as f_out:
+                    f_out.write(reader.blob(revision, path))
+
+
+def timed(stages, name, function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    stages[name] = time.perf_counter() - start
+    logger.info('%s: %.3fs', name, stages[name])
+    return result
+
+
+def count_rows(csv_file):
+    with open(csv_file, 'r', encoding='utf8', newline='') as f_in:
+        return max(0, sum(1 for _ in f_in) - 1)
+
+
+def run_size(work_folder, cves, files, methods, workers=2, raw_source='http', slicing=True, seed=0, fail_every=0):
+    origin = os.path.join(work_folder, 'origin')
+    repo_folder = os.path.join(origin, PROJECT)
+    data_folder = os.path.join(work_folder, 'data')
+    cache_folder = os.path.join(work_folder, 'cache')
+    for folder in [repo_folder, data_folder, cache_folder]:
+        os.makedirs(folder)
+    setup = dict()
+    stages = dict()
+    fixes = timed(setup, 'create_repository', create_repository, repo_folder, cves, files, methods, seed=seed)
+    # repo looks like a GitHub URL, so the raw file URL gets <user>/<project> out of it
+    repo = os.path.join(origin, USER, PROJECT)
+    os.makedirs(os.path.dirname(repo))
+    os.symlink(repo_folder, repo)
+    input_revisions, ground_truth, alerts_folder = create_fixtures(data_folder, repo, fixes, files, seed=seed)
+
+    metrics.reset()
+    generator = DatasetGenerator(input_revisions=input_revisions, input_ground_truth=ground_truth,
+                                 intermediate_store=os.path.join(data_folder, 'store.sqlite'),
+                                 alerts_folder=alerts_folder, cache_folder=cache_folder)
+
+    server = None
+    if raw_source == 'http':
+        server = RawFileServer(origin, fail_every=fail_every).start()
+        generator.slicer.raw_file_start = server.url
+    else:
+        raw_folder = os.path.join(work_folder, 'raw')
+        export_raw_files(raw_folder, repo_folder, fixes)
+        generator.slicer.raw_file_start = raw_folder
+    try:
+        downloads = [(commit, path) for vuln_id, commit, changed in fixes for path in changed]
+        timed(stages, 'fetch', generator.slicer.prefetch_remote,
+              [(repo, commit, path) for commit, path in downloads])
+    finally:
+        if server is not None:
+            server.stop()
+
+    timed(stages, 'ground_truth', lambda: [generator.final_dict_as_table(vuln=vuln, incremental=False)
+                                           for vuln in [True, False]])
+    combined = os.path.join(data_folder, 'combined_output.csv')
+    timed(stages, 'combine', generator.combine_final_dataset_file, combined, WORKERS=workers, incremental=False)
+    if slicing and shutil.which('java') is not None:
+        timed(stages, 'slicing', generator.augment_final_dataset_with_slices, combined, WORKERS=workers,
+              output_dataset=os.path.join(data_folder, 'alerts-dataset.csv'))
+    elif slicing:
+        logger.warning('java is not available, the slicing stage is skipped')
+
+    return {'cves': cves, 'files': files, 'methods': methods, 'downloads': len(downloads),
+            'combined_rows': count_rows(combined), 'setup': setup, 'stages': stages,
+            'timers': dict((name, timer[1]) for name, timer in metrics.timers.items()),
+            'counters': dict(metrics.counters)}
+
+
+def run_benchmark(sizes=SIZES, files_per_cve=0.5, methods=20, workers=2, raw_source='http', slicing=True, seed=0,
+                  keep=False, fail_every=0):
+    results = []
+    for cves in sizes:
+        files = max(2, int(cves * files_per_cve))
+        work_folder = tempfile.mkdtemp(prefix='benchmark_{}_'.format(cves))
+        logger.info('Benchmarking %d CVEs over %d files in %s', cves, files, work_folder)
+        try:
+            results.append(run_size(work_folder, cves, files, methods, workers=workers, raw_source=raw_source,
+                                    slicing=slicing, seed=seed, fail_every=fail_every))
+        finally:
+            if not keep:
+                shutil.rmtree(work_folder, ignore_errors=True)
+    return {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'machine': platform.machine(), 'cpus': os.cpu_count(), 'workers': workers, 'raw_source': raw_source,
+            'results': results}
+
+
+def compare(baseline, current, tolerance=TOLERANCE):
+    # Prints stage times of both runs per size, returns False when a stage got slower than tolerance allows
+    ok = True
+    baseline_results = dict((result['cves'], result) for result in baseline['results'])
+    for result in current['results']:
+        previous = baseline_results.get(result['cves'])
+        if previous is None:
+            continue
+        print('{} CVEs'.format(result['cves']))
+        for stage in result['stages']:
+            if stage not in previous['stages']:
+                continue
+            before = previous['stages'][stage]
+            after = result['stages'][stage]
+            ratio = after / before if before > 0 else 1.0
+            flag = ''
+            if ratio > tolerance:
+                flag = '  slower'
+                ok = False
+            print('  {:<20} {:>10.3f} {:>10.3f} {:>7.2f}x{}'.format(stage, before, after, ratio, flag))
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times the dataset generation stages on synthetic projects')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in SIZES),
+                        help='comma separated numbers of CVEs to benchmark')
+    parser.add_argument('--files-per-cve', type=float, default=0.5)
+    parser.add_argument('--methods', type=int, default=20, help='methods per generated class')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--raw-source', choices=['http', 'file'], default='http',
+                        help='serve raw files from a local HTTP stand-in or a local folder')
+    parser.add_argument('--fail-every', type=int, default=0,
+                        help='have the HTTP stand-in answer every Nth request with 429 to exercise the retries')
+    parser.add_argument('--no-slice', action='store_true', help='skip the slicing stage')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', action='store_true', help='keep the generated projects')
+    parser.add_argument('--output', help='where to save the results, by default under data/benchmarks')
+    parser.add_argument('--compare', metavar='BASELINE', help='compare with the results of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+    logging.basicConfig(level='INFO', format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    logging.getLogger('scripts.dataset_generator').setLevel(logging.WARNING)
+
+    results = run_benchmark([int(size) for size in args.sizes.split(',')], files_per_cve=args.files_per_cve,
+                            methods=args.methods, workers=args.workers, raw_source=args.raw_source,
+                            slicing=not args.no_slice, seed=args.seed, keep=args.keep,
+                            fail_every=args.fail_every)
+    output = args.output
+    if output is None:
+        os.makedirs(BENCHMARK_FOLDER, exist_ok=True)
+        output = os.path.join(BENCHMARK_FOLDER, 'benchmark-{}.json'.format(time.strftime('%Y%m%d-%H%M%S')))
+    with open(output, 'w', encoding='utf8') as f_out:
+        json.dump(results, f_out, indent=2)
+    print('Results saved in {}'.format(output))
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf8') as f_in:
+            baseline = json.load(f_in)
+        sys.exit(0 if compare(baseline, results, args.tolerance) else 1)
@@ -0,0 +1,175 @@
+import os, sqlite3, time, hashlib
+from scripts.git_reader import get_reader
+
+BLOB_FOLDER = 'blobs'
+MAX_STORE_SIZE = 2 * 1024 * 1024 * 1024
+# Marked paths absent from a revision in earlier stores. These are no longer written, a later fetch of the clone
+# may bring the revision in.
+MISSING = ''
+TOUCH_INTERVAL = 60
+
+
+def project_name(repo):
+    # What revisions are stored under: the same for a repository URL and for the folder it was cloned into
+    name = os.path.basename(repo.rstrip('/'))
+    return name[:-len('.git')] if name.endswith('.git') else name
+
+
+def git_blob_sha(content):
+    # The sha git itself gives the blob, so downloaded and locally read revisions share their entries
+    return hashlib.sha1(b'blob %d\0' % len(content) + content).hexdigest()
+
+
+class BlobStore:
+    # Content-addressed store of file revisions, filled from a local clone through git cat-file --batch.
+    # blobs/<sha[:2]>/<sha> holds the contents, index.sqlite maps (project, full commit sha, path) to the blob sha
+    # and keeps the last access time used for LRU eviction. Access times are written in batches at most every
+    # TOUCH_INTERVAL seconds, so reads from many pool workers do not queue on the SQLite write lock.
+    def __init__(self, cache_folder, max_size=MAX_STORE_SIZE):
+        self.folder = os.path.join(cache_folder, BLOB_FOLDER)
+        self.index_file = os.path.join(self.folder, 'index.sqlite')
+        self.max_size = max_size
+        self._connection = None
+        self._pid = None
+        self._touched = dict()
+        self._flushed = time.time()
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder, exist_ok=True)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        state['_pid'] = None
+        state['_touched'] = dict()
+        return state
+
+    @property
+    def connection(self):
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.index_file, timeout=60)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS blobs '
+                                     '(sha TEXT PRIMARY KEY, size INTEGER, last_used REAL)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS paths '
+                                     '(repo TEXT, rev TEXT, path TEXT, sha TEXT, PRIMARY KEY (repo, rev, path))')
+            self._connection.commit()
+            self._pid = os.getpid()
+        return self._connection
+
+    def blob_path(self, sha):
+        return os.path.join(self.folder, sha[:2], sha)
+
+    def lookup(self, repo, rev, path):
+        row = self.connection.execute('SELECT sha FROM paths WHERE repo = ? AND rev = ? AND path = ?',
+                                      (repo, rev, path)).fetchone()
+        if row is None or row[0] == MISSING:
+            return None
+        return row[0]
+
+    def get(self, repo_folder, rev, path):
+        # Returns the file contents as bytes or None if the path does not exist at that revision
+        repo = project_name(repo_folder)
+        rev = get_reader(repo_folder).resolve(rev) or rev
+        sha = self.lookup(repo, rev, path)
+        if sha is None or not os.path.exists(self.blob_path(sha)):
+            self.prefetch(repo_folder, [(rev, path)])
+            sha = self.lookup(repo, rev, path)
+        if sha is None:
+            return None
+        return self.read_blob(sha)
+
+    def read_blob(self, sha):
+        with open(self.blob_path(sha), 'rb') as f_in:
+            content = f_in.read()
+        self.touch(sha)
+        return content
+
+    def touch(self, sha):
+        now = time.time()
+        self._touched[sha] = now
+        if now - self._flushed > TOUCH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        # Writes the access times collected since the last flush
+        if len(self._touched) > 0:
+            self.connection.executemany('UPDATE blobs SET last_used = ? WHERE sha = ?',
+                                        [(used, sha) for sha, used in self._touched.items()])
+            self.connection.commit()
+            self._touched = dict()
+        self._flushed = time.time()
+
+    def read(self, repo, rev, path):
+        # Stored contents of path at rev, None when the store does not hold them; no repository is involved
+        sha = self.lookup(repo, rev, path)
+        if sha is None or not os.path.exists(self.blob_path(sha)):
+            return None
+        return self.read_blob(sha)
+
+    def stored_size(self, repo, rev, path):
+        # Size in bytes of the stored contents of path at rev, None when the store does not hold them
+        row = self.connection.execute('SELECT blobs.size FROM paths JOIN blobs ON blobs.sha = paths.sha '
+                                      'WHERE paths.repo = ? AND paths.rev = ? AND paths.path = ?',
+                                      (repo, rev, path)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def put(self, repo, rev, path, content):
+        # Stores contents obtained without the repository, e.g. downloaded; the caller commits
+        sha = git_blob_sha(content)
+        self.store(sha, content, time.time())
+        self.connection.execute('INSERT OR REPLACE INTO paths VALUES (?, ?, ?, ?)', (repo, rev, path, sha))
+
+    def prefetch(self, repo_folder, revisions_paths):
+        # revisions_paths = [(rev, path)], read through the repository's cat-file session; blobs that are
+        # already stored under their sha are only indexed, not read again
+        repo = project_name(repo_folder)
+        reader = get_reader(repo_folder)
+        now = time.time()
+        for rev, path in revisions_paths:
+            rev = reader.resolve(rev) or rev
+            sha = self.lookup(repo, rev, path)
+            if sha is not None and os.path.exists(self.blob_path(sha)):
+                continue
+            sha = reader.blob_sha(rev, path)
+            if sha is None:
+                # Not stored, the path may appear at rev once the clone is fetched again
+                continue
+            if not os.path.exists(self.blob_path(sha)):
+                self.store(sha, reader.read(sha)[2], now)
+            else:
+                self.connection.execute('UPDATE blobs SET last_used = ? WHERE sha = ?', (now, sha))
+            self.connection.execute('INSERT OR REPLACE INTO paths VALUES (?, ?, ?, ?)', (repo, rev, path, sha))
+        self.connection.commit()
+        self.evict()
+
+    def store(self, sha, content, now):
+        filename = self.blob_path(sha)
+        if not os.path.exists(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            tmp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+            with open(tmp_filename, 'wb') as f_out:
+                f_out.write(content)
+            os.replace(tmp_filename, filename)
+        self.connection.execute('INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)', (sha, len(content), now))
+
+    def size(self):
+        return self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+
+    def evict(self):
+        self.flush()
+        total = self.size()
+        if total <= self.max_size:
+            return
+        for sha, size in self.connection.execute('SELECT sha, size FROM blobs ORDER BY last_used').fetchall():
+            if total <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(self.blob_path(sha))
+            except OSError:
+                pass
+            self.connection.execute('DELETE FROM blobs WHERE sha = ?', (sha,))
+            self.connection.execute('DELETE FROM paths WHERE sha = ?', (sha,))
+            total -= size
+        self.connection.commit()
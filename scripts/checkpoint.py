@@ -0,0 +1,62 @@
+import os, json, zlib
+
+ERROR_RESULT = 'error file'
+
+
+def row_key(line):
+    # project, vuln_id, vul_or_fix, tool, file of a combined dataset row
+    return line[0], line[3], line[4], line[5], line[6]
+
+
+def shard_of(line, shards):
+    # Rows slicing the same file at the same commit stay in one shard, so they can still be batched
+    return zlib.crc32('\0'.join([line[1], line[2], line[6]]).encode('utf8')) % shards
+
+
+def shard_filename(output_dataset, index, shards):
+    base, extension = os.path.splitext(output_dataset)
+    return '{}.shard{}of{}{}'.format(base, index, shards, extension)
+
+
+class CheckpointJournal:
+    # Append-only JSON lines journal of finished rows and their slices. A crash can at most leave a
+    # truncated last line behind, which is ignored when the journal is loaded again.
+    def __init__(self, journal_file):
+        self.journal_file = journal_file
+        self.completed = dict()
+        self._f_out = None
+
+    def load(self):
+        self.completed = dict()
+        if not os.path.exists(self.journal_file):
+            return self.completed
+        with open(self.journal_file, 'r', encoding='utf8') as f_in:
+            for line in f_in:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self.completed[tuple(record['key'])] = (record['slices'], record.get('fingerprint'))
+        return self.completed
+
+    def get(self, line, fingerprint=None):
+        # Returns the journalled slices of a row unless they have to be computed (again): they failed, or
+        # were computed from inputs with another fingerprint
+        record = self.completed.get(row_key(line))
+        if record is None or ERROR_RESULT in record[0]:
+            return None
+        if fingerprint is not None and record[1] != fingerprint:
+            return None
+        return record[0]
+
+    def record(self, line, slices, fingerprint=None):
+        if self._f_out is None:
+            self._f_out = open(self.journal_file, 'a', encoding='utf8')
+        self._f_out.write(json.dumps({'key': list(row_key(line)), 'slices': slices, 'fingerprint': fingerprint}) + '\n')
+        self._f_out.flush()
+        self.completed[row_key(line)] = (slices, fingerprint)
+
+    def close(self):
+        if self._f_out is not None:
+            self._f_out.close()
+            self._f_out = None
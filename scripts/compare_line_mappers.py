@@ -0,0 +1,62 @@
+import os, csv, sys, time, argparse
+from scripts.slicer_wrapper import Slicer, DATA_FOLDER
+from scripts.line_mapper import compare_mappings
+
+# Regression check of the in-process line mapper against lhdiff.jar: every (repo, commit, file) of the
+# combined dataset is mapped against its parent revision by both engines and the mappings are compared.
+
+
+def build_corpus(combined_dataset, limit=None):
+    corpus = []
+    seen = set()
+    with open(combined_dataset, 'r', encoding='utf8') as f_in:
+        reader = csv.reader(f_in, delimiter=';')
+        next(reader)
+        for line in reader:
+            request = (line[1], line[2], line[6])
+            if request in seen:
+                continue
+            seen.add(request)
+            corpus.append(request)
+            if limit is not None and len(corpus) >= limit:
+                break
+    return corpus
+
+
+def compare(corpus, cache_folder=None):
+    kwargs = dict() if cache_folder is None else {'cache_folder': cache_folder}
+    engines = [Slicer(line_mapper='lhdiff', **kwargs), Slicer(line_mapper='python', **kwargs)]
+    elapsed = [0.0, 0.0]
+    totals = [0, 0, 0, 0]
+    mismatches = []
+    for repo, commit, file in corpus:
+        commit_new, commit_old = engines[0].resolve_commit_and_parent(repo, commit)
+        mappings = []
+        for i, slicer in enumerate(engines):
+            start = time.time()
+            mappings.append(slicer.compute_line_mapping(repo, commit_old, commit_new, file, file))
+            elapsed[i] += time.time() - start
+        expected, actual = mappings
+        if isinstance(expected, str) or isinstance(actual, str):
+            if expected != actual:
+                mismatches.append((repo, commit, file, expected if isinstance(expected, str) else 'mapping',
+                                   actual if isinstance(actual, str) else 'mapping'))
+            continue
+        counts = compare_mappings(expected, actual)
+        totals = [total + count for total, count in zip(totals, counts)]
+        if counts[1:] != (0, 0, 0):
+            mismatches.append((repo, commit, file) + counts)
+
+    print('{} file pairs, lhdiff {:.2f}s, python {:.2f}s'.format(len(corpus), elapsed[0], elapsed[1]))
+    print('same {}, different {}, only lhdiff {}, only python {}'.format(*totals))
+    for mismatch in mismatches:
+        print('mismatch {}'.format(mismatch))
+    return len(mismatches) == 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares the python line mapper with lhdiff.jar')
+    parser.add_argument('--dataset', default=os.path.join(DATA_FOLDER, 'combined_output.csv'))
+    parser.add_argument('--limit', type=int)
+    args = parser.parse_args()
+    sys.exit(0 if compare(build_corpus(args.dataset, args.limit)) else 1)
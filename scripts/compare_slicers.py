@@ -0,0 +1,67 @@
+import os, csv, sys, time, argparse
+from scripts.slicer_wrapper import Slicer, DATA_FOLDER
+from scripts.lines import line_base
+
+# Regression check of slicer/SlicerServer.java against the repoman jar it reimplements the Main of: every alert
+# of the combined dataset is sliced by the jar's command line and by the server, both slice types, and the
+# sliced lines are compared.
+SLICE_TYPES = ['lightweight', 'pessimist']
+
+
+def build_corpus(combined_dataset, limit=None):
+    # [(repo, commit, file, lines, starting_index)] without repeats
+    corpus = []
+    seen = set()
+    with open(combined_dataset, 'r', encoding='utf8') as f_in:
+        reader = csv.reader(f_in, delimiter=';')
+        next(reader)
+        for line in reader:
+            starting_index = line_base(line[5])
+            request = (line[1], line[2], line[-2], line[-1], starting_index)
+            if request in seen:
+                continue
+            seen.add(request)
+            corpus.append(request)
+            if limit is not None and len(corpus) >= limit:
+                break
+    return corpus
+
+
+def compare(corpus, cache_folder=None):
+    kwargs = dict() if cache_folder is None else {'cache_folder': cache_folder}
+    engines = [Slicer(use_server=False, use_slice_cache=False, **kwargs),
+               Slicer(use_server=True, use_slice_cache=False, **kwargs)]
+    elapsed = [0.0, 0.0]
+    same = 0
+    mismatches = []
+    for repo, commit, file, lines, starting_index in corpus:
+        content = engines[0].get_file_content(repo=repo, commit=commit, file=file)
+        seed_lines = engines[0].get_seed_lines(lines, starting_index)
+        if content is None or seed_lines is None:
+            continue
+        for slicetype in SLICE_TYPES:
+            answers = []
+            for i, slicer in enumerate(engines):
+                start = time.time()
+                output, error = slicer.run_slicer(content, slicetype, seed_lines)
+                elapsed[i] += time.time() - start
+                answers.append(slicer.slice_output_lines(output, error))
+            expected, actual = answers
+            if expected == actual:
+                same += 1
+            else:
+                mismatches.append((repo, commit, file, slicetype, lines, expected, actual))
+
+    print('{} queries, jar {:.2f}s, server {:.2f}s'.format(same + len(mismatches), elapsed[0], elapsed[1]))
+    print('same {}, different {}'.format(same, len(mismatches)))
+    for mismatch in mismatches:
+        print('mismatch {}'.format(mismatch))
+    return len(mismatches) == 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares the slices of SlicerServer.java with the repoman jar')
+    parser.add_argument('--dataset', default=os.path.join(DATA_FOLDER, 'combined_output.csv'))
+    parser.add_argument('--limit', type=int)
+    args = parser.parse_args()
+    sys.exit(0 if compare(build_corpus(args.dataset, args.limit)) else 1)
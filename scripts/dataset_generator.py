@@ -1,5 +1,15 @@
-import os, csv, sys, re, json
-from scripts.slicer_wrapper import Slicer
+import os, csv, sys, json, time, itertools, functools, argparse, logging
+from scripts.slicer_wrapper import Slicer, CACHE_FOLDER
+from scripts.checkpoint import CheckpointJournal, row_key, shard_of, shard_filename, ERROR_RESULT
+from scripts.intermediate_store import IntermediateStore, SIDES
+from scripts.dataset_model import build_model, Finding
+from scripts.alerts_index import AlertsIndex, AlertsView, ALERTS_INDEX_FILE
+from scripts.fingerprints import fingerprint
+from scripts.metrics import metrics, stage, SLOWEST_ROWS
+from scripts.lines import parse_lines, encode_lines, format_lines, mapping_to_array, map_lines, difference, line_base
+from scripts.scheduler import CostScheduler, worker_count
+from scripts.work_queue import open_queue, work, TaskError, POLL_SECONDS
+from scripts.merge_join import combine_key, external_sort, unique_by, merge_join, grouped, SortedCursor
 from multiprocessing.pool import Pool
 
 cwd = os.path.dirname(__file__)
@@ -10,225 +20,158 @@ INPUT_GROUND_TRUTH = os.path.join(DATA_FOLDER, 'ground_truth.csv')
 TOOL_ALERTS_FOLDER = os.path.join(DATA_FOLDER, 'tool_alerts')
 
 OUTPUT_TABLE_FILE = os.path.join(DATA_FOLDER, 'tomcat_dataset_no_slice.csv')
+INTERMEDIATE_STORE = os.path.join(DATA_FOLDER, 'tomcat_dataset_no_slice.sqlite')
 OUTPUT_JSON_FILE = os.path.join(DATA_FOLDER, 'tomcat_dataset.json')
 AUGMENTED_DATASET = os.path.join(DATA_FOLDER, 'alerts-dataset.csv')
+COMBINED_HEADER = ['project', 'repo', 'commit', 'vuln_id', 'vul_or_fix', 'tool', 'file', 'LoC_vuln',
+                   'LoC_sliced_lightweight', 'LoC_sliced_pessimist']
+COMBINE_BATCH = 2000
+SEED_LINE_COST = 256  # bytes of source one seed line weighs as when estimating slicing work
+
+logger = logging.getLogger(__name__)
 
 
 class DatasetGenerator:
-    def __init__(self, input_revisions=INPUT_REVISIONS, input_ground_truth=INPUT_GROUND_TRUTH):
+    def __init__(self, input_revisions=INPUT_REVISIONS, input_ground_truth=INPUT_GROUND_TRUTH,
+                 intermediate_store=INTERMEDIATE_STORE, line_mapper='lhdiff', alerts_folder=TOOL_ALERTS_FOLDER,
+                 cache_folder=CACHE_FOLDER, remote=False):
         self.input_revisions_file = input_revisions
         self.input_ground_truth_file = input_ground_truth
-        self.slicer = Slicer()
-
-    def load_data_from(self, file_name, delimiter=','):
-        print('Loading data from {}'.format(file_name))
-        content = []
-        try:
-            with open(file_name, 'r', encoding='utf8') as f_in:
-                reader = csv.reader(f_in, delimiter=delimiter)
-                for line in reader:
-                    content.append(line)
-                print('Data from {} was successfully loaded'.format(file_name))
-        except OSError as e:
-            print('I cannot locate file {}'.format(file_name))
-            print(str(e))
-        except Exception as e:
-            print('An exception happened, while reading data from {}'.format(file_name))
-            print(str(e))
-        return content
-
-    def build_dictionary(self, file_name, key_columns, delimiter=',', columns_to_extract=None, title_row='True'):
-        print('Building dictionary for {}'.format(file_name))
-        dict_to_return = dict()
-        data = self.load_data_from(file_name, delimiter=delimiter)
-        # ground_truth = self.load_data_from(self.input_ground_truth_file, delimiter=';')
-        counter = 0
-        for row in data:
-            if title_row and counter < 1:
-                counter += 1
-                continue
-
-            tmp_key = []
-            for key_column in key_columns:
-                tmp_key.append(row[key_column])
-            key = '_'.join(tmp_key)
-            if not key in dict_to_return:
-                dict_to_return[key] = []
-            if columns_to_extract is None:
-                dict_to_return[key].append(row)
-            else:
-                tmp = []
-                for item in columns_to_extract:
-                    tmp.append(row[item])
-                dict_to_return[key].append(tmp)
-        print('Dictionary for {} was successfully built'.format(file_name))
-        return dict_to_return
-
-    def combine_revisions_ground_truth(self, clean_filenames=True):
-        dict_revisions = self.build_dictionary(self.input_revisions_file, key_columns=[0, 3],
-                                               columns_to_extract=[0, 1, 2, 3])
-        dict_ground_truth = self.build_dictionary(self.input_ground_truth_file, delimiter=';', key_columns=[0, 1],
-                                                  columns_to_extract=[2, 3])
-        if clean_filenames:
-            for key in dict_ground_truth:
-                for i in range(len(dict_ground_truth[key])):
-                    dict_ground_truth[key][i][0] = dict_ground_truth[key][i][0].strip()
-                    dict_ground_truth[key][i][0] = re.sub(r'\\', '/', dict_ground_truth[key][i][0])
-                    if dict_ground_truth[key][i][0].startswith('/'):
-                        dict_ground_truth[key][i][0] = dict_ground_truth[key][i][0][1:]
-                    if dict_ground_truth[key][i][0].startswith('org/'):
-                        dict_ground_truth[key][i][0] = 'java/{}'.format(dict_ground_truth[key][i][0])
-
-        dict_combined = dict()
-        for key in dict_revisions:
-            try:
-                dict_combined[key] = dict_revisions[key]
-                dict_combined[key].append(dict_ground_truth[key])
-            except Exception as e:
-                print(
-                    '[SKIPPING] An exception happened, while trying to merge {} for revisions and ground truth'.format(
-                        key))
-                print(str(e))
-                dict_combined[key].append([])
-        return dict_combined
-
-    def get_alerts_dict(self, vuln=True, alerts_folder=TOOL_ALERTS_FOLDER, clean_spotted_filenames=True):
-        alerts_dict = dict()
-        if vuln:
-            start_folder = os.path.join(alerts_folder, 'vuln')
-            filename_end = '_out.csv'
-        else:
-            start_folder = os.path.join(alerts_folder, 'fix')
-            filename_end = '_out_fix.csv'
-        for path, dirs, filenames in os.walk(start_folder):
-            for filename in filenames:
-                if filename.endswith(filename_end):
-                    tool_name = os.path.basename(path)
-                    project_id = os.path.basename(os.path.dirname(path))
-                    vuln_id = filename.split(filename_end)[0]
-
-                    key = '{}_{}'.format(project_id, vuln_id)
-                    if not key in alerts_dict:
-                        alerts_dict[key] = dict()
-                    if not tool_name in alerts_dict[key]:
-                        alerts_dict[key][tool_name] = []
-                    alerts_dict[key][tool_name] = self.load_data_from(os.path.join(path, filename), delimiter=';')
-                    if clean_spotted_filenames:
-                        for i in range(len(alerts_dict[key][tool_name])):
-                            try:
-                                alerts_dict[key][tool_name][i][2] = alerts_dict[key][tool_name][i][2].strip()
-                                alerts_dict[key][tool_name][i][2] = re.sub(r'\\', '/',
-                                                                           alerts_dict[key][tool_name][i][2])
-                                if alerts_dict[key][tool_name][i][2].startswith('/'):
-                                    alerts_dict[key][tool_name][i][2] = alerts_dict[key][tool_name][i][2][1:]
-                                if alerts_dict[key][tool_name][i][2].startswith('org/'):
-                                    alerts_dict[key][tool_name][i][2] = 'java/{}'.format(
-                                        alerts_dict[key][tool_name][i][2])
-                            except Exception as e:
-                                print(
-                                    'An exception occurred, while cleaning filename for {} {} {}'.format(key, tool_name,
-                                                                                                         alerts_dict[
-                                                                                                             key][
-                                                                                                             tool_name][
-                                                                                                             i]))
-                                print(str(e))
-                                continue
-        return alerts_dict
-
-    def combine_revisions_gtf_alerts(self, vuln=True):  # Set vuln=False to calculate for fix
-        revisions_gtf_dict = self.combine_revisions_ground_truth()
-        alerts_dict = self.get_alerts_dict(vuln=vuln)
-        final_dict = dict()
-        for key in revisions_gtf_dict:
-            if not key in final_dict:
-                final_dict[key] = []
-            final_dict[key].extend(revisions_gtf_dict[key])
-            try:
-                final_dict[key].append(alerts_dict[key])
-            except Exception as e:
-                print('An exception occured, while trying to combine revisions_gtf information with alerts information')
-                print(str(e))
-                final_dict[key].append(dict())
+        self.alerts_folder = alerts_folder
+        self.slicer = Slicer(cache_folder=cache_folder, line_mapper=line_mapper, remote=remote)
+        self.store = IntermediateStore(intermediate_store)
+        self.lines_mappings = dict()
+        self.ground_truths = dict()
+        self.alerts_index = None
+
+    def get_alerts_dict(self, vuln=True, alerts_folder=None, clean_spotted_filenames=True):
+        # Lazy {project_vuln: {tool: [rows]}} backed by the alerts index, which is brought up to date once per
+        # side and run and only rereads the alert files that changed since it was built
+        if alerts_folder is None:
+            alerts_folder = self.alerts_folder
+        if self.alerts_index is None or self.alerts_index.alerts_folder != alerts_folder:
+            self.alerts_index = AlertsIndex(alerts_folder, os.path.join(self.slicer.cache_folder, ALERTS_INDEX_FILE))
+        return AlertsView(self.alerts_index, 'vuln' if vuln else 'fix', clean_filenames=clean_spotted_filenames)
+
+    def key_fingerprint(self, side, key, inputs):
+        # Inputs of the rows of one key: its revision rows and ground truth rows, then the hashes of its alert files
+        return fingerprint(inputs, self.alerts_index.hashes(side, key))
+
+    def build_model(self):
+        with metrics.timer('csv_read'):
+            return build_model(self.input_revisions_file, self.input_ground_truth_file)
+
+    def key_rows(self, revision_row, ground_truth, alerts):
+        # Table rows of one key on one side: a ground_truth row per changed file, then every finding of every tool
+        rows = []
+        for file in ground_truth:
+            rows.append(revision_row + ['ground_truth', file, encode_lines(ground_truth[file])])
+        for tool in alerts:
+            for finding in alerts[tool]:
+                rows.append(Finding.from_alert(tool, finding).as_row(revision_row))
+        return rows
+
+    def get_ground_truth_pair(self, repo, commit):
+        # Diff of a fix commit against its parent, unless it was computed already by the workers of distribute
+        if (repo, commit) in self.ground_truths:
+            return self.ground_truths[(repo, commit)]
+        return self.slicer.get_ground_truth_pair(repo=repo, commit_old='{}^'.format(commit), commit_new=commit)
+
+    def build_tables(self, model, sides, incremental=True):
+        # {side: (rows, row fingerprints)} for the given sides out of one walk over the model: the ground truth diff
+        # of a key runs once for all sides. With incremental=True the rows of keys whose fingerprint did not change
+        # are taken over from the store instead of being computed again.
+        alerts = dict((side, self.get_alerts_dict(vuln=side == 'vuln')) for side in sides)
+        stored_fingerprints = dict()
+        stored_rows = dict()
+        for side in sides:
+            stored_fingerprints[side] = self.store.key_fingerprints(side) if incremental else dict()
+            stored_rows[side] = dict()
+            if len(stored_fingerprints[side]) > 0:
+                for row in self.store.read_rows(side):
+                    stored_rows[side].setdefault((row[0], row[3]), []).append(row)
+        tables = dict((side, ([], [])) for side in sides)
+        recomputed = dict((side, 0) for side in sides)
+        count = 0
+        for key, record in model.items():
+            count += 1
+            inputs = record.inputs()
+            project_vuln = record.project_vuln
+            to_compute = []
+            for side in sides:
+                table_rows, row_fingerprints = tables[side]
+                key_fingerprint = self.key_fingerprint(side, key, inputs)
+                if stored_fingerprints[side].get(project_vuln) == key_fingerprint and \
+                        project_vuln in stored_rows[side]:
+                    table_rows.extend(stored_rows[side][project_vuln])
+                    row_fingerprints.extend([key_fingerprint] * len(stored_rows[side][project_vuln]))
+                    metrics.count('table.keys_reused')
+                else:
+                    to_compute.append((side, key_fingerprint))
+            if len(to_compute) == 0:
                 continue
-        return final_dict
-
-    def final_dict_as_table(self, output_table=OUTPUT_TABLE_FILE, vuln=True):
-        final_dict = self.combine_revisions_gtf_alerts(vuln=vuln)
-        if vuln:
-            output = '{}_vuln.csv'.format(output_table.split('.csv')[0])
-            commit_add = '^'
-        else:
-            output = '{}_fix.csv'.format(output_table.split('.csv')[0])
-            commit_add = ''
+            key_start = time.perf_counter()
+            logger.debug('Processing key %s (%d out of %d - %s)', key, count, len(model), sides)
+            revision = record.revisions[0]
+            gt = self.get_ground_truth_pair(revision.repo, revision.commit)
+            for side, key_fingerprint in to_compute:
+                recomputed[side] += 1
+                metrics.count('table.keys_recomputed')
+                if isinstance(gt, str):
+                    continue
+                table_rows, row_fingerprints = tables[side]
+                key_alerts = alerts[side].get(key)
+                rows = self.key_rows(revision.as_row(), gt[0] if side == 'vuln' else gt[1],
+                                     dict() if key_alerts is None else key_alerts)
+                table_rows.extend(rows)
+                row_fingerprints.extend([key_fingerprint] * len(rows))
+            metrics.row('table {} {}'.format('/'.join(sides), key), time.perf_counter() - key_start)
+        for side in sides:
+            logger.info('%d rows for the %s revisions, %d out of %d keys recomputed', len(tables[side][0]), side,
+                        recomputed[side], len(model))
+        return tables
+
+    def write_table(self, side, table_rows, row_fingerprints, output_table=OUTPUT_TABLE_FILE, export_csv=False):
+        with metrics.timer('store_write'):
+            self.store.write_rows(side, table_rows, row_fingerprints)
+        logger.info('%d rows for the %s revisions stored in %s', len(table_rows), side, self.store.db_file)
+        if not export_csv:
+            return
+        output = '{}_{}.csv'.format(output_table.split('.csv')[0], side)
         try:
             with open(output, 'w', newline='', encoding='utf8') as f_out:
                 writer = csv.writer(f_out, delimiter=';')
                 roww = ['project', 'repo', 'commit', 'vuln_id', 'tool', 'file', 'lines', 'lines_sliced_li',
                         'lines_sliced_pess']
                 writer.writerow(roww)
-                count = 0
-                for key in final_dict:
-                    count += 1
-                    print('Processing key {} ({} out of {} - {}'.format(key, count, len(final_dict), vuln))
-                    checkouted = False
-                    slice_error = False
-
-                    gt = self.slicer.get_ground_truth(repo=final_dict[key][0][1],
-                                                      commit_old='{}^'.format(final_dict[key][0][2]),
-                                                      commit_new=final_dict[key][0][2], vuln_revision=vuln)
-                    if 'error' in gt:
-                        # print('An error occured, while calculating ground truth for {}'.format(final_dict[key]))
-                        continue
-                    for file in gt:
-                        roww = []
-                        roww.extend(final_dict[key][0])
-                        roww.append('ground_truth')
-                        roww.append(file)
-                        roww.append(str(gt[file]))
-                        # try:
-                        #     # roww.append(self.slicer.get_slice(repo=roww[1], path=file, lines=str(gt[file]), commit='{}{}'.format(roww[2], commit_add), checkouted=checkouted, slicetype='lightweight'))
-                        #     # roww.append(self.slicer.get_slice(repo=roww[1], path=file, lines=str(gt[file]),
-                        #     #                                   commit='{}{}'.format(roww[2], commit_add),
-                        #     #                                   checkouted=checkouted, slicetype='pessimist'))
-                        #     checkouted = True
-                        # except Exception as e:
-                        #     print(str(e))
-                        #     # roww.append('')
-                        #     # roww.append('')
-                        #     slice_error = True
-                        writer.writerow(roww)
-                    # break
-                    for tool in final_dict[key][2]:
-                        for finding in final_dict[key][2][tool]:
-                            roww = []
-                            roww.extend(final_dict[key][0])
-                            roww.append(tool)
-                            roww.extend(finding[2:])
-                            # try:
-                            #     if not slice_error:
-                            #         if tool == 'Tool_A':
-                            #             start_index = 0
-                            #         else:
-                            #             start_index = 1
-                            #         # roww.append(self.slicer.get_slice(repo=roww[1], path=roww[5], lines=roww[6],
-                            #         #                               commit='{}{}'.format(roww[2], commit_add),
-                            #         #                               checkouted=checkouted, slicetype='lightweight',
-                            #         #                               starting_index=start_index))
-                            #         # roww.append(self.slicer.get_slice(repo=roww[1], path=roww[5], lines=roww[6],
-                            #         #                                   commit='{}{}'.format(roww[2], commit_add),
-                            #         #                                   checkouted=checkouted, slicetype='pessimist',
-                            #         #                                   starting_index=start_index))
-                            #         checkouted = True
-                            #     else:
-                            #         roww.append('')
-                            #         roww.append('')
-                            # except Exception as e:
-                            #     print(str(e))
-                            #     roww.append('')
-                            writer.writerow(roww)
+                writer.writerows(table_rows)
         except OSError as e:
-            print('An error occurred, while trying to create file {} for writing'.format(output_table))
-            print(e)
+            logger.error('An error occurred, while trying to create file %s for writing', output_table)
+            logger.error(str(e))
+
+    @stage('final_dict_as_table')
+    def final_dict_as_table(self, output_table=OUTPUT_TABLE_FILE, vuln=True, export_csv=False, incremental=True):
+        # The table goes to the intermediate store, export_csv=True also writes the old _vuln/_fix.csv file.
+        # Every row is stored with the fingerprint of its key's inputs, with incremental=True the rows of keys
+        # whose fingerprint did not change are taken over from the store instead of being computed again.
+        side = 'vuln' if vuln else 'fix'
+        # The store keeps the first seven columns only, the CSV export needs all of them computed
+        tables = self.build_tables(self.build_model(), [side], incremental=incremental and not export_csv)
+        self.write_table(side, tables[side][0], tables[side][1], output_table=output_table, export_csv=export_csv)
+
+    @stage('generate_tables')
+    def generate_tables(self, common_output=None, WORKERS=7, output_table=OUTPUT_TABLE_FILE, export_csv=False,
+                        incremental=True):
+        # Single pass over the inputs for both sides: the revisions and ground truth are read into one model, the
+        # ground truth diff of every key runs once, and both tables are built in the same walk. With common_output
+        # the combined dataset is then made from the tables in memory instead of reloading them from the store.
+        tables = self.build_tables(self.build_model(), SIDES, incremental=incremental and not export_csv)
+        for side in SIDES:
+            self.write_table(side, tables[side][0], tables[side][1], output_table=output_table,
+                             export_csv=export_csv)
+        if common_output is not None:
+            self.combine_final_dataset_file(common_output, WORKERS=WORKERS, incremental=incremental,
+                                            tables=dict((side, tables[side][0]) for side in SIDES))
 
     def load_dict_output(self, output_file):
         # roww = ['project', 'repo', 'commit', 'vuln_id', 'tool', 'file', 'lines', 'lines_sliced']
@@ -239,163 +182,640 @@ class DatasetGenerator:
                 if line[0] == 'project':
                     continue
                 key = '{}_{}_{}_{}'.format(line[0], line[3], line[4], line[5])
+                if len(line) > 6:
+                    line[6] = parse_lines(line[6])
                 to_return[key] = line
         return to_return
 
+    def encoded_dict_output(self, dict_output):
+        # Line arrays back in their compact text form, for the JSON dumps
+        to_return = dict()
+        for key in dict_output:
+            line = list(dict_output[key])
+            if len(line) > 6:
+                line[6] = encode_lines(line[6])
+            to_return[key] = line
+        return to_return
+
     def get_lines_mapping(self, repo, commit_new, file_old, file_new, start_index, reversed=False):
+        request = (repo, commit_new, file_old, file_new, start_index, reversed)
+        if request in self.lines_mappings:
+            return self.lines_mappings[request]
         return self.slicer.get_line_mapping(repo, commit_new, file_old, file_new, start_index=start_index,
                                             reversed=reversed)
 
+    def _mapping_helper(self, request):
+        repo, commit_new, file_old, file_new, start_index, reversed = request
+        mapping = self.slicer.get_line_mapping(repo, commit_new, file_old, file_new, start_index=start_index,
+                                               reversed=reversed)
+        return request, mapping, metrics.drain()
+
+    def prefetch_lines_mappings(self, requests, WORKERS=7, pool=None):
+        # Every mapping works in its own scratch folder, so they can all be computed in parallel up front.
+        # A pool can be passed in by callers that prefetch several times.
+        requests = list(dict.fromkeys(requests))
+        logger.info('Computing %d line mappings with %d workers', len(requests), WORKERS)
+        if WORKERS <= 1:
+            for request, mapping, snapshot in map(self._mapping_helper, requests):
+                self.lines_mappings[request] = mapping
+            return
+        if pool is None:
+            with Pool(processes=WORKERS) as pool:
+                return self.prefetch_lines_mappings(requests, WORKERS=WORKERS, pool=pool)
+        for request, mapping, snapshot in pool.imap_unordered(self._mapping_helper, requests, chunksize=4):
+            self.lines_mappings[request] = mapping
+            metrics.merge(snapshot)
+
+    def prefetch_remote_files(self, revisions_paths):
+        # With a remote slicer every file a stage reads is downloaded concurrently before its workers start
+        if not self.slicer.remote:
+            return
+        self.slicer.prefetch_remote(list(revisions_paths))
+
+    def mapping_files(self, requests):
+        for repo, commit_new, file_old, file_new, start_index, reversed in requests:
+            commit_old, commit_new = self.slicer.line_mapping_revisions(repo, commit_new, reversed)
+            yield repo, commit_old, file_old
+            yield repo, commit_new, file_new
+
     def get_filtered_lines(self, line_mapping, lines_old, lines_new):
-        filtered_lines = []
-        converted_lines = []
+        # Lines of lines_old that no line of lines_new is mapped onto, as a sorted array
+        lines_old = parse_lines(lines_old)
+        lines_new = parse_lines(lines_new)
         if line_mapping == 'equals':
             converted_lines = lines_new
         else:
-            for line in lines_new:
-                try:
-                    converted_lines.append(line_mapping[line])
-                except Exception as e:
-                    print('Line {} was not found in the mapping'.format(line))
-                    print(str(e))
-        for line in lines_old:
-            if line not in converted_lines:
-                filtered_lines.append(line)
-        return filtered_lines
-
-    def combine_final_dataset_file(self, common_output, WORKERS=7):
-        dict_vuln_pess = self.load_dict_output('{}_vuln.csv'.format(OUTPUT_TABLE_FILE.split('.csv')[0]))
-        dict_fix_pess = self.load_dict_output('{}_fix.csv'.format(OUTPUT_TABLE_FILE.split('.csv')[0]))
-
-        with open(os.path.join(DATA_FOLDER, 'dict_vuln.json'), 'w') as f_json:
-            json.dump(dict_vuln_pess, f_json)
+            if isinstance(line_mapping, dict):
+                line_mapping = mapping_to_array(line_mapping)
+            converted_lines, unmapped = map_lines(line_mapping, lines_new)
+            if unmapped > 0:
+                logger.debug('%d out of %d lines were not found in the mapping', unmapped, len(lines_new))
+                metrics.count('lines.unmapped', unmapped)
+        return difference(lines_old, converted_lines)
+
+    def load_revision_table(self, side, **filters):
+        # From the intermediate store, or from the _vuln/_fix.csv file of runs that predate it
+        if self.store.has_side(side):
+            with metrics.timer('store_read'):
+                return self.store.load_dict(side, **filters)
+        to_return = dict()
+        for row in self.read_revision_csv(side, **filters):
+            to_return['{}_{}_{}_{}'.format(row[0], row[3], row[4], row[5])] = row
+        return to_return
 
-        with open(os.path.join(DATA_FOLDER, 'dict_fix.json'), 'w') as f_json:
-            json.dump(dict_fix_pess, f_json)
+    def table_dict(self, rows, **filters):
+        # Same shape as load_revision_table, out of table rows whose lines are parsed in place
+        columns = {'project': 0, 'vuln_id': 3, 'tool': 4, 'file': 5}
+        filters = [(columns[column], value) for column, value in filters.items() if value is not None]
+        to_return = dict()
+        for row in rows:
+            if any(row[column] != value for column, value in filters):
+                continue
+            if len(row) > 6:
+                row[6] = parse_lines(row[6])
+            to_return['{}_{}_{}_{}'.format(row[0], row[3], row[4], row[5])] = row
+        return to_return
 
+    def read_revision_csv(self, side, **filters):
+        # Rows of the _vuln/_fix.csv table matching the filters, one at a time
+        columns = {'project': 0, 'vuln_id': 3, 'tool': 4, 'file': 5}
+        filters = [(columns[column], value) for column, value in filters.items() if value is not None]
+        with open('{}_{}.csv'.format(OUTPUT_TABLE_FILE.split('.csv')[0], side), 'r') as f_in:
+            for line in csv.reader(f_in, delimiter=';'):
+                if line[0] == 'project':
+                    continue
+                if any(line[column] != value for column, value in filters):
+                    continue
+                if len(line) > 6:
+                    line[6] = parse_lines(line[6])
+                yield line
+
+    def load_combined_rows(self, common_output):
+        # (project, vuln_id) -> rows of a previously written combined dataset
+        rows = dict()
+        if not os.path.exists(common_output):
+            return rows
+        with metrics.timer('csv_read'), open(common_output, 'r', encoding='utf8', newline='') as f_in:
+            reader = csv.reader(f_in, delimiter=';')
+            next(reader, None)
+            for line in reader:
+                rows.setdefault((line[0], line[3]), []).append(line)
+        return rows
+
+    def combined_fingerprints(self, project_vulns, filters):
+        # A (project, vuln_id) of the combined dataset depends on its vuln and fix rows and on the line mapper
+        vuln_fingerprints = self.store.key_fingerprints('vuln')
+        fix_fingerprints = self.store.key_fingerprints('fix')
+        fingerprints = dict()
+        for project_vuln in project_vulns:
+            if project_vuln in vuln_fingerprints and project_vuln in fix_fingerprints:
+                fingerprints[project_vuln] = fingerprint(vuln_fingerprints[project_vuln],
+                                                         fix_fingerprints[project_vuln], self.slicer.line_mapper,
+                                                         sorted(filters.items()))
+        return fingerprints
+
+    def pair_mapping_requests(self, fix_row, vuln_row):
+        # The two line mappings the fix and vuln rows of one key are filtered with
+        if fix_row[4] == 'ground_truth':
+            return []
+        start_index = line_base(fix_row[4])
+        return [(fix_row[1], fix_row[2], fix_row[5], vuln_row[5], start_index, True),
+                (vuln_row[1], vuln_row[2], vuln_row[5], fix_row[5], start_index, False)]
+
+    def combined_rows(self, fix_row, vuln_row):
+        # Output rows of one key: the fix row then the vuln row, each keeping the lines that are not found on the
+        # other side once mapped there. Rows whose mapping failed are left out.
+        rows = []
+        for side, row, other, reversed in [('fix', fix_row, vuln_row, True), ('vuln', vuln_row, fix_row, False)]:
+            roww = row[:4]
+            roww.append(side)
+            roww.append(row[4])
+            roww.append(row[5])
+            if row[4] == 'ground_truth':
+                roww.append(format_lines(row[6]))
+                roww.extend(row[7:])
+                rows.append(roww)
+                continue
+            start_index = line_base(fix_row[4])
+            lines_mapping = self.get_lines_mapping(row[1], row[2], row[5], other[5], start_index=start_index,
+                                                   reversed=reversed)
+            if not 'error' in lines_mapping:
+                lines_filtered = self.get_filtered_lines(lines_mapping, row[6], other[6])
+                roww.append(format_lines(lines_filtered))
+                rows.append(roww)
+        return rows
+
+    @stage('combine_final_dataset_file')
+    def combine_final_dataset_file(self, common_output, WORKERS=7, dump_json=False, incremental=True, streaming=False,
+                                   tables=None, **filters):
+        # filters (project, vuln_id, tool) restrict the combination to the matching rows of both tables.
+        # With incremental=True the rows of every (project, vuln_id) whose inputs kept their fingerprint since
+        # the previous run are copied from the previous output instead of being mapped again.
+        # streaming=True joins the tables in key order in bounded memory, see combine_streaming.
+        # tables={side: rows} combines rows already in memory instead of loading them from the store.
+        if streaming:
+            if dump_json:
+                raise ValueError('dump_json needs both tables in memory, it cannot be used with streaming=True')
+            return self.combine_streaming(common_output, WORKERS=WORKERS, incremental=incremental, **filters)
+        if tables is None:
+            dict_vuln_pess = self.load_revision_table('vuln', **filters)
+            dict_fix_pess = self.load_revision_table('fix', **filters)
+        else:
+            dict_vuln_pess = self.table_dict(tables['vuln'], **filters)
+            dict_fix_pess = self.table_dict(tables['fix'], **filters)
+
+        output_name = os.path.abspath(common_output)
+        fingerprints = self.combined_fingerprints(set((row[0], row[3]) for row in dict_fix_pess.values()), filters)
+        reusable = set()
+        previous_rows = dict()
+        if incremental:
+            previous_fingerprints = self.store.output_fingerprints(output_name)
+            if len(previous_fingerprints) > 0:
+                previous_rows = self.load_combined_rows(common_output)
+            reusable = set(project_vuln for project_vuln, key_fingerprint in fingerprints.items()
+                           if previous_fingerprints.get('{}_{}'.format(*project_vuln)) == key_fingerprint and
+                           project_vuln in previous_rows)
+        logger.info('%d out of %d CVEs taken over from %s', len(reusable), len(fingerprints), common_output)
+        metrics.count('combine.cves_reused', len(reusable))
+
+        if dump_json:
+            with open(os.path.join(DATA_FOLDER, 'dict_vuln.json'), 'w') as f_json:
+                json.dump(self.encoded_dict_output(dict_vuln_pess), f_json)
+
+            with open(os.path.join(DATA_FOLDER, 'dict_fix.json'), 'w') as f_json:
+                json.dump(self.encoded_dict_output(dict_fix_pess), f_json)
+
+        mapping_requests = []
+        for key in dict_fix_pess:
+            if key not in dict_vuln_pess:
+                continue
+            if (dict_fix_pess[key][0], dict_fix_pess[key][3]) in reusable:
+                continue
+            mapping_requests.extend(self.pair_mapping_requests(dict_fix_pess[key], dict_vuln_pess[key]))
+        mapping_requests = [request for request in dict.fromkeys(mapping_requests) if request not in self.lines_mappings]
+        self.prefetch_remote_files(self.mapping_files(mapping_requests))
+        self.prefetch_lines_mappings(mapping_requests, WORKERS=WORKERS)
 
         with open(common_output, 'w', newline='', encoding='utf8') as f_out:
             writer = csv.writer(f_out, delimiter=';')
-            roww = 'project; repo; commit; vuln_id; vul_or_fix; tool; file; LoC_vuln; LoC_sliced_lightweight; LoC_sliced_pessimist'.split(
-                '; ')
-            writer.writerow(roww)
+            writer.writerow(COMBINED_HEADER)
             total = len(dict_fix_pess)
             count = 0
+            copied = set()
 
             for key in dict_fix_pess:
                 count += 1
+                project_vuln = (dict_fix_pess[key][0], dict_fix_pess[key][3])
+                if project_vuln in reusable:
+                    if project_vuln not in copied:
+                        writer.writerows(previous_rows[project_vuln])
+                        copied.add(project_vuln)
+                    continue
                 if key in dict_vuln_pess:
-                    print('Processing key {} ({} out of {})'.format(key, count, total))
-                    roww = dict_fix_pess[key][:4]
-                    roww.append('fix')
-                    roww.append(dict_fix_pess[key][4])
-                    roww.append(dict_fix_pess[key][5])
-                    if dict_fix_pess[key][4] == 'ground_truth':
-                        roww.extend(dict_fix_pess[key][6:])
-                        writer.writerow(roww)
-                    else:
-                        start_index = 1
-                        if dict_fix_pess[key][4] in ['Tool_A', 'Tool_B']:
-                            start_index = 0
-                        lines_mapping = self.get_lines_mapping(dict_fix_pess[key][1], dict_fix_pess[key][2],
-                                                               dict_fix_pess[key][5], dict_vuln_pess[key][5],
-                                                               start_index=start_index, reversed=True)
-
-                        if not 'error' in lines_mapping:
-                            lines_old = re.sub(r"['\[\]]", '', dict_fix_pess[key][6]).split(', ')
-                            lines_new = re.sub(r"['\[\]]", '', dict_vuln_pess[key][6]).split(', ')
-                            lines_filtered = self.get_filtered_lines(lines_mapping, lines_old, lines_new)
-                            roww.append(str(lines_filtered))
-                            # roww.append(self.slicer.get_slice(repo=roww[1], path=roww[5], lines=lines_filtered,
-                            #                                   commit=dict_fix_pess[key][2],
-                            #                                   checkouted=False, slicetype='lightweight',
-                            #                                   starting_index=1))
-                            # roww.append(self.slicer.get_slice(repo=roww[1], path=roww[5], lines=lines_filtered,
-                            #                                   commit='{}{}'.format(roww[2], dict_fix_pess[key][2]),
-                            #                                   checkouted=True, slicetype='pessimist',
-                            #                                   starting_index=1))
-                            if len(roww) < 8:
-                                print(roww)
-                            writer.writerow(roww)
-
-                    roww = dict_vuln_pess[key][:4]
-                    roww.append('vuln')
-                    roww.append(dict_vuln_pess[key][4])
-                    roww.append(dict_vuln_pess[key][5])
-                    if dict_vuln_pess[key][4] == 'ground_truth':
-                        roww.extend(dict_vuln_pess[key][6:])
-                        writer.writerow(roww)
-                    else:
-                        start_index = 1
-                        if dict_fix_pess[key][4] in ['Tool_A', 'Tool_B']:
-                            start_index = 0
-                        lines_mapping = self.get_lines_mapping(dict_vuln_pess[key][1], dict_vuln_pess[key][2],
-                                                               dict_vuln_pess[key][5], dict_fix_pess[key][5],
-                                                               start_index)
-                        if not 'error' in lines_mapping:
-                            lines_old = re.sub(r"['\[\]]", '', dict_fix_pess[key][6]).split(', ')
-                            lines_new = re.sub(r"['\[\]]", '', dict_vuln_pess[key][6]).split(', ')
-
-                            lines_filtered = self.get_filtered_lines(lines_mapping, lines_new, lines_old)
-                            roww.append(str(lines_filtered))
-                            if len(roww) < 8:
-                                print(roww)
-                            writer.writerow(roww)
-
-    def _augment_helper(self, line):
-        with open(AUGMENTED_DATASET, 'a', newline='', encoding='utf8') as f_out:
-            writer = csv.writer(f_out, delimiter=';')
-            print('Processing line {}'. format(line))
-            # project;repo;commit;vuln_id;vul_or_fix;tool;file;LoC_vuln;LoC_sliced_lightweight;LoC_sliced_pessimist
-            if line[0] == 'project':
-                writer.writerow(line)
+                    logger.debug('Processing key %s (%d out of %d)', key, count, total)
+                    key_start = time.perf_counter()
+                    writer.writerows(self.combined_rows(dict_fix_pess[key], dict_vuln_pess[key]))
+                    metrics.row('combine {}'.format(key), time.perf_counter() - key_start)
+
+        self.store.set_output_fingerprints(output_name, dict(('{}_{}'.format(*project_vuln), key_fingerprint)
+                                                             for project_vuln, key_fingerprint in fingerprints.items()))
+
+    def sorted_revision_rows(self, side, work_folder, **filters):
+        # Rows of one table in (project, vuln_id, tool, file) order, only the last of rows sharing a key like in
+        # load_revision_table. The store returns them sorted off its index, old CSV tables are sorted externally.
+        if self.store.has_side(side):
+            rows = self.store.read_rows(side, sorted_by_key=True, **filters)
+        else:
+            rows = external_sort(self.read_revision_csv(side, **filters), combine_key, folder=work_folder)
+        return unique_by(rows, combine_key)
+
+    def combine_streaming(self, common_output, WORKERS=7, incremental=True, batch_size=COMBINE_BATCH, **filters):
+        # Merge-join of the two tables sorted by (project, vuln_id, tool, file): at most batch_size key pairs are
+        # held at a time, their line mappings are computed together and their rows written before the next batch
+        # is read. The output is written in key order to a temporary file that replaces common_output at the end,
+        # so the rows of an earlier sorted output can be reused while it is read, also in key order.
+        output_name = os.path.abspath(common_output)
+        project_vulns = set()
+        if self.store.has_side('fix'):
+            project_vulns = self.store.project_vulns('fix', **filters)
+        fingerprints = self.combined_fingerprints(project_vulns, filters)
+        previous = SortedCursor([])
+        if incremental and len(self.store.output_fingerprints(output_name)) > 0 and os.path.exists(common_output):
+            previous_fingerprints = self.store.output_fingerprints(output_name)
+            fingerprints_kept = set(project_vuln for project_vuln, key_fingerprint in fingerprints.items()
+                                    if previous_fingerprints.get('{}_{}'.format(*project_vuln)) == key_fingerprint)
+            f_previous = open(common_output, 'r', encoding='utf8', newline='')
+            reader = csv.reader(f_previous, delimiter=';')
+            next(reader, None)
+            previous = SortedCursor(grouped(reader, lambda line: (line[0], line[3])))
+        else:
+            fingerprints_kept = set()
+            f_previous = None
+
+        pool = Pool(processes=WORKERS) if WORKERS > 1 else None
+        work_folder = os.path.dirname(output_name)
+        tmp_output = '{}.{}.tmp'.format(output_name, os.getpid())
+        count = 0
+        reused = set()
+        try:
+            with open(tmp_output, 'w', newline='', encoding='utf8') as f_out:
+                writer = csv.writer(f_out, delimiter=';')
+                writer.writerow(COMBINED_HEADER)
+                pairs = merge_join(self.sorted_revision_rows('fix', work_folder, **filters),
+                                   self.sorted_revision_rows('vuln', work_folder, **filters), combine_key)
+                while True:
+                    batch = list(itertools.islice(pairs, batch_size))
+                    if len(batch) == 0:
+                        break
+                    to_combine = []
+                    for fix_row, vuln_row in batch:
+                        project_vuln = (fix_row[0], fix_row[3])
+                        previous_rows = None
+                        if project_vuln in fingerprints_kept:
+                            previous_rows = previous.find(project_vuln)
+                        to_combine.append(previous_rows)
+                    mapping_requests = []
+                    for (fix_row, vuln_row), previous_rows in zip(batch, to_combine):
+                        if previous_rows is None:
+                            mapping_requests.extend(self.pair_mapping_requests(fix_row, vuln_row))
+                    self.prefetch_remote_files(self.mapping_files(dict.fromkeys(mapping_requests)))
+                    self.prefetch_lines_mappings(mapping_requests, WORKERS=WORKERS, pool=pool)
+                    for (fix_row, vuln_row), previous_rows in zip(batch, to_combine):
+                        count += 1
+                        project_vuln = (fix_row[0], fix_row[3])
+                        if previous_rows is not None:
+                            if project_vuln not in reused:
+                                writer.writerows(previous_rows)
+                                reused.add(project_vuln)
+                            continue
+                        key_start = time.perf_counter()
+                        writer.writerows(self.combined_rows(fix_row, vuln_row))
+                        metrics.row('combine {}'.format('_'.join(combine_key(fix_row))),
+                                    time.perf_counter() - key_start)
+                    self.lines_mappings = dict()
+                    logger.debug('%d keys combined', count)
+            os.replace(tmp_output, common_output)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            if f_previous is not None:
+                f_previous.close()
+            if os.path.exists(tmp_output):
+                os.remove(tmp_output)
+        logger.info('%d keys combined, %d out of %d CVEs taken over from %s', count, len(reused), len(fingerprints),
+                    common_output)
+        metrics.count('combine.cves_reused', len(reused))
+        self.store.set_output_fingerprints(output_name, dict(('{}_{}'.format(*project_vuln), key_fingerprint)
+                                                             for project_vuln, key_fingerprint in fingerprints.items()))
+
+    def group_rows_by_file(self, rows):
+        # (repo, commit, file) -> positions of the rows slicing that file, in order of appearance
+        groups = dict()
+        for i, line in enumerate(rows):
+            groups.setdefault((line[1], line[2], line[-2]), []).append(i)
+        return groups
+
+    def _augment_batch(self, blocks, task_budget=None):
+        # Runs in the pool workers on a batch of CVE blocks, their rows are handed back to the single writer in the
+        # parent process
+        return [self._augment_helper(block, task_budget) for block in blocks], metrics.drain()
+
+    def _augment_helper(self, block, task_budget=None):
+        # Slices the rows of one CVE. Rows slicing the same file at the same commit go to the slicer as one batch,
+        # so the file is parsed once for all of them. Once task_budget seconds are spent the remaining files are
+        # given up and their rows marked 'error file', so a rerun slices them again.
+        deadline = None if task_budget is None else time.monotonic() + task_budget
+        rows = [None] * len(block)
+        to_slice = []
+        positions = []
+        for i, (line, journalled) in enumerate(block):
+            if journalled is not None:
+                rows[i] = line + journalled
             else:
-                roww = line
-                starting_index = 1
-                if line[4] in ['Tool_A', 'Tool_B']:
-                    starting_index = 0
-                file = line[-2]
-                lines = line[-1]
-                roww.append(str(self.slicer.get_slice(repo=line[1], path=file, lines=lines, commit=line[2],
-                                                      slicetype='lightweight', starting_index=starting_index)))
-                roww.append(str(self.slicer.get_slice(repo=line[1], path=file, lines=lines, commit=line[2],
-                                                      slicetype='pessimist', starting_index=starting_index)))
-
-                writer.writerow(roww)
-
-    def augment_final_dataset_with_slices(self, input_dataset, WORKERS=4):
-            read_lines = []
-        # try:
-            with open(input_dataset, 'r', encoding='utf8', newline='') as f_in:
+                to_slice.append(line)
+                positions.append(i)
+
+        for (repo, commit, file), group in self.group_rows_by_file(to_slice).items():
+            if deadline is not None and time.monotonic() > deadline:
+                logger.warning('Time budget of %ss exceeded, %d rows of %s at %s left unsliced', task_budget,
+                               len(group), file, commit)
+                for i in group:
+                    rows[positions[i]] = to_slice[i] + ['error file', 'error file']
+                metrics.count('augment.rows_over_budget', len(group))
+                continue
+            logger.debug('Slicing %d rows of %s at %s', len(group), file, commit)
+            group_start = time.perf_counter()
+            # project;repo;commit;vuln_id;vul_or_fix;tool;file;LoC_vuln;LoC_sliced_lightweight;LoC_sliced_pessimist
+            requests = []
+            for i in group:
+                line = to_slice[i]
+                starting_index = line_base(line[5])
+                requests.append((line[-1], 'lightweight', starting_index))
+                requests.append((line[-1], 'pessimist', starting_index))
+            slices = self.slicer.get_slices_batch(repo, commit, file, requests)
+            for n, i in enumerate(group):
+                rows[positions[i]] = to_slice[i] + [str(slices[2 * n]), str(slices[2 * n + 1])]
+            metrics.count('augment.rows_sliced', len(group))
+            metrics.row('slice {} {} at {} ({} rows)'.format(to_slice[group[0]][0], file, commit, len(group)),
+                        time.perf_counter() - group_start)
+        metrics.count('augment.rows_journalled', len(block) - len(to_slice))
+        return rows
+
+    def block_cost(self, block):
+        # Estimated slicing work of one CVE: the size of every file it slices plus SEED_LINE_COST per seed line
+        to_slice = [line for line, journalled in block if journalled is None]
+        cost = 0
+        for (repo, commit, file), group in self.group_rows_by_file(to_slice).items():
+            cost += self.slicer.file_size(repo, commit, file)
+            cost += SEED_LINE_COST * sum(len(parse_lines(to_slice[i][-1])) for i in group)
+        return cost
+
+    def row_fingerprint(self, line):
+        # Slices of a combined row depend on the row itself and on the repoman build
+        return fingerprint(line, self.slicer.get_jar_sha())
+
+    def _blocks(self, reader, journal, shard):
+        # Lazily yields the consecutive rows of one CVE at a time, each with its journalled slices if any
+        block = []
+        for line in reader:
+            if shard is not None and shard_of(line, shard[1]) != shard[0]:
+                continue
+            if len(block) > 0 and (block[-1][0][0], block[-1][0][3]) != (line[0], line[3]):
+                yield block
+                block = []
+            block.append((line, journal.get(line, self.row_fingerprint(line))))
+        if len(block) > 0:
+            yield block
+
+    def slicing_files(self, input_dataset, journal, shard):
+        # (repo, commit, file) of every row of the input that still has to be sliced
+        with open(input_dataset, 'r', encoding='utf8', newline='') as f_in:
+            reader = csv.reader(f_in, delimiter=';')
+            next(reader, None)
+            for line in reader:
+                if shard is not None and shard_of(line, shard[1]) != shard[0]:
+                    continue
+                if journal.get(line, self.row_fingerprint(line)) is None:
+                    yield line[1], line[2], line[-2]
+
+    @stage('augment_final_dataset_with_slices')
+    def augment_final_dataset_with_slices(self, input_dataset, WORKERS=None, output_dataset=AUGMENTED_DATASET,
+                                          max_pending=None, journal_file=None, shard=None, task_budget=None):
+        # CVE blocks go to the pool through a CostScheduler, the most expensive first within every max_pending
+        # blocks read ahead and the cheap ones in batches. Their rows come back in input order and are written by
+        # this process only, so the output is the same on every run whatever the number of workers. WORKERS=None
+        # sizes the pool to the available cores and memory for the slicer JVMs.
+        # Finished rows are journalled next to the output with the fingerprint of their inputs, a rerun only slices
+        # the rows that are missing from the journal, changed since, or failed with 'error file'.
+        # shard=(index, count) processes only that share of the rows.
+        if shard is not None:
+            output_dataset = shard_filename(output_dataset, shard[0], shard[1])
+        if journal_file is None:
+            journal_file = '{}.journal'.format(output_dataset)
+        journal = CheckpointJournal(journal_file)
+        journal.load()
+        logger.info('%d rows already completed in %s', len(journal.completed), journal_file)
+        if self.slicer.remote:
+            self.prefetch_remote_files(dict.fromkeys(self.slicing_files(input_dataset, journal, shard)))
+
+        if WORKERS is None:
+            WORKERS = worker_count(self.slicer.server_workers)
+        logger.info('Slicing with %d workers', WORKERS)
+        if max_pending is None:
+            max_pending = WORKERS * 16
+        with open(input_dataset, 'r', encoding='utf8', newline='') as f_in, \
+                open(output_dataset, 'w', newline='', encoding='utf8', buffering=1024 * 1024) as f_out:
+            reader = csv.reader(f_in, delimiter=';')
+            writer = csv.writer(f_out, delimiter=';')
+            header = next(reader, None)
+            if header is None:
+                return
+            writer.writerow(header)
+            try:
+                with Pool(processes=WORKERS) as pool:
+                    scheduler = CostScheduler(pool, functools.partial(self._augment_batch, task_budget=task_budget),
+                                              self.block_cost, max_pending)
+                    for rows in scheduler.run(self._blocks(reader, journal, shard)):
+                        self.write_augmented_rows(writer, journal, rows)
+            finally:
+                journal.close()
+
+    def write_augmented_rows(self, writer, journal, rows):
+        for roww in rows:
+            writer.writerow(roww)
+            row_fingerprint = self.row_fingerprint(roww[:-2])
+            if journal.get(roww, row_fingerprint) is None:
+                journal.record(roww, roww[-2:], row_fingerprint)
+
+    def regenerate(self, common_output, WORKERS=None, output_dataset=AUGMENTED_DATASET, streaming=False):
+        # Brings every output up to date with the inputs, each stage only recomputes what its fingerprints
+        # say has changed
+        if WORKERS is None:
+            WORKERS = worker_count(self.slicer.server_workers)
+        if streaming:
+            self.generate_tables(WORKERS=WORKERS)
+            self.combine_final_dataset_file(common_output, WORKERS=WORKERS, streaming=True)
+        else:
+            self.generate_tables(common_output, WORKERS=WORKERS)
+        self.augment_final_dataset_with_slices(common_output, WORKERS=WORKERS, output_dataset=output_dataset)
+
+    def run_task(self, kind, payload):
+        # Work of one task of distribute, run by whichever worker leased it. Mapping and slicing payloads name the
+        # line mapper and repoman build the coordinator expects, a worker set up otherwise refuses them. Slicing
+        # tasks with a row that failed fail too, so they are retried and never kept as done.
+        if kind == 'ground_truth':
+            repo, commit = payload
+            gt = self.slicer.get_ground_truth_pair(repo=repo, commit_old='{}^'.format(commit), commit_new=commit)
+            return gt if isinstance(gt, str) else list(gt)
+        if kind == 'mapping':
+            self.check_task_setup('line mapper', payload['line_mapper'], self.slicer.line_mapper)
+            return [self.slicer.get_line_mapping(repo, commit_new, file_old, file_new, start_index=start_index,
+                                                 reversed=reversed)
+                    for repo, commit_new, file_old, file_new, start_index, reversed in payload['requests']]
+        if kind == 'slicing':
+            self.check_task_setup('repoman build', payload['jar_sha'], self.slicer.get_jar_sha())
+            rows = self._augment_helper([(line, None) for line in payload['rows']])
+            failed = len([roww for roww in rows if ERROR_RESULT in roww[-2:]])
+            if failed > 0:
+                raise TaskError('{} out of {} rows could not be sliced'.format(failed, len(rows)))
+            return rows
+        raise ValueError('Unknown task kind {}'.format(kind))
+
+    def check_task_setup(self, name, expected, actual):
+        if expected != actual:
+            raise TaskError('{} {} expected, this worker has {}'.format(name, expected, actual))
+
+    def run_worker(self, queue, idle_timeout=None, poll=POLL_SECONDS):
+        return work(queue, self.run_task, poll=poll, idle_timeout=idle_timeout)
+
+    def run_workers(self, queue, WORKERS=None, idle_timeout=None, poll=POLL_SECONDS):
+        # A worker node of distribute: WORKERS processes taking tasks until the coordinator is done
+        if WORKERS is None:
+            WORKERS = worker_count(self.slicer.server_workers)
+        logger.info('Working on %s with %d processes', queue.folder, WORKERS)
+        if WORKERS <= 1:
+            return self.run_worker(queue, idle_timeout, poll)
+        with Pool(processes=WORKERS) as pool:
+            results = [pool.apply_async(self.run_worker, (queue, idle_timeout, poll)) for _ in range(WORKERS)]
+            return sum(result.get() for result in results)
+
+    def run_distributed(self, queue, kind, tasks, work_too=True, poll=POLL_SECONDS):
+        logger.info('%d %s tasks to run', queue.enqueue(kind, tasks), kind)
+        if work_too:
+            work(queue, self.run_task, kinds=[kind], poll=poll, stop=lambda: queue.unfinished(kind) == 0)
+        while queue.unfinished(kind) > 0:
+            time.sleep(poll)
+        counts = queue.counts(kind)
+        logger.info('%s tasks: %s', kind, ', '.join('{} {}'.format(n, state) for state, n in sorted(counts.items())))
+
+    def slicing_tasks(self, input_dataset, journal):
+        # (key, payload) of every CVE block of the combined dataset with rows left to slice, in input order. The
+        # payload holds the jar sha the rows are fingerprinted with, so a done task is redone after a jar change.
+        jar_sha = self.slicer.get_jar_sha()
+        with open(input_dataset, 'r', encoding='utf8', newline='') as f_in:
+            reader = csv.reader(f_in, delimiter=';')
+            next(reader, None)
+            for index, block in enumerate(self._blocks(reader, journal, None)):
+                lines = [line for line, journalled in block if journalled is None]
+                if len(lines) > 0:
+                    yield '{}_{}_{}'.format(block[0][0][0], block[0][0][3], index), {'jar_sha': jar_sha, 'rows': lines}
+
+    @stage('distribute')
+    def distribute(self, common_output, queue, output_dataset=AUGMENTED_DATASET, work_too=True, poll=POLL_SECONDS):
+        # Coordinator of a run spread over several nodes sharing the queue: each stage is cut into per-key tasks,
+        # the ground truth diff of every fix commit, the line mappings of every CVE and the slicing of every CVE
+        # block not journalled yet, which the workers of run_workers lease from the queue. Their results are merged
+        # here in input order, so the outputs are the same as regenerate's. What failed for good on the workers is
+        # computed here instead, except slices which are marked 'error file' for the next run.
+        # With work_too=True the coordinator also runs tasks while it waits.
+        model = self.build_model()
+        revisions = dict(('{}@{}'.format(record.revisions[0].repo, record.revisions[0].commit),
+                          (record.revisions[0].repo, record.revisions[0].commit)) for record in model.values())
+        self.run_distributed(queue, 'ground_truth', [(key, list(revision)) for key, revision in revisions.items()],
+                             work_too, poll)
+        for key, gt in queue.results('ground_truth'):
+            if key in revisions:
+                self.ground_truths[revisions[key]] = gt if isinstance(gt, str) else tuple(gt)
+        self.generate_tables()
+
+        dict_vuln_pess = self.load_revision_table('vuln')
+        dict_fix_pess = self.load_revision_table('fix')
+        requests = dict()
+        for key in dict_fix_pess:
+            if key in dict_vuln_pess:
+                project_vuln = '{}_{}'.format(dict_fix_pess[key][0], dict_fix_pess[key][3])
+                requests.setdefault(project_vuln, dict()).update(
+                    dict.fromkeys(self.pair_mapping_requests(dict_fix_pess[key], dict_vuln_pess[key])))
+        requests = dict((key, list(key_requests)) for key, key_requests in requests.items() if len(key_requests) > 0)
+        mapping_tasks = [(key, {'line_mapper': self.slicer.line_mapper, 'requests': key_requests})
+                         for key, key_requests in requests.items()]
+        self.run_distributed(queue, 'mapping', mapping_tasks, work_too, poll)
+        for key, mappings in queue.results('mapping'):
+            if key in requests:
+                self.lines_mappings.update(zip(requests[key], mappings))
+        self.combine_final_dataset_file(common_output, WORKERS=1)
+
+        journal = CheckpointJournal('{}.journal'.format(output_dataset))
+        journal.load()
+        self.run_distributed(queue, 'slicing', self.slicing_tasks(common_output, journal), work_too, poll)
+        queue.finish()
+        with open(common_output, 'r', encoding='utf8', newline='') as f_in, \
+                open(output_dataset, 'w', newline='', encoding='utf8', buffering=1024 * 1024) as f_out:
+            reader = csv.reader(f_in, delimiter=';')
+            writer = csv.writer(f_out, delimiter=';')
+            writer.writerow(next(reader))
+            try:
+                for index, block in enumerate(self._blocks(reader, journal, None)):
+                    sliced = iter([])
+                    if any(journalled is None for line, journalled in block):
+                        sliced = iter(queue.result('slicing', '{}_{}_{}'.format(block[0][0][0], block[0][0][3],
+                                                                               index)) or [])
+                    rows = []
+                    for line, journalled in block:
+                        if journalled is not None:
+                            rows.append(line + journalled)
+                            continue
+                        roww = next(sliced, None)
+                        if roww is None:
+                            metrics.count('distribute.rows_failed')
+                            roww = line + ['error file', 'error file']
+                        rows.append(roww)
+                    self.write_augmented_rows(writer, journal, rows)
+            finally:
+                journal.close()
+
+    def merge_shards(self, input_dataset, shards, output_dataset=AUGMENTED_DATASET):
+        # Every shard output follows the input order, so the input tells which shard holds the next row
+        shard_files = [open(shard_filename(output_dataset, index, shards), 'r', encoding='utf8', newline='')
+                       for index in range(shards)]
+        try:
+            shard_readers = [csv.reader(f_shard, delimiter=';') for f_shard in shard_files]
+            for shard_reader in shard_readers:
+                header = next(shard_reader, None)
+            with open(input_dataset, 'r', encoding='utf8', newline='') as f_in, \
+                    open(output_dataset, 'w', newline='', encoding='utf8', buffering=1024 * 1024) as f_out:
                 reader = csv.reader(f_in, delimiter=';')
+                writer = csv.writer(f_out, delimiter=';')
+                input_header = next(reader)
+                writer.writerow(input_header if header is None else header)
                 for line in reader:
-                    read_lines.append(line)
-                # read_lines = reader.readlines()
-                with Pool(processes=3) as pool:
-                    pool.map(self._augment_helper, read_lines)
-                # with open(AUGMENTED_DATASET, 'w', newline='', encoding='utf8') as f_out:
-                #     writer = csv.writer(f_out, delimiter=';')
-                #     count = 0
-                #     for line in reader:
-                #         count += 1
-                #         print('Augmenting item {}'.format(count))
-                #         # project;repo;commit;vuln_id;vul_or_fix;tool;file;LoC_vuln;LoC_sliced_lightweight;LoC_sliced_pessimist
-                #         if line[0] == 'project':
-                #             continue
-                #         roww = line
-                #         roww.append(str(self.slicer.get_slice(repo=line[1], path=line[-2], lines=line[-1], commit=line[2], slicetype='lightweight')))
-                #         roww.append(str(self.slicer.get_slice(repo=line[1], path=line[-2], lines=line[-1], commit=line[2], slicetype='pessimist')))
-                #         writer.writerow(roww)
-        # except Exception as e:
-        #     print('I cannot open file {}'.format(input_dataset))
-        #     print(str(e))
+                    roww = next(shard_readers[shard_of(line, shards)], None)
+                    if roww is None or row_key(roww) != row_key(line):
+                        logger.error('Shard %d of %d does not contain %s', shard_of(line, shards), shards,
+                                     row_key(line))
+                        return False
+                    writer.writerow(roww)
+        finally:
+            for f_shard in shard_files:
+                f_shard.close()
+        return True
 
 
 if __name__ == '__main__':
     # slicer = Slicer()
     # print(slicer.get_slice('git@github.com:apache/tomcat.git', path=os.path.join(DATA_FOLDER, 'cache', 'tomcat', 'java/org/apache/tomcat/util/buf/UDecoder.java'), lines='77, 78, 79, 81, 82, 84, 92, 95, 97, 98, 99, 100, 101, 104, 107, 108, 109, 113, 114, 115, 118, 145, 146, 147, 149, 150, 151, 152, 154, 159, 160, 163, 164, 165, 166, 167, 170, 174, 175, 176, 180, 181, 182, 185, 203, 205, 206, 209, 212, 213, 216, 217, 240, 241, 244, 245, 249, 250, 256, 257, 258, 262, 267, 268, 269, 270, 272, 276, 277, 278', commit='ec7ff88', slicetype='pessimist'))
 
-    ds_gen = DatasetGenerator()
     # # ds_gen.combine_revisions_ground_truth()
     # # ds_gen.get_alerts_dict()
     # ds_gen.final_dict_as_table(vuln=True)
@@ -403,7 +823,52 @@ if __name__ == '__main__':
     common_output = os.path.join(DATA_FOLDER, 'combined_output.csv')
     # ds_gen.combine_final_dataset_file(common_output)
 
-    ds_gen.augment_final_dataset_with_slices(common_output, AUGMENTED_DATASET)
+    parser = argparse.ArgumentParser(description='Augments the combined dataset with lightweight and pessimist slices')
+    parser.add_argument('--workers', type=int, help='by default as many as the cores and free memory allow')
+    parser.add_argument('--task-budget', type=float, help='seconds after which a CVE gives up its remaining files')
+    parser.add_argument('--shard', help='process only shard i of N, given as i/N')
+    parser.add_argument('--merge-shards', type=int, metavar='N', help='merge the outputs of N shard runs')
+    parser.add_argument('--queue', help='work queue shared by the nodes of a distributed run, a folder for the '
+                                         'default sqlite backend')
+    parser.add_argument('--coordinator', action='store_true', help='enqueue the tasks of every stage on --queue and '
+                                                                   'merge their results')
+    parser.add_argument('--worker', action='store_true', help='run tasks from --queue until the coordinator is done')
+    parser.add_argument('--idle-timeout', type=float, help='seconds after which a worker without tasks stops')
+    parser.add_argument('--regenerate', action='store_true',
+                        help='rebuild every stage from the inputs, recomputing only the rows whose inputs changed')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    parser.add_argument('--metrics-log', help='append JSON lines stage metrics to this file')
+    parser.add_argument('--profile', action='store_true',
+                        help='report the time spent per stage and the slowest rows at the end')
+    parser.add_argument('--slowest', type=int, default=SLOWEST_ROWS, help='number of rows listed by --profile')
+    parser.add_argument('--streaming', action='store_true',
+                        help='combine the revision tables with a sorted merge-join in bounded memory')
+    parser.add_argument('--remote', action='store_true',
+                        help='download file revisions from GITHUB_FILE_RAW_START instead of reading the local clones')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    metrics.configure(log_file=args.metrics_log, profile=args.profile, slowest=args.slowest)
+    ds_gen = DatasetGenerator(remote=args.remote)
+
+    if args.coordinator or args.worker:
+        if args.queue is None:
+            parser.error('--coordinator and --worker need --queue')
+        if args.coordinator:
+            ds_gen.distribute(common_output, open_queue(args.queue))
+        else:
+            ds_gen.run_workers(open_queue(args.queue), WORKERS=args.workers, idle_timeout=args.idle_timeout)
+    elif args.regenerate:
+        ds_gen.regenerate(common_output, WORKERS=args.workers, streaming=args.streaming)
+    elif args.merge_shards:
+        ds_gen.merge_shards(common_output, args.merge_shards)
+    else:
+        shard = None
+        if args.shard:
+            shard = tuple(int(part) for part in args.shard.split('/'))
+        ds_gen.augment_final_dataset_with_slices(common_output, WORKERS=args.workers, shard=shard,
+                                                 task_budget=args.task_budget)
+    if args.profile:
+        metrics.write_profile()
 
     # args = sys.argv
     # if len(args) < 3:
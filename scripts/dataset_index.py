@@ -0,0 +1,334 @@
+import os, sys, csv, mmap, struct, argparse, logging
+from array import array
+from scripts.lines import LINE_TYPECODE, parse_lines, format_lines
+from scripts.metrics import metrics
+
+cwd = os.path.dirname(__file__)
+AUGMENTED_DATASET = os.path.normpath(os.path.join(cwd, '..', 'data', 'alerts-dataset.csv'))
+
+MAGIC = b'ALRTIDX1'
+VERSION = 1
+FIELDS = ['project', 'repo', 'commit', 'vuln_id', 'side', 'tool', 'file']
+INDEXED_FIELDS = ['project', 'vuln_id', 'tool', 'file']
+LINE_COLUMNS = ['lines', 'lightweight', 'pessimist']
+ERROR_RESULT = 'error file'
+# string offsets, string bytes, a column per field, line pool bounds, error flags, line pool, then offsets and rows
+# of every indexed field
+SECTIONS = 2 + len(FIELDS) + 3 + 2 * len(INDEXED_FIELDS)
+# magic, version, rows, strings, lines in the pool, size and mtime_ns of the source CSV, offset of every section
+HEADER = struct.Struct('<8sIQQQQQ{}Q'.format(SECTIONS))
+
+logger = logging.getLogger(__name__)
+
+
+def index_filename(dataset_file):
+    return '{}.idx'.format(dataset_file)
+
+
+def little_endian(values):
+    # Bytes of an array as stored in the index, which is little-endian whatever the platform
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class AlertRow:
+    # One row of the dataset, lightweight and pessimist are None where slicing failed ('error file') or the dataset
+    # has no slices, like the combined dataset
+    __slots__ = ('position', 'project', 'repo', 'commit', 'vuln_id', 'side', 'tool', 'file', 'lines', 'lightweight',
+                 'pessimist')
+
+    def __init__(self, position, strings, lines, lightweight, pessimist):
+        self.position = position
+        self.project, self.repo, self.commit, self.vuln_id, self.side, self.tool, self.file = strings
+        self.lines = lines
+        self.lightweight = lightweight
+        self.pessimist = pessimist
+
+    def as_row(self):
+        # Back in the form of the dataset CSV, apart from the order the slices were listed in
+        row = [self.project, self.repo, self.commit, self.vuln_id, self.side, self.tool, self.file,
+               format_lines(self.lines)]
+        for lines in (self.lightweight, self.pessimist):
+            row.append(ERROR_RESULT if lines is None else str(set(lines)))
+        return row
+
+    def __repr__(self):
+        return 'AlertRow({})'.format(', '.join('{}={!r}'.format(name, getattr(self, name)) for name in self.__slots__))
+
+
+def compile_dataset(dataset_file=AUGMENTED_DATASET, index_file=None):
+    # Compiles the augmented dataset CSV into the binary file DatasetIndex maps. Every string is stored once in a
+    # sorted table, so a value is found by binary search and its id is its rank. A row is a string id per field plus
+    # three consecutive ranges of one packed pool of line numbers: the ground truth or alert lines, the lightweight
+    # and the pessimist slice, line column n of row r going from bounds[3r + n] to bounds[3r + n + 1]. For project,
+    # vuln_id, tool and file the positions of the rows holding each value are listed contiguously, from offsets[id]
+    # to offsets[id + 1].
+    if index_file is None:
+        index_file = index_filename(dataset_file)
+    stat = os.stat(dataset_file)
+    ids = dict()
+    columns = [array('i') for _ in FIELDS]
+    pool = array(LINE_TYPECODE)
+    bounds = array('q', [0])
+    errors = array('b')
+    with metrics.timer('compile_dataset'):
+        with open(dataset_file, 'r', encoding='utf8', newline='') as f_in:
+            reader = csv.reader(f_in, delimiter=';')
+            header = next(reader, [])
+            for line in reader:
+                if not line:
+                    continue
+                if len(line) != len(header):
+                    logger.warning('%s:%d has %d columns instead of %d, skipped', dataset_file, reader.line_num,
+                                   len(line), len(header))
+                    metrics.error('dataset_index')
+                    continue
+                for column, value in zip(columns, line):
+                    column.append(ids.setdefault(value, len(ids)))
+                flags = 0
+                for n in range(len(LINE_COLUMNS)):
+                    value = line[len(FIELDS) + n] if len(line) > len(FIELDS) + n else ERROR_RESULT
+                    if value == ERROR_RESULT:
+                        flags |= 1 << n
+                    else:
+                        pool.extend(parse_lines(value))
+                    bounds.append(len(pool))
+                errors.append(flags)
+
+        strings = sorted(ids)
+        rank = array('i', [0]) * len(strings)
+        for position, value in enumerate(strings):
+            rank[ids[value]] = position
+        for column in columns:
+            for i, string_id in enumerate(column):
+                column[i] = rank[string_id]
+        encoded = [value.encode('utf8') for value in strings]
+        string_offsets = array('q', [0])
+        for value in encoded:
+            string_offsets.append(string_offsets[-1] + len(value))
+
+        sections = [little_endian(string_offsets), b''.join(encoded)]
+        sections.extend(little_endian(column) for column in columns)
+        sections.append(little_endian(bounds))
+        sections.append(little_endian(errors))
+        sections.append(little_endian(pool))
+        for field in INDEXED_FIELDS:
+            # Counting sort of the row positions by the id of their value
+            column = columns[FIELDS.index(field)]
+            offsets = array('q', [0]) * (len(strings) + 1)
+            for string_id in column:
+                offsets[string_id + 1] += 1
+            for i in range(len(strings)):
+                offsets[i + 1] += offsets[i]
+            rows = array('i', [0]) * len(column)
+            filled = array('q', offsets[:-1])
+            for position, string_id in enumerate(column):
+                rows[filled[string_id]] = position
+                filled[string_id] += 1
+            sections.append(little_endian(offsets))
+            sections.append(little_endian(rows))
+
+        # Every section starts on an 8 byte boundary, so it can be used in place once mapped
+        positions = []
+        position = HEADER.size
+        for section in sections:
+            position += -position % 8
+            positions.append(position)
+            position += len(section)
+        tmp_file = '{}.{}.tmp'.format(index_file, os.getpid())
+        with open(tmp_file, 'wb') as f_out:
+            f_out.write(HEADER.pack(MAGIC, VERSION, len(errors), len(strings), len(pool), stat.st_size,
+                                    stat.st_mtime_ns, *positions))
+            for position, section in zip(positions, sections):
+                f_out.write(b'\0' * (position - f_out.tell()))
+                f_out.write(section)
+        os.replace(tmp_file, index_file)
+    logger.info('%d rows, %d strings and %d lines of %s compiled into %s', len(errors), len(strings), len(pool),
+                dataset_file, index_file)
+    return index_file
+
+
+class DatasetIndex:
+    # Read API over a compiled dataset. The file is memory-mapped and its sections used in place, opening it only
+    # reads the header; rows are decoded when asked for. On big-endian platforms the sections are copied and
+    # swapped instead.
+    # find(vuln_id='CVE-2009-3555', side='fix', tool='Tool_A') starts from the shortest list of rows among the
+    # indexed fields given and checks the other fields on those rows only.
+    def __init__(self, index_file):
+        self.index_file = index_file
+        with open(index_file, 'rb') as f_in:
+            self.map = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = [memoryview(self.map)]
+        header = HEADER.unpack_from(self.map)
+        if header[0] != MAGIC or header[1] != VERSION:
+            self.close()
+            raise ValueError('{} is not a dataset index of version {}'.format(index_file, VERSION))
+        self.size, self.string_count, pool_size, self.source_size, self.source_mtime = header[2:7]
+        sections = iter(header[7:])
+        self.string_offsets = self.section(next(sections), 'q', self.string_count + 1)
+        self.string_bytes = self.section(next(sections), 'B', self.string_offsets[-1])
+        self.columns = dict((field, self.section(next(sections), 'i', self.size)) for field in FIELDS)
+        self.bounds = self.section(next(sections), 'q', self.size * len(LINE_COLUMNS) + 1)
+        self.errors = self.section(next(sections), 'b', self.size)
+        self.pool = self.section(next(sections), LINE_TYPECODE, pool_size)
+        self.postings = dict()
+        for field in INDEXED_FIELDS:
+            offsets = self.section(next(sections), 'q', self.string_count + 1)
+            self.postings[field] = (offsets, self.section(next(sections), 'i', self.size))
+
+    def section(self, position, typecode, length):
+        size = array(typecode).itemsize
+        view = self._views[0][position:position + length * size]
+        self._views.append(view)
+        if sys.byteorder == 'big' and size > 1:
+            values = array(typecode)
+            values.frombytes(view)
+            values.byteswap()
+            return values
+        view = view.cast(typecode)
+        self._views.append(view)
+        return view
+
+    def close(self):
+        # Views on the map have to be released before it can be closed
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def __len__(self):
+        return self.size
+
+    def is_stale(self, dataset_file):
+        # The CSV was written again since it was compiled
+        stat = os.stat(dataset_file)
+        return stat.st_size != self.source_size or stat.st_mtime_ns != self.source_mtime
+
+    def string(self, string_id):
+        return bytes(self.string_bytes[self.string_offsets[string_id]:self.string_offsets[string_id + 1]]).decode('utf8')
+
+    def string_id(self, value):
+        # Rank of value in the sorted string table, None if no row holds it. UTF-8 bytes sort like the strings.
+        value = value.encode('utf8')
+        low = 0
+        high = self.string_count
+        while low < high:
+            middle = (low + high) // 2
+            if bytes(self.string_bytes[self.string_offsets[middle]:self.string_offsets[middle + 1]]) < value:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.string_count and \
+                bytes(self.string_bytes[self.string_offsets[low]:self.string_offsets[low + 1]]) == value:
+            return low
+        return None
+
+    def line_view(self, column, position):
+        # Line numbers of one line column of a row in place in the pool, None where slicing failed
+        if self.errors[position] & (1 << column):
+            return None
+        bound = position * len(LINE_COLUMNS) + column
+        return self.pool[self.bounds[bound]:self.bounds[bound + 1]]
+
+    def lines(self, column, position):
+        # Same as an array
+        lines = self.line_view(column, position)
+        if lines is None:
+            return None
+        return array(LINE_TYPECODE, lines)
+
+    def row(self, position):
+        if not 0 <= position < self.size:
+            raise IndexError('row {} out of range'.format(position))
+        return AlertRow(position, [self.string(self.columns[field][position]) for field in FIELDS],
+                        *[self.lines(column, position) for column in range(len(LINE_COLUMNS))])
+
+    def __getitem__(self, position):
+        return self.row(position)
+
+    def __iter__(self):
+        for position in range(self.size):
+            yield self.row(position)
+
+    def positions(self, **filters):
+        # Positions of the rows matching every field=value filter, in dataset order
+        wanted = dict()
+        for field, value in filters.items():
+            if field not in FIELDS:
+                raise ValueError('Unknown field {}, one of {} expected'.format(field, ', '.join(FIELDS)))
+            if value is None:
+                continue
+            string_id = self.string_id(value)
+            if string_id is None:
+                return []
+            wanted[field] = string_id
+        candidates = None
+        for field in INDEXED_FIELDS:
+            if field in wanted:
+                offsets, rows = self.postings[field]
+                rows = rows[offsets[wanted[field]]:offsets[wanted[field] + 1]]
+                if candidates is None or len(rows) < len(candidates):
+                    candidates = rows
+        if candidates is None:
+            candidates = range(self.size)
+        checks = [(self.columns[field], string_id) for field, string_id in wanted.items()]
+        return [position for position in candidates if all(column[position] == string_id
+                                                           for column, string_id in checks)]
+
+    def find(self, **filters):
+        # Rows matching every field=value filter, e.g. find(vuln_id='CVE-2009-3555', side='fix', tool='Tool_A')
+        return [self.row(position) for position in self.positions(**filters)]
+
+    def values(self, field):
+        # Distinct values of an indexed field, sorted
+        offsets = self.postings[field][0]
+        return [self.string(string_id) for string_id in range(self.string_count)
+                if offsets[string_id + 1] > offsets[string_id]]
+
+
+def open_dataset(dataset_file=AUGMENTED_DATASET, index_file=None):
+    # DatasetIndex over the dataset, compiled first when there is no index yet or the CSV changed since
+    if index_file is None:
+        index_file = index_filename(dataset_file)
+    if os.path.exists(index_file):
+        try:
+            index = DatasetIndex(index_file)
+        except ValueError as e:
+            logger.warning('%s, compiling it again', e)
+        else:
+            if not os.path.exists(dataset_file) or not index.is_stale(dataset_file):
+                return index
+            index.close()
+            logger.info('%s changed since it was compiled', dataset_file)
+    compile_dataset(dataset_file, index_file)
+    return DatasetIndex(index_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compiles the augmented dataset into an indexed binary file and '
+                                                 'queries it')
+    parser.add_argument('dataset', nargs='?', default=AUGMENTED_DATASET)
+    parser.add_argument('--index', help='index file, by default next to the dataset')
+    parser.add_argument('--compile', action='store_true', help='compile the index even if it is up to date')
+    for field in FIELDS:
+        parser.add_argument('--{}'.format(field.replace('_', '-')), dest=field, help='only rows with this {}'.format(field))
+    args = parser.parse_args()
+    logging.basicConfig(level='INFO', format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    if args.compile:
+        compile_dataset(args.dataset, args.index)
+    filters = dict((field, getattr(args, field)) for field in FIELDS if getattr(args, field) is not None)
+    if not args.compile or len(filters) > 0:
+        with open_dataset(args.dataset, args.index) as index:
+            writer = csv.writer(sys.stdout, delimiter=';')
+            for row in index.find(**filters):
+                writer.writerow(row.as_row())
@@ -0,0 +1,97 @@
+import csv
+from scripts.alerts_index import clean_filename
+from scripts.lines import encode_lines
+
+# Compact records for the inputs of the revision tables, one CveRecord per (project, vuln_id) holding its
+# revisions and the ground truth listed for it in ground_truth.csv
+
+
+class Revision:
+    __slots__ = ('project', 'repo', 'commit', 'vuln_id')
+
+    def __init__(self, project, repo, commit, vuln_id):
+        self.project = project
+        self.repo = repo
+        self.commit = commit
+        self.vuln_id = vuln_id
+
+    def as_row(self):
+        return [self.project, self.repo, self.commit, self.vuln_id]
+
+
+class GroundTruthEntry:
+    __slots__ = ('file', 'lines')
+
+    def __init__(self, file, lines):
+        self.file = file
+        self.lines = lines
+
+    def as_row(self):
+        return [self.file, self.lines]
+
+
+class Finding:
+    # One alert of a tool: the file and its lines in compact form, then whatever columns the report adds
+    __slots__ = ('tool', 'file', 'lines', 'extra')
+
+    def __init__(self, tool, file=None, lines=None, extra=()):
+        self.tool = tool
+        self.file = file
+        self.lines = lines
+        self.extra = extra
+
+    @classmethod
+    def from_alert(cls, tool, row):
+        columns = row[2:]
+        return cls(tool, columns[0] if len(columns) > 0 else None,
+                   encode_lines(columns[1]) if len(columns) > 1 else None, tuple(columns[2:]))
+
+    def as_row(self, revision_row):
+        row = list(revision_row)
+        row.append(self.tool)
+        if self.file is not None:
+            row.append(self.file)
+        if self.lines is not None:
+            row.append(self.lines)
+        row.extend(self.extra)
+        return row
+
+
+class CveRecord:
+    __slots__ = ('revisions', 'ground_truth')
+
+    def __init__(self):
+        self.revisions = []
+        self.ground_truth = []
+
+    @property
+    def project_vuln(self):
+        return self.revisions[0].project, self.revisions[0].vuln_id
+
+    def inputs(self):
+        # The key's revision rows followed by the list of its ground truth rows, what the rows of the key are
+        # fingerprinted by
+        return [revision.as_row() for revision in self.revisions] + [[entry.as_row() for entry in self.ground_truth]]
+
+
+def read_rows(file_name, delimiter):
+    with open(file_name, 'r', encoding='utf8') as f_in:
+        reader = csv.reader(f_in, delimiter=delimiter)
+        next(reader, None)
+        for row in reader:
+            yield row
+
+
+def build_model(input_revisions, input_ground_truth, clean_filenames=True):
+    # {project_vuln: CveRecord} for every revision of input_revisions, in file order
+    model = dict()
+    for row in read_rows(input_revisions, ','):
+        key = '{}_{}'.format(row[0], row[3])
+        if key not in model:
+            model[key] = CveRecord()
+        model[key].revisions.append(Revision(row[0], row[1], row[2], row[3]))
+    for row in read_rows(input_ground_truth, ';'):
+        record = model.get('{}_{}'.format(row[0], row[1]))
+        if record is not None:
+            record.ground_truth.append(GroundTruthEntry(clean_filename(row[2]) if clean_filenames else row[2], row[3]))
+    return model
@@ -0,0 +1,17 @@
+import os, json, hashlib
+
+
+def fingerprint(*parts):
+    # Stable digest of JSON serialisable inputs
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf8')).hexdigest()
+
+
+def file_sha(path, block_size=1024 * 1024):
+    # Digest of a file's contents, '' when it does not exist
+    if not os.path.exists(path):
+        return ''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f_in:
+        for block in iter(lambda: f_in.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
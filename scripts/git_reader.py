@@ -0,0 +1,161 @@
+import os, re, subprocess, threading
+
+_readers = dict()
+FULL_SHA = re.compile('^([0-9a-f]{40}|[0-9a-f]{64})$')
+# Last word of the header git cat-file answers with when it has no object for the spec
+UNKNOWN_OBJECT = ['missing', 'ambiguous']
+
+
+class GitReaderError(Exception):
+    pass
+
+
+class GitObjectReader:
+    # One long-lived git cat-file --batch and --batch-check pair per repository, so revisions, blobs and
+    # trees are resolved without spawning a git process per lookup
+    def __init__(self, repo_folder):
+        self.repo_folder = repo_folder
+        self.batch = None
+        self.batch_check = None
+        self.resolved = dict()
+        self._lock = threading.Lock()
+
+    def _start(self, option):
+        return subprocess.Popen(['git', 'cat-file', option], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, cwd=self.repo_folder)
+
+    def _request(self, process_attr, option, spec):
+        if '\n' in spec:
+            raise GitReaderError('invalid object name {}'.format(spec))
+        for attempt in range(2):
+            process = getattr(self, process_attr)
+            if process is None or process.poll() is not None:
+                process = self._start(option)
+                setattr(self, process_attr, process)
+            try:
+                process.stdin.write('{}\n'.format(spec).encode())
+                process.stdin.flush()
+                header = process.stdout.readline()
+                if header == b'':
+                    raise BrokenPipeError()
+                return process, parse_header(header.decode().rstrip('\n'))
+            except (BrokenPipeError, OSError):
+                process.kill()
+                setattr(self, process_attr, None)
+        raise GitReaderError('git cat-file {} died in {}'.format(option, self.repo_folder))
+
+    def info(self, spec):
+        # Returns (sha, type, size) or None if the object does not exist
+        with self._lock:
+            _, header = self._request('batch_check', '--batch-check', spec)
+        if header is None:
+            return None
+        return header[0], header[1], int(header[2])
+
+    def read(self, spec):
+        # Returns (sha, type, content) or None if the object does not exist
+        with self._lock:
+            process, header = self._request('batch', '--batch', spec)
+            if header is None:
+                return None
+            size = int(header[2])
+            content = process.stdout.read(size + 1)[:size]
+        return header[0], header[1], content
+
+    def resolve(self, rev):
+        # Only full shas are cached, HEAD, branches and missing objects can change with the next fetch
+        if rev in self.resolved:
+            return self.resolved[rev]
+        info = self.info(rev)
+        if info is None:
+            return None
+        if FULL_SHA.match(rev):
+            self.resolved[rev] = info[0]
+        return info[0]
+
+    def parents(self, commit):
+        obj = self.read(commit)
+        if obj is None or obj[1] != 'commit':
+            return []
+        parents = []
+        for line in obj[2].decode('utf8', errors='replace').splitlines():
+            if line == '':
+                break
+            if line.startswith('parent '):
+                parents.append(line.split(' ')[1])
+        return parents
+
+    def previous_commit(self, commit):
+        # Same answer as the last field of git rev-list --parents -n 1 <commit>
+        parents = self.parents(commit)
+        if len(parents) == 0:
+            return self.resolve(commit)
+        return parents[-1]
+
+    def blob(self, rev, path):
+        obj = self.read('{}:{}'.format(rev, path))
+        if obj is None or obj[1] != 'blob':
+            return None
+        return obj[2]
+
+    def blob_sha(self, rev, path):
+        info = self.info('{}:{}'.format(rev, path))
+        if info is None or info[1] != 'blob':
+            return None
+        return info[0]
+
+    def tree(self, rev, path=''):
+        # Returns [(mode, type, sha, name)] for the entries of the tree at rev:path
+        obj = self.read('{}:{}'.format(rev, path) if path else '{}^{{tree}}'.format(rev))
+        if obj is None or obj[1] != 'tree':
+            return []
+        entries = []
+        content = obj[2]
+        position = 0
+        while position < len(content):
+            space = content.index(b' ', position)
+            nul = content.index(b'\0', space)
+            mode = content[position:space].decode()
+            name = content[space + 1:nul].decode('utf8', errors='surrogateescape')
+            sha = content[nul + 1:nul + 21].hex()
+            position = nul + 21
+            if mode == '40000':
+                kind = 'tree'
+            elif mode == '160000':
+                kind = 'commit'
+            else:
+                kind = 'blob'
+            entries.append((mode, kind, sha, name))
+        return entries
+
+    def close(self):
+        with self._lock:
+            for process_attr in ['batch', 'batch_check']:
+                process = getattr(self, process_attr)
+                if process is None:
+                    continue
+                try:
+                    process.stdin.close()
+                    process.wait(timeout=5)
+                except (OSError, subprocess.TimeoutExpired):
+                    process.kill()
+                setattr(self, process_attr, None)
+
+
+def parse_header(header):
+    # [sha, type, size], None for a missing object. The spec echoed back in that case may contain spaces,
+    # '<rev>:a b missing', so the answer is told by its last word and not by its number of fields.
+    if header.rsplit(' ', 1)[-1] in UNKNOWN_OBJECT:
+        return None
+    fields = header.split(' ')
+    if len(fields) != 3:
+        raise GitReaderError('unexpected git cat-file header {}'.format(header))
+    return fields
+
+
+def get_reader(repo_folder):
+    # Readers are per process, pipes inherited through fork must not be shared
+    key = (os.getpid(), os.path.abspath(repo_folder))
+    if key not in _readers:
+        _readers[key] = GitObjectReader(repo_folder)
+    return _readers[key]
@@ -0,0 +1,74 @@
+import re
+
+_HUNK = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+def _diff_path(header):
+    # '--- a/java/org/A.java' -> 'java/org/A.java', '--- /dev/null' -> None
+    path = header[4:].rstrip('\n').split('\t')[0].strip()
+    if path == '/dev/null':
+        return None
+    if path.startswith('a/') or path.startswith('b/'):
+        path = path[2:]
+    return path
+
+
+def parse_unified_diff(diff_text, extension='.java'):
+    # One pass over the output of 'git diff -U0 old new'. Returns (old_lines, new_lines) where old_lines[file]
+    # lists the lines removed from the old revision of file (keyed by its old path) and new_lines[file] the lines
+    # added to the new revision (keyed by its new path), as strings, the way showlinenum.awk reported them.
+    old_lines = dict()
+    new_lines = dict()
+    old_file = None
+    new_file = None
+    old_remaining = 0
+    new_remaining = 0
+    old_number = 0
+    new_number = 0
+    for line in diff_text.splitlines():
+        if old_remaining > 0 or new_remaining > 0:
+            # Inside a hunk every line belongs to it, even one looking like a '--- ' header
+            if line.startswith('-'):
+                if old_file is not None:
+                    old_lines[old_file].append(str(old_number))
+                old_number += 1
+                old_remaining -= 1
+                continue
+            if line.startswith('+'):
+                if new_file is not None:
+                    new_lines[new_file].append(str(new_number))
+                new_number += 1
+                new_remaining -= 1
+                continue
+            if line.startswith(' '):
+                old_number += 1
+                new_number += 1
+                old_remaining -= 1
+                new_remaining -= 1
+                continue
+            if line.startswith('\\'):
+                continue
+            old_remaining = new_remaining = 0
+
+        if line.startswith('diff '):
+            old_file = new_file = None
+        elif line.startswith('--- '):
+            old_file = _diff_path(line)
+            if old_file is not None and old_file.endswith(extension):
+                old_lines.setdefault(old_file, [])
+            else:
+                old_file = None
+        elif line.startswith('+++ '):
+            new_file = _diff_path(line)
+            if new_file is not None and new_file.endswith(extension):
+                new_lines.setdefault(new_file, [])
+            else:
+                new_file = None
+        else:
+            match = _HUNK.match(line)
+            if match is not None:
+                old_number = int(match.group(1))
+                old_remaining = 1 if match.group(2) is None else int(match.group(2))
+                new_number = int(match.group(3))
+                new_remaining = 1 if match.group(4) is None else int(match.group(4))
+    return old_lines, new_lines
@@ -0,0 +1,120 @@
+import os, sys, sqlite3
+from array import array
+from scripts.lines import LINE_TYPECODE, parse_lines
+
+SIDES = ['vuln', 'fix']
+
+
+def pack_lines(lines):
+    # Little-endian int32 array, the stored form of a line list
+    lines = array(LINE_TYPECODE, parse_lines(lines))
+    if sys.byteorder == 'big':
+        lines.byteswap()
+    return lines.tobytes()
+
+
+def unpack_lines(blob):
+    lines = array(LINE_TYPECODE)
+    lines.frombytes(blob)
+    if sys.byteorder == 'big':
+        lines.byteswap()
+    return lines
+
+
+class IntermediateStore:
+    # Typed store for the per-revision tables that final_dict_as_table produces and combine_final_dataset_file
+    # consumes: one row per (side, project, vuln_id, tool, file) with its lines as a packed integer array.
+    # Filters on project, vuln_id and tool are answered from indexes instead of reading everything.
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._connection = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        state['_pid'] = None
+        return state
+
+    @property
+    def connection(self):
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.db_file, timeout=60)
+            self._connection.execute('CREATE TABLE IF NOT EXISTS findings '
+                                     '(side TEXT NOT NULL, position INTEGER NOT NULL, project TEXT, repo TEXT, '
+                                     'commit_hash TEXT, vuln_id TEXT, tool TEXT, file TEXT, lines BLOB, '
+                                     'fingerprint TEXT, PRIMARY KEY (side, position))')
+            columns = [row[1] for row in self._connection.execute('PRAGMA table_info(findings)')]
+            if 'fingerprint' not in columns:
+                self._connection.execute('ALTER TABLE findings ADD COLUMN fingerprint TEXT')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS findings_key '
+                                     'ON findings (side, project, vuln_id, tool, file)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS findings_tool ON findings (side, tool)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS outputs '
+                                     '(output TEXT, key TEXT, fingerprint TEXT, PRIMARY KEY (output, key))')
+            self._connection.commit()
+            self._pid = os.getpid()
+        return self._connection
+
+    def write_rows(self, side, rows, fingerprints=None):
+        # rows = [project, repo, commit, vuln_id, tool, file, lines], replaces everything stored for that side.
+        # fingerprints[i] is the fingerprint of the inputs rows[i] was computed from
+        if fingerprints is None:
+            fingerprints = [None] * len(rows)
+        with self.connection:
+            self.connection.execute('DELETE FROM findings WHERE side = ?', (side,))
+            self.connection.executemany('INSERT INTO findings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                        ((side, position, row[0], row[1], row[2], row[3], row[4], row[5],
+                                          pack_lines(row[6] if len(row) > 6 else []), fingerprint)
+                                         for position, (row, fingerprint) in enumerate(zip(rows, fingerprints))))
+
+    def has_side(self, side):
+        return self.connection.execute('SELECT 1 FROM findings WHERE side = ? LIMIT 1', (side,)).fetchone() is not None
+
+    def filter_clause(self, side, project=None, vuln_id=None, tool=None, file=None):
+        query = ' WHERE side = ?'
+        parameters = [side]
+        for column, value in [('project', project), ('vuln_id', vuln_id), ('tool', tool), ('file', file)]:
+            if value is not None:
+                query += ' AND {} = ?'.format(column)
+                parameters.append(value)
+        return query, parameters
+
+    def read_rows(self, side, sorted_by_key=False, **filters):
+        # Yields [project, repo, commit, vuln_id, tool, file, lines] in the order they were written, or with
+        # sorted_by_key=True in (project, vuln_id, tool, file) order straight off the findings_key index
+        query, parameters = self.filter_clause(side, **filters)
+        query = 'SELECT project, repo, commit_hash, vuln_id, tool, file, lines FROM findings' + query
+        if sorted_by_key:
+            query += ' ORDER BY project, vuln_id, tool, file, position'
+        else:
+            query += ' ORDER BY position'
+        for row in self.connection.execute(query, parameters):
+            yield list(row[:6]) + [unpack_lines(row[6])]
+
+    def project_vulns(self, side, **filters):
+        query, parameters = self.filter_clause(side, **filters)
+        return set(self.connection.execute('SELECT DISTINCT project, vuln_id FROM findings' + query, parameters))
+
+    def key_fingerprints(self, side):
+        # {(project, vuln_id): fingerprint} of the rows stored for that side
+        return dict(((project, vuln_id), fingerprint) for project, vuln_id, fingerprint in self.connection.execute(
+            'SELECT DISTINCT project, vuln_id, fingerprint FROM findings WHERE side = ? AND fingerprint IS NOT NULL',
+            (side,)))
+
+    def output_fingerprints(self, output):
+        # {key: fingerprint} recorded for the rows of a generated file
+        return dict(self.connection.execute('SELECT key, fingerprint FROM outputs WHERE output = ?', (output,)))
+
+    def set_output_fingerprints(self, output, fingerprints):
+        with self.connection:
+            self.connection.execute('DELETE FROM outputs WHERE output = ?', (output,))
+            self.connection.executemany('INSERT INTO outputs VALUES (?, ?, ?)',
+                                        ((output, key, fingerprint) for key, fingerprint in fingerprints.items()))
+
+    def load_dict(self, side, **filters):
+        # Same shape as DatasetGenerator.load_dict_output
+        to_return = dict()
+        for row in self.read_rows(side, **filters):
+            to_return['{}_{}_{}_{}'.format(row[0], row[3], row[4], row[5])] = row
+        return to_return
@@ -0,0 +1,223 @@
+import re, heapq, hashlib
+
+# LHDiff style line tracking (Asaduzzaman et al., ICSM 2013) done in process: unchanged lines come from an LCS
+# diff of the normalised lines, the remaining deleted lines are matched to added lines by a mix of content
+# and context similarity, candidates being preselected with simhash.
+CONTEXT_SIZE = 4
+CANDIDATES = 15
+CONTENT_WEIGHT = 0.6
+CONTEXT_WEIGHT = 0.4
+THRESHOLD = 0.45
+
+_WHITESPACE = re.compile(r'\s+')
+_TOKENS = re.compile(r'\w+|[^\w\s]')
+
+
+def split_lines(content):
+    if isinstance(content, bytes):
+        content = content.decode('utf8', errors='replace')
+    lines = content.split('\n')
+    if len(lines) > 0 and lines[-1] == '':
+        lines.pop()
+    return lines
+
+
+def normalise(line):
+    return _WHITESPACE.sub('', line)
+
+
+def lcs_matches(a, b):
+    # Myers O(ND) diff, returns the (i, j) pairs of equal lines on the shortest edit script
+    prefix = 0
+    while prefix < len(a) and prefix < len(b) and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < len(a) - prefix and suffix < len(b) - prefix and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+    matches = [(i, i) for i in range(prefix)]
+    middle_a = a[prefix:len(a) - suffix]
+    middle_b = b[prefix:len(b) - suffix]
+    matches.extend((prefix + i, prefix + j) for i, j in _myers(middle_a, middle_b))
+    matches.extend((len(a) - suffix + k, len(b) - suffix + k) for k in range(suffix))
+    return matches
+
+
+def _myers(a, b):
+    n, m = len(a), len(b)
+    if n == 0 or m == 0:
+        return []
+    offset = n + m
+    v = [0] * (2 * offset + 2)
+    trace = []
+    for d in range(offset + 1):
+        trace.append(v[offset - d:offset + d + 2])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, a, b, d)
+    return []
+
+
+def _backtrack(trace, a, b, d):
+    # trace[step] holds v[-step .. step + 1] as it was when that step started
+    matches = []
+    x, y = len(a), len(b)
+    for step in range(d, 0, -1):
+        previous = trace[step]
+        k = x - y
+        if k == -step or (k != step and previous[k - 1 + step] < previous[k + 1 + step]):
+            k_previous = k + 1
+        else:
+            k_previous = k - 1
+        x_previous = previous[k_previous + step]
+        y_previous = x_previous - k_previous
+        while x > x_previous and y > y_previous:
+            x -= 1
+            y -= 1
+            matches.append((x, y))
+        x, y = x_previous, y_previous
+    while x > 0 and y > 0:
+        x -= 1
+        y -= 1
+        matches.append((x, y))
+    matches.reverse()
+    return matches
+
+
+def _feature_hash(token, cache):
+    value = cache.get(token)
+    if value is None:
+        value = int.from_bytes(hashlib.blake2b(token.encode('utf8'), digest_size=8).digest(), 'big')
+        cache[token] = value
+    return value
+
+
+def simhash(tokens, cache):
+    weights = [0] * 64
+    for token in tokens:
+        value = _feature_hash(token, cache)
+        for bit in range(64):
+            if value >> bit & 1:
+                weights[bit] += 1
+            else:
+                weights[bit] -= 1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def levenshtein_similarity(a, b):
+    if a == b:
+        return 1.0
+    if len(a) == 0 or len(b) == 0:
+        return 0.0
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return 1.0 - float(previous[-1]) / max(len(a), len(b))
+
+
+def cosine_similarity(a, b):
+    if len(a) == 0 or len(b) == 0:
+        return 0.0
+    dot = sum(count * b.get(token, 0) for token, count in a.items())
+    if dot == 0:
+        return 0.0
+    norm_a = sum(count * count for count in a.values()) ** 0.5
+    norm_b = sum(count * count for count in b.values()) ** 0.5
+    return dot / (norm_a * norm_b)
+
+
+def _bag(tokens):
+    bag = dict()
+    for token in tokens:
+        bag[token] = bag.get(token, 0) + 1
+    return bag
+
+
+def _context_tokens(lines, index):
+    tokens = []
+    for line in lines[max(0, index - CONTEXT_SIZE):index] + lines[index + 1:index + 1 + CONTEXT_SIZE]:
+        tokens.extend(_TOKENS.findall(line))
+    return tokens
+
+
+class _Side:
+    # Content and context features of the unmatched lines of one file
+    def __init__(self, lines, indexes, cache):
+        self.content = dict()
+        self.context = dict()
+        self.content_hash = dict()
+        self.context_hash = dict()
+        for index in indexes:
+            content_tokens = _TOKENS.findall(lines[index])
+            context_tokens = _context_tokens(lines, index)
+            self.content[index] = lines[index]
+            self.context[index] = _bag(context_tokens)
+            self.content_hash[index] = simhash(content_tokens, cache)
+            self.context_hash[index] = simhash(context_tokens, cache)
+
+
+def track_lines(old_content, new_content):
+    # Returns {old line index: new line index}, 0-based, for every old line that could be tracked
+    old_lines = [normalise(line) for line in split_lines(old_content)]
+    new_lines = [normalise(line) for line in split_lines(new_content)]
+    mapping = dict(lcs_matches(old_lines, new_lines))
+
+    matched_new = set(mapping.values())
+    deleted = [i for i in range(len(old_lines)) if i not in mapping and old_lines[i] != '']
+    added = [j for j in range(len(new_lines)) if j not in matched_new and new_lines[j] != '']
+    if len(deleted) == 0 or len(added) == 0:
+        return mapping
+
+    cache = dict()
+    old_side = _Side(old_lines, deleted, cache)
+    new_side = _Side(new_lines, added, cache)
+    # The added lines' hashes are gathered once, every deleted line then only selects its CANDIDATES nearest
+    # instead of sorting all of them
+    added_hashes = [(j, new_side.content_hash[j], new_side.context_hash[j]) for j in added]
+    scored = []
+    for i in deleted:
+        content_hash = old_side.content_hash[i]
+        context_hash = old_side.context_hash[i]
+        distances = [(CONTENT_WEIGHT * bin(content_hash ^ added_content).count('1') +
+                      CONTEXT_WEIGHT * bin(context_hash ^ added_context).count('1'), j)
+                     for j, added_content, added_context in added_hashes]
+        for distance, j in heapq.nsmallest(CANDIDATES, distances):
+            score = CONTENT_WEIGHT * levenshtein_similarity(old_side.content[i], new_side.content[j]) + \
+                CONTEXT_WEIGHT * cosine_similarity(old_side.context[i], new_side.context[j])
+            if score >= THRESHOLD:
+                scored.append((-score, i, j))
+
+    # Conflicts go to the most similar pair
+    scored.sort()
+    used_new = set()
+    for score, i, j in scored:
+        if i in mapping or j in used_new:
+            continue
+        mapping[i] = j
+        used_new.add(j)
+    return mapping
+
+
+def compare_mappings(expected, actual):
+    # Agreement between two {old: new} mappings as (same, different, only expected, only actual)
+    same = different = 0
+    for old, new in expected.items():
+        if old in actual:
+            if actual[old] == new:
+                same += 1
+            else:
+                different += 1
+    only_expected = len([old for old in expected if old not in actual])
+    only_actual = len([old for old in actual if old not in expected])
+    return same, different, only_expected, only_actual
@@ -0,0 +1,88 @@
+import re
+from array import array
+
+LINE_TYPECODE = 'i'
+_NUMBERS = re.compile(r'-?\d+')
+_RANGES = re.compile(r'^\d+(-\d+)?(,\d+(-\d+)?)*$')
+# Tools whose reports count lines from 0, the slicer, the ground truth and the other tools count from 1. Their
+# lines, and the slices of them, stay 0-based in the datasets.
+ZERO_BASED_TOOLS = ['Tool_A', 'Tool_B']
+
+
+def line_base(tool):
+    # Number of the first line in the reports of tool
+    return 0 if tool in ZERO_BASED_TOOLS else 1
+
+
+def as_lines(values):
+    # Sorted array of distinct line numbers
+    return array(LINE_TYPECODE, sorted(set(values)))
+
+
+def parse_lines(value):
+    # Accepts every encoding a line list shows up in: the compact '45-46,155' form, Python reprs such as
+    # "['45', '46']", '[45, 46]' or '{45, 46}', plain '45, 46', or any iterable of numbers
+    if isinstance(value, array):
+        return value
+    if not isinstance(value, str):
+        return as_lines(int(line) for line in value)
+    value = value.strip()
+    if _RANGES.match(value):
+        lines = []
+        for part in value.split(','):
+            start, _, end = part.partition('-')
+            if end == '':
+                lines.append(int(start))
+            else:
+                lines.extend(range(int(start), int(end) + 1))
+        return as_lines(lines)
+    return as_lines(int(line) for line in _NUMBERS.findall(value))
+
+
+def encode_lines(lines):
+    # Compact form used in the intermediate files: runs of consecutive lines become ranges, '45-46,155'
+    lines = parse_lines(lines)
+    parts = []
+    i = 0
+    while i < len(lines):
+        j = i
+        while j + 1 < len(lines) and lines[j + 1] == lines[j] + 1:
+            j += 1
+        if j > i:
+            parts.append('{}-{}'.format(lines[i], lines[j]))
+        else:
+            parts.append(str(lines[i]))
+        i = j + 1
+    return ','.join(parts)
+
+
+def format_lines(lines):
+    # Form used in the published dataset files, "['45', '46']". The lines are sorted and listed once whatever order
+    # the alert files gave them in, datasets built before lines.py kept that order and any repeats.
+    return str([str(line) for line in parse_lines(lines)])
+
+
+def mapping_to_array(line_mapping):
+    # {'old': 'new'} as produced by Slicer.get_line_mapping -> array indexed by old line, -1 when unmapped
+    if len(line_mapping) == 0:
+        return array(LINE_TYPECODE)
+    pairs = [(int(old), int(new)) for old, new in line_mapping.items()]
+    table = array(LINE_TYPECODE, [-1]) * (max(old for old, new in pairs) + 1)
+    for old, new in pairs:
+        if old >= 0:
+            table[old] = new
+    return table
+
+
+def map_lines(mapping_table, lines):
+    # Returns (mapped lines, number of lines without a mapping)
+    size = len(mapping_table)
+    mapped = [mapping_table[line] if 0 <= line < size else -1 for line in lines]
+    converted = [line for line in mapped if line != -1]
+    return as_lines(converted), len(mapped) - len(converted)
+
+
+def difference(lines, to_remove):
+    # Lines of the first sorted array missing from the second one
+    to_remove = set(to_remove)
+    return array(LINE_TYPECODE, [line for line in lines if line not in to_remove])
@@ -0,0 +1,138 @@
+import os, sqlite3, json
+from collections import OrderedDict
+
+MAPPING_CACHE_FILE = 'mappings.sqlite'
+LRU_SIZE = 4096
+SCHEMA_VERSION = 1
+
+
+class MappingCache:
+    # Persistent cache of parent commits, ground truth diffs and line mappings with an in-process LRU in front of it.
+    # Mappings are keyed by (repo, commit_old, commit_new, file_old, file_new, start_index, reversed, engine)
+    # where the commits are the full hashes the mapping was computed between.
+    def __init__(self, cache_folder, lru_size=LRU_SIZE):
+        self.db_file = os.path.join(cache_folder, MAPPING_CACHE_FILE)
+        self.lru_size = lru_size
+        self.lru = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        state['_pid'] = None
+        state['lru'] = OrderedDict()
+        return state
+
+    @property
+    def connection(self):
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.db_file, timeout=60)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            if self._connection.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+                # Mappings written before they were keyed by the engine that computed them
+                self._connection.execute('DROP TABLE IF EXISTS mappings')
+                self._connection.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+            self._connection.execute('CREATE TABLE IF NOT EXISTS parents '
+                                     '(repo TEXT, rev TEXT, commit_hash TEXT, parent TEXT, PRIMARY KEY (repo, rev))')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS mappings '
+                                     '(repo TEXT, commit_old TEXT, commit_new TEXT, file_old TEXT, file_new TEXT, '
+                                     'start_index INTEGER, reversed INTEGER, engine TEXT, mapping TEXT, '
+                                     'PRIMARY KEY (repo, commit_old, commit_new, file_old, file_new, start_index, '
+                                     'reversed, engine))')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS ground_truth '
+                                     '(repo TEXT, commit_old TEXT, commit_new TEXT, vuln_lines TEXT, fix_lines TEXT, '
+                                     'PRIMARY KEY (repo, commit_old, commit_new))')
+            self._connection.commit()
+            self._pid = os.getpid()
+        return self._connection
+
+    def _remember(self, key, value):
+        self.lru[key] = value
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    def get_parent(self, repo, rev):
+        # Returns (commit_hash, parent) or None
+        key = ('parent', repo, rev)
+        if key in self.lru:
+            self.lru.move_to_end(key)
+            return self.lru[key]
+        row = self.connection.execute('SELECT commit_hash, parent FROM parents WHERE repo = ? AND rev = ?',
+                                      (repo, rev)).fetchone()
+        if row is not None:
+            self._remember(key, row)
+        return row
+
+    def put_parent(self, repo, rev, commit_hash, parent):
+        self.connection.execute('INSERT OR REPLACE INTO parents VALUES (?, ?, ?, ?)', (repo, rev, commit_hash, parent))
+        self.connection.commit()
+        self._remember(('parent', repo, rev), (commit_hash, parent))
+
+    def get_mapping(self, repo, commit_old, commit_new, file_old, file_new, start_index, reversed, engine):
+        key = ('mapping', repo, commit_old, commit_new, file_old, file_new, start_index, bool(reversed), engine)
+        if key in self.lru:
+            self.lru.move_to_end(key)
+            self.hits += 1
+            return self.lru[key]
+        row = self.connection.execute('SELECT mapping FROM mappings WHERE repo = ? AND commit_old = ? AND '
+                                      'commit_new = ? AND file_old = ? AND file_new = ? AND start_index = ? AND '
+                                      'reversed = ? AND engine = ?', key[1:-2] + (int(bool(reversed)), engine)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        mapping = json.loads(row[0])
+        self._remember(key, mapping)
+        return mapping
+
+    def put_mapping(self, repo, commit_old, commit_new, file_old, file_new, start_index, reversed, engine, mapping):
+        self.connection.execute('INSERT OR REPLACE INTO mappings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                (repo, commit_old, commit_new, file_old, file_new, start_index, int(bool(reversed)),
+                                 engine, json.dumps(mapping)))
+        self.connection.commit()
+        self._remember(('mapping', repo, commit_old, commit_new, file_old, file_new, start_index, bool(reversed),
+                        engine), mapping)
+
+    def get_ground_truth(self, repo, commit_old, commit_new):
+        # Returns (vuln_lines, fix_lines) or None
+        key = ('ground_truth', repo, commit_old, commit_new)
+        if key in self.lru:
+            self.lru.move_to_end(key)
+            return self.lru[key]
+        row = self.connection.execute('SELECT vuln_lines, fix_lines FROM ground_truth WHERE repo = ? AND '
+                                      'commit_old = ? AND commit_new = ?', key[1:]).fetchone()
+        if row is None:
+            return None
+        ground_truth = (json.loads(row[0]), json.loads(row[1]))
+        self._remember(key, ground_truth)
+        return ground_truth
+
+    def put_ground_truth(self, repo, commit_old, commit_new, vuln_lines, fix_lines):
+        self.connection.execute('INSERT OR REPLACE INTO ground_truth VALUES (?, ?, ?, ?, ?)',
+                                (repo, commit_old, commit_new, json.dumps(vuln_lines), json.dumps(fix_lines)))
+        self.connection.commit()
+        self._remember(('ground_truth', repo, commit_old, commit_new), (vuln_lines, fix_lines))
+
+    def invalidate(self, repo=None, commit=None):
+        # Drops everything, everything for a repository, or everything touching one commit of it
+        if repo is None:
+            self.connection.execute('DELETE FROM parents')
+            self.connection.execute('DELETE FROM mappings')
+            self.connection.execute('DELETE FROM ground_truth')
+        elif commit is None:
+            self.connection.execute('DELETE FROM parents WHERE repo = ?', (repo,))
+            self.connection.execute('DELETE FROM mappings WHERE repo = ?', (repo,))
+            self.connection.execute('DELETE FROM ground_truth WHERE repo = ?', (repo,))
+        else:
+            self.connection.execute('DELETE FROM parents WHERE repo = ? AND (rev = ? OR commit_hash = ?)',
+                                    (repo, commit, commit))
+            self.connection.execute('DELETE FROM mappings WHERE repo = ? AND (commit_old = ? OR commit_new = ?)',
+                                    (repo, commit, commit))
+            self.connection.execute('DELETE FROM ground_truth WHERE repo = ? AND (commit_old = ? OR commit_new = ?)',
+                                    (repo, commit, commit))
+        self.connection.commit()
+        self.lru.clear()
@@ -0,0 +1,94 @@
+import heapq, pickle, tempfile, itertools
+
+SORT_CHUNK_ROWS = 100000
+
+
+def combine_key(row):
+    # (project, vuln_id, tool, file), what the rows of both revision tables are joined on
+    return row[0], row[3], row[4], row[5]
+
+
+def _read_run(run):
+    while True:
+        try:
+            yield pickle.load(run)
+        except EOFError:
+            return
+
+
+def external_sort(rows, key, chunk_rows=SORT_CHUNK_ROWS, folder=None):
+    # Sorts rows with at most chunk_rows of them in memory: every sorted chunk is spilled to a temporary file and
+    # the files are merged back lazily. Stable, rows with the same key keep their input order.
+    rows = iter(rows)
+    runs = []
+    try:
+        while True:
+            chunk = list(itertools.islice(rows, chunk_rows))
+            chunk.sort(key=key)
+            if len(runs) == 0 and len(chunk) < chunk_rows:
+                yield from chunk
+                return
+            if len(chunk) == 0:
+                break
+            run = tempfile.TemporaryFile(prefix='sort_', dir=folder)
+            for row in chunk:
+                pickle.dump(row, run, pickle.HIGHEST_PROTOCOL)
+            run.seek(0)
+            runs.append(run)
+        yield from heapq.merge(*[_read_run(run) for run in runs], key=key)
+    finally:
+        for run in runs:
+            run.close()
+
+
+def unique_by(rows, key):
+    # Of consecutive rows with the same key keeps the last one, as a dict built from them would
+    previous = None
+    for row in rows:
+        if previous is not None and key(row) != key(previous):
+            yield previous
+        previous = row
+    if previous is not None:
+        yield previous
+
+
+def merge_join(left, right, key):
+    # Inner join of two iterables sorted by key with unique keys, yields (left_row, right_row) in key order
+    right = iter(right)
+    right_row = next(right, None)
+    for left_row in left:
+        left_key = key(left_row)
+        while right_row is not None and key(right_row) < left_key:
+            right_row = next(right, None)
+        if right_row is None:
+            return
+        if key(right_row) == left_key:
+            yield left_row, right_row
+
+
+def grouped(rows, key):
+    # (key, [rows]) of every run of consecutive rows sharing a key
+    for group_key, group in itertools.groupby(rows, key=key):
+        yield group_key, list(group)
+
+
+class SortedCursor:
+    # Forward-only lookups into (key, value) pairs sorted by key, for keys asked in increasing order. Stops at the
+    # first key out of order, so an input that turns out not to be sorted only answers less, never wrongly.
+    def __init__(self, items):
+        self.items = iter(items)
+        self.current = None
+        self.advance()
+
+    def advance(self):
+        previous = self.current
+        self.current = next(self.items, None)
+        if previous is not None and self.current is not None and self.current[0] <= previous[0]:
+            self.current = None
+
+    def find(self, key):
+        while self.current is not None and self.current[0] < key:
+            self.advance()
+        if self.current is not None and self.current[0] == key:
+            return self.current[1]
+        return None
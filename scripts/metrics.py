@@ -0,0 +1,139 @@
+import os, time, json, heapq, logging, functools
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SLOWEST_ROWS = 20
+
+
+class Metrics:
+    # Per-process stage timers, counters and, when profiling, the slowest rows. Pool workers inherit a copy
+    # of the parent's state when they are forked; the first record made in a new process starts from zero,
+    # and the worker hands what it collected back with drain() so the parent can merge() it.
+    def __init__(self):
+        self.owner = os.getpid()
+        self.log_file = None
+        self.profile = False
+        self.slowest = SLOWEST_ROWS
+        self.reset()
+
+    def reset(self):
+        self._pid = os.getpid()
+        self.timers = dict()  # stage -> [calls, seconds, longest]
+        self.counters = dict()
+        self.rows = []  # heap of the slowest (seconds, row)
+
+    def configure(self, log_file=None, profile=False, slowest=SLOWEST_ROWS):
+        self.log_file = log_file
+        self.profile = profile
+        self.slowest = slowest
+
+    def _check_process(self):
+        if self._pid != os.getpid():
+            self.reset()
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def add_time(self, stage, seconds, calls=1, longest=None):
+        self._check_process()
+        timer = self.timers.get(stage)
+        if timer is None:
+            self.timers[stage] = [calls, seconds, seconds if longest is None else longest]
+        else:
+            timer[0] += calls
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds if longest is None else longest)
+
+    def count(self, name, value=1):
+        self._check_process()
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def error(self, error_class):
+        self.count('error.{}'.format(error_class))
+
+    def row(self, row, seconds):
+        if not self.profile:
+            return
+        self._check_process()
+        entry = (seconds, str(row))
+        if len(self.rows) < self.slowest:
+            heapq.heappush(self.rows, entry)
+        elif entry > self.rows[0]:
+            heapq.heapreplace(self.rows, entry)
+
+    def drain(self):
+        # In a pool worker returns and forgets what was collected since the last drain, None in the owner
+        if os.getpid() == self.owner:
+            return None
+        self._check_process()
+        snapshot = {'timers': self.timers, 'counters': self.counters, 'rows': self.rows}
+        self.reset()
+        return snapshot
+
+    def merge(self, snapshot):
+        if snapshot is None:
+            return
+        for stage, (calls, seconds, longest) in snapshot['timers'].items():
+            self.add_time(stage, seconds, calls=calls, longest=longest)
+        for name, value in snapshot['counters'].items():
+            self.count(name, value)
+        for seconds, row in snapshot['rows']:
+            self.row(row, seconds)
+
+    def event(self, event, **fields):
+        # One JSON line per event in the metrics log, appended by whichever process records it
+        if self.log_file is None:
+            return
+        record = {'event': event, 'time': time.time(), 'pid': os.getpid()}
+        record.update(fields)
+        with open(self.log_file, 'a', encoding='utf8') as f_out:
+            f_out.write(json.dumps(record, default=str) + '\n')
+
+    def stage_done(self, stage, seconds, **fields):
+        self.event('stage', stage=stage, seconds=seconds, timers=self.timers, counters=self.counters, **fields)
+        logger.info('%s finished in %.2fs', stage, seconds)
+
+    def report(self):
+        lines = ['{:<36} {:>9} {:>11} {:>10}'.format('stage', 'calls', 'seconds', 'longest')]
+        for stage, (calls, seconds, longest) in sorted(self.timers.items(), key=lambda item: -item[1][1]):
+            lines.append('{:<36} {:>9} {:>11.3f} {:>10.3f}'.format(stage, calls, seconds, longest))
+        if len(self.counters) > 0:
+            lines.append('')
+            for name in sorted(self.counters):
+                lines.append('{:<36} {:>9}'.format(name, self.counters[name]))
+        if len(self.rows) > 0:
+            lines.append('')
+            lines.append('slowest {} rows'.format(len(self.rows)))
+            for seconds, row in sorted(self.rows, reverse=True):
+                lines.append('{:>10.3f}  {}'.format(seconds, row))
+        return '\n'.join(lines)
+
+    def write_profile(self):
+        self.event('profile', timers=self.timers, counters=self.counters,
+                   slowest_rows=sorted(self.rows, reverse=True))
+        logger.info('Profile\n%s', self.report())
+
+
+metrics = Metrics()
+
+
+def stage(name):
+    # Times every call of the decorated pipeline stage and logs a 'stage' event when it returns
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                metrics.add_time(name, seconds)
+                metrics.stage_done(name, seconds)
+        return wrapper
+    return decorator
@@ -0,0 +1,71 @@
+import os, threading, urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from scripts.git_reader import get_reader
+
+# Local stand-in for raw.githubusercontent.com: answers GET /<user>/<project>/<commit>/<path> from the
+# repositories found in a folder (one per project name). Used by the benchmarks and to test fetchers offline.
+
+
+class RawFileHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real endpoint
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        parts = urllib.parse.unquote(urllib.parse.urlparse(self.path).path).lstrip('/').split('/', 3)
+        if len(parts) < 4:
+            self.send_error(404)
+            return
+        user, project, commit, path = parts
+        with server.lock:
+            server.requests += 1
+            fail = server.fail_every > 0 and server.requests % server.fail_every == 0
+        if fail:
+            # Simulated rate limiting, so clients can exercise their retries
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        repo_folder = os.path.join(server.repos_folder, project)
+        content = None
+        if os.path.isdir(repo_folder):
+            content = get_reader(repo_folder).blob(commit, path)
+        if content is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RawFileServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, repos_folder, host='127.0.0.1', port=0, fail_every=0):
+        super().__init__((host, port), RawFileHandler)
+        self.repos_folder = repos_folder
+        self.fail_every = fail_every
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(self.server_address[0], self.server_address[1])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
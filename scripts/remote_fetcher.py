@@ -0,0 +1,199 @@
+import os, time, random, queue, asyncio, logging, http.client, urllib.parse, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from scripts.blob_store import project_name
+from scripts.metrics import metrics
+
+CONCURRENCY = 8
+RETRIES = 4
+BACKOFF = 0.5
+MAX_BACKOFF = 30
+TIMEOUT = 30
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MISSING_STATUSES = {404, 410}
+
+logger = logging.getLogger(__name__)
+
+
+class FetchError(Exception):
+    pass
+
+
+def raw_location(repo):
+    # (user, project) of a repository URL, for both https://github.com/user/project.git and git@github.com:user/project.git
+    user = os.path.basename(os.path.dirname(repo)).split(':')[-1]
+    project = os.path.basename(repo.split('.git')[0])
+    return user, project
+
+
+class ConnectionPool:
+    # Keep-alive connections to the raw file host, each one used by a single thread at a time
+    def __init__(self, url, timeout=TIMEOUT):
+        parts = urllib.parse.urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        metrics.count('remote.connections')
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def release(self, connection, reusable=True):
+        if reusable:
+            self.idle.put(connection)
+        else:
+            connection.close()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class RemoteFetcher:
+    # Downloads file revisions from a raw file endpoint (<raw_file_start>/<user>/<project>/<commit>/<path>) into
+    # the blob store. The downloads are blocking http.client calls, run in the threads of a ThreadPoolExecutor
+    # that an asyncio loop keeps at most `concurrency` requests in flight on, each over a pooled keep-alive
+    # connection; 429 and 5xx answers and connection errors are retried with exponential backoff. raw_file_start
+    # may also be a local folder with the same layout.
+    # resolve(repo, commit) gives the full sha of a commit, or None when it cannot tell: revisions are then stored
+    # under project and full sha like the ones read from a clone, and the endpoint is asked for the sha.
+    def __init__(self, raw_file_start, blob_store, concurrency=CONCURRENCY, retries=RETRIES, backoff=BACKOFF,
+                 timeout=TIMEOUT, resolve=None):
+        if '://' not in raw_file_start:
+            raw_file_start = 'file://{}'.format(urllib.request.pathname2url(os.path.abspath(raw_file_start)))
+        self.raw_file_start = raw_file_start
+        self.blob_store = blob_store
+        self.resolve = resolve
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.base_path = urllib.parse.urlsplit(raw_file_start).path.rstrip('/')
+        self.local = raw_file_start.startswith('file:')
+        self.pool = None if self.local else ConnectionPool(raw_file_start, timeout=timeout)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+
+    def revision(self, repo, commit):
+        if self.resolve is None:
+            return commit
+        return self.resolve(repo, commit) or commit
+
+    def url_path(self, repo, commit, path):
+        user, project = raw_location(repo)
+        return '{}/{}/{}/{}/{}'.format(self.base_path, user, project, commit, urllib.parse.quote(path))
+
+    def request(self, url_path):
+        # Blocking, runs in the executor: returns (status, body, Retry-After header)
+        if self.local:
+            try:
+                with open(urllib.request.url2pathname(url_path), 'rb') as f_in:
+                    return 200, f_in.read(), None
+            except FileNotFoundError:
+                return 404, b'', None
+        connection = self.pool.acquire()
+        try:
+            connection.request('GET', url_path, headers={'Accept-Encoding': 'identity'})
+            response = connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            raise
+        self.pool.release(connection, reusable=not response.will_close)
+        return response.status, body, response.getheader('Retry-After')
+
+    def delay(self, attempt, retry_after):
+        delay = self.backoff * 2 ** attempt * (1 + random.random())
+        if retry_after is not None and retry_after.strip().isdigit():
+            delay = max(delay, int(retry_after))
+        return min(delay, MAX_BACKOFF)
+
+    async def fetch(self, loop, executor, semaphore, url_path):
+        # Returns the contents, None if the file does not exist, raises FetchError once the retries run out
+        async with semaphore:
+            for attempt in range(self.retries + 1):
+                start = time.perf_counter()
+                try:
+                    status, body, retry_after = await loop.run_in_executor(executor, self.request, url_path)
+                    reason = status
+                except (OSError, http.client.HTTPException) as e:
+                    status, body, retry_after, reason = None, None, None, e
+                metrics.add_time('github_fetch', time.perf_counter() - start)
+                metrics.count('remote.requests')
+                if status == 200:
+                    metrics.count('bytes_fetched', len(body))
+                    return body
+                if status in MISSING_STATUSES:
+                    return None
+                if status is not None and status not in RETRY_STATUSES:
+                    raise FetchError('{} answered {}'.format(url_path, status))
+                if attempt < self.retries:
+                    metrics.count('remote.retries')
+                    logger.debug('Retrying %s after %s', url_path, reason)
+                    await asyncio.sleep(self.delay(attempt, retry_after))
+            raise FetchError('{} failed {} times, last with {}'.format(url_path, self.retries + 1, reason))
+
+    async def fetch_all(self, requests):
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return await asyncio.gather(*[self.fetch(loop, executor, semaphore, self.url_path(repo, commit, path))
+                                          for repo, commit, path in requests], return_exceptions=True)
+
+    def fetch_many(self, requests):
+        # requests = [(repo, commit, path)]; downloads them concurrently, stores what was found in the blob store
+        # and returns the contents in the same order, None for missing files and failed downloads
+        if len(requests) == 0:
+            return []
+        requests = [(repo, self.revision(repo, commit), path) for repo, commit, path in requests]
+        results = asyncio.run(self.fetch_all(requests))
+        contents = []
+        for (repo, commit, path), result in zip(requests, results):
+            if isinstance(result, Exception):
+                logger.error('An exeption occured, while trying to download %s %s from %s', commit, path,
+                             self.raw_file_start)
+                logger.error(str(result))
+                metrics.error('github_fetch')
+                result = None
+            elif result is None:
+                logger.warning('%s does not exist at %s in %s', path, commit, self.raw_file_start)
+                metrics.error('missing_file')
+            else:
+                self.blob_store.put(project_name(repo), commit, path, result)
+            contents.append(result)
+        self.blob_store.connection.commit()
+        self.blob_store.evict()
+        return contents
+
+    def cached(self, repo, commit, path):
+        return self.blob_store.read(project_name(repo), self.revision(repo, commit), path)
+
+    def cached_size(self, repo, commit, path):
+        return self.blob_store.stored_size(project_name(repo), self.revision(repo, commit), path)
+
+    def prefetch(self, requests):
+        # Downloads every (repo, commit, path) the blob store does not hold yet, returns how many were fetched
+        requests = list(dict.fromkeys(requests))
+        missing = [request for request in requests if self.cached(*request) is None]
+        metrics.count('remote.cache_hits', len(requests) - len(missing))
+        logger.info('Fetching %d files from %s, %d already stored', len(missing), self.raw_file_start,
+                    len(requests) - len(missing))
+        return sum(1 for content in self.fetch_many(missing) if content is not None)
+
+    def get(self, repo, commit, path):
+        content = self.cached(repo, commit, path)
+        if content is not None:
+            metrics.count('remote.cache_hits')
+            return content
+        return self.fetch_many([(repo, commit, path)])[0]
@@ -0,0 +1,112 @@
+import os, itertools, logging
+from scripts.metrics import metrics
+
+JVM_MEMORY = int(os.environ.get('SLICER_JVM_MEMORY', 1024 * 1024 * 1024))
+TINY_COST = 64 * 1024
+BATCH_SIZE = 32
+MEMINFO = '/proc/meminfo'
+
+logger = logging.getLogger(__name__)
+
+
+def available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def available_memory():
+    # Bytes of memory new processes can get without swapping, None where the platform does not tell. Linux counts
+    # reclaimable page cache in MemAvailable, free pages alone leave out most of a busy machine's memory.
+    try:
+        with open(MEMINFO, 'r') as f_in:
+            for line in f_in:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def worker_count(jvms_per_worker=1, jvm_memory=JVM_MEMORY):
+    # As many workers as there are cores the process may run on, as long as their slicer JVMs fit in free memory
+    workers = available_cpus()
+    memory = available_memory()
+    if memory is not None and jvm_memory > 0:
+        workers = min(workers, memory // (jvm_memory * max(1, jvms_per_worker)))
+    return max(1, workers)
+
+
+class CostScheduler:
+    # Runs function over items on a multiprocessing pool and yields the results in input order.
+    # Up to max_pending items are read ahead; each window is submitted most expensive first, as estimated by cost(item),
+    # so a huge task starts early instead of stalling the end of the run, and items cheaper than tiny_cost go
+    # together in batches of up to batch_size to save round trips.
+    # function(batch) gets a list of items and returns (results, metrics snapshot), one result per item.
+    def __init__(self, pool, function, cost, max_pending, tiny_cost=TINY_COST, batch_size=BATCH_SIZE):
+        self.pool = pool
+        self.function = function
+        self.cost = cost
+        self.max_pending = max(1, max_pending)
+        self.tiny_cost = tiny_cost
+        self.batch_size = batch_size
+        self.queued = dict()  # index -> (async result, indexes of its batch)
+        self.done = dict()
+
+    def apply(self, batch):
+        indexes = [index for index, item in batch]
+        result = self.pool.apply_async(self.function, ([item for index, item in batch],))
+        for index in indexes:
+            self.queued[index] = (result, indexes)
+        metrics.count('scheduler.batches')
+
+    def submit(self, window):
+        costs = sorted(((self.cost(item), index, item) for index, item in window), key=lambda entry: (-entry[0], entry[1]))
+        batch = []
+        batch_cost = 0
+        for cost, index, item in costs:
+            if cost >= self.tiny_cost:
+                self.apply([(index, item)])
+                continue
+            batch.append((index, item))
+            batch_cost += cost
+            if batch_cost >= self.tiny_cost or len(batch) >= self.batch_size:
+                self.apply(batch)
+                batch = []
+                batch_cost = 0
+        if len(batch) > 0:
+            self.apply(batch)
+
+    def collect(self, index):
+        result, indexes = self.queued[index]
+        results, snapshot = result.get()
+        metrics.merge(snapshot)
+        for batch_index, batch_result in zip(indexes, results):
+            self.done[batch_index] = batch_result
+            del self.queued[batch_index]
+
+    def run(self, items):
+        items = iter(items)
+        read = 0
+        written = 0
+        exhausted = False
+        while True:
+            # Topped up once half of the read ahead items are written, so every window has some choice of order
+            if not exhausted and read - written <= self.max_pending // 2:
+                wanted = self.max_pending - (read - written)
+                window = list(itertools.islice(items, wanted))
+                exhausted = len(window) < wanted
+                if len(window) > 0:
+                    self.submit(list(enumerate(window, read)))
+                    read += len(window)
+            if written == read:
+                if exhausted:
+                    return
+                continue
+            if written not in self.done:
+                self.collect(written)
+            yield self.done.pop(written)
+            written += 1
@@ -0,0 +1,250 @@
+import sys, csv, argparse, logging
+from scripts.dataset_index import open_dataset, AUGMENTED_DATASET, LINE_COLUMNS
+from scripts.lines import ZERO_BASED_TOOLS, line_base
+from scripts.metrics import metrics
+
+GROUND_TRUTH = 'ground_truth'
+# What an alert is compared with the ground truth as: its own lines, or the lightweight or pessimist slice of them
+SLICE_TYPES = ['raw', 'lightweight', 'pessimist']
+LEVELS = ['alert', 'tool', 'cve']
+
+logger = logging.getLogger(__name__)
+
+
+def ratio(numerator, denominator):
+    if denominator == 0:
+        return None
+    return numerator / denominator
+
+
+class AlertScore:
+    # One alert row (a tool's findings in one file) against the ground truth lines of the same file, CVE and side
+    __slots__ = ('project', 'vuln_id', 'side', 'slicetype', 'tool', 'file', 'alert_lines', 'ground_truth_lines',
+                 'overlap')
+
+    def __init__(self, project, vuln_id, side, slicetype, tool, file, alert_lines, ground_truth_lines, overlap):
+        self.project = project
+        self.vuln_id = vuln_id
+        self.side = side
+        self.slicetype = slicetype
+        self.tool = tool
+        self.file = file
+        self.alert_lines = alert_lines
+        self.ground_truth_lines = ground_truth_lines
+        self.overlap = overlap
+
+    @property
+    def precision(self):
+        return ratio(self.overlap, self.alert_lines)
+
+    @property
+    def recall(self):
+        return ratio(self.overlap, self.ground_truth_lines)
+
+
+class Score:
+    # Totals of a group of alerts. An alert hits when it shares a line with the ground truth, the others are the
+    # ones a filter would drop. precision is the share of the alert lines in the ground truth, recall the share of
+    # the ground truth lines of the group's CVEs that its alerts cover. Alerts without the slice asked for are only
+    # counted as unsliced.
+    __slots__ = ('alerts', 'hits', 'unsliced', 'alert_lines', 'overlap', 'ground_truth_lines', 'covered_lines')
+
+    def __init__(self):
+        self.alerts = 0
+        self.hits = 0
+        self.unsliced = 0
+        self.alert_lines = 0
+        self.overlap = 0
+        self.ground_truth_lines = 0
+        self.covered_lines = 0
+
+    @property
+    def filtered(self):
+        return self.alerts - self.hits
+
+    @property
+    def hit_rate(self):
+        return ratio(self.hits, self.alerts)
+
+    @property
+    def precision(self):
+        return ratio(self.overlap, self.alert_lines)
+
+    @property
+    def recall(self):
+        return ratio(self.covered_lines, self.ground_truth_lines)
+
+    def add(self, alert):
+        self.alerts += 1
+        self.alert_lines += alert.alert_lines
+        self.overlap += alert.overlap
+        if alert.overlap > 0:
+            self.hits += 1
+
+
+class Scorer:
+    # Scores every alert of a compiled dataset (see dataset_index) against its ground truth, for every slice type.
+    # Everything works on the string ids and packed line pool of the index: ground truth lines become one set per
+    # (project, vuln_id, side, file) and each alert is a single set intersection with it. Strings are only decoded
+    # for the rows reported. The ground truth counts lines from 1, the lines and slices of ZERO_BASED_TOOLS are
+    # shifted to match before they are compared with it.
+    def __init__(self, index, slice_types=SLICE_TYPES):
+        self.index = index
+        self.slice_types = slice_types
+        self.ground_truth = dict()
+        self.alerts = []
+        # {tool id: what its line numbers are shifted by}
+        self.shifts = dict()
+        for tool in ZERO_BASED_TOOLS:
+            tool_id = index.string_id(tool)
+            if tool_id is not None:
+                self.shifts[tool_id] = 1 - line_base(tool)
+        columns = index.columns
+        self.project, self.vuln_id, self.side, self.tool, self.file = [columns[field] for field in
+                                                                       ['project', 'vuln_id', 'side', 'tool', 'file']]
+        with metrics.timer('scoring'):
+            ground_truth_id = index.string_id(GROUND_TRUTH)
+            for position in range(len(index)):
+                if self.tool[position] == ground_truth_id:
+                    key = (self.project[position], self.vuln_id[position], self.side[position], self.file[position])
+                    self.ground_truth.setdefault(key, set()).update(index.line_view(0, position) or ())
+                else:
+                    self.alerts.append(position)
+        logger.info('%d alerts against the ground truth of %d files', len(self.alerts), len(self.ground_truth))
+
+    def column(self, slicetype):
+        return 0 if slicetype == 'raw' else LINE_COLUMNS.index(slicetype)
+
+    def alert_scores(self):
+        # (alert position, slice type, AlertScore or None when the alert has no such slice, ground truth lines it
+        # covers), in dataset order
+        empty = frozenset()
+        columns = [(slicetype, self.column(slicetype)) for slicetype in self.slice_types]
+        for position in self.alerts:
+            ground_truth = self.ground_truth.get((self.project[position], self.vuln_id[position], self.side[position],
+                                                  self.file[position]), empty)
+            for slicetype, column in columns:
+                lines = self.index.line_view(column, position)
+                if lines is None:
+                    yield position, slicetype, None, empty
+                    continue
+                # Slices may list a line twice, once as seed and once as sliced
+                shift = self.shifts.get(self.tool[position], 0)
+                lines = set(lines) if shift == 0 else set(line + shift for line in lines)
+                hit = ground_truth.intersection(lines)
+                yield position, slicetype, AlertScore(self.project[position], self.vuln_id[position],
+                                                      self.side[position], slicetype, self.tool[position],
+                                                      self.file[position], len(lines), len(ground_truth),
+                                                      len(hit)), hit
+
+    def ground_truth_lines(self):
+        # {(project, vuln_id, side): ground truth lines over all files}
+        lines = dict()
+        for (project, vuln_id, side, file), file_lines in self.ground_truth.items():
+            lines[(project, vuln_id, side)] = lines.get((project, vuln_id, side), 0) + len(file_lines)
+        return lines
+
+    def scores(self, level):
+        # {group: Score} with group (project, side, slicetype, tool) for level 'tool' and (project, side,
+        # slicetype, vuln_id) for level 'cve', all ids
+        with metrics.timer('scoring'):
+            scores = dict()
+            tools_of = dict()
+            # (slicetype, project, vuln_id, side, file) -> {tool: ground truth lines its alerts cover}
+            covered = dict()
+            for position, slicetype, alert, hit in self.alert_scores():
+                group = self.group(level, self.project[position], self.side[position], slicetype,
+                                   self.tool[position], self.vuln_id[position])
+                score = scores.get(group)
+                if score is None:
+                    score = scores[group] = Score()
+                if alert is None:
+                    score.unsliced += 1
+                    continue
+                score.add(alert)
+                tools_of.setdefault((self.project[position], self.side[position]), set()).add(self.tool[position])
+                if len(hit) > 0:
+                    key = (slicetype, alert.project, alert.vuln_id, alert.side, alert.file)
+                    covered.setdefault(key, dict()).setdefault(alert.tool, set()).update(hit)
+
+            ground_truth_lines = self.ground_truth_lines()
+            for (project, vuln_id, side), lines in ground_truth_lines.items():
+                if level == 'cve':
+                    groups = [self.group(level, project, side, slicetype, None, vuln_id)
+                              for slicetype in self.slice_types]
+                else:
+                    # A tool that reports nothing on a CVE misses all of its ground truth
+                    groups = [self.group(level, project, side, slicetype, tool, vuln_id)
+                              for slicetype in self.slice_types for tool in tools_of.get((project, side), ())]
+                for group in groups:
+                    if group not in scores:
+                        scores[group] = Score()
+                    scores[group].ground_truth_lines += lines
+            for (slicetype, project, vuln_id, side, file), tools in covered.items():
+                if level == 'cve':
+                    scores[self.group(level, project, side, slicetype, None, vuln_id)].covered_lines += \
+                        len(set().union(*tools.values()))
+                else:
+                    for tool, lines in tools.items():
+                        scores[self.group(level, project, side, slicetype, tool, vuln_id)].covered_lines += len(lines)
+        return scores
+
+    def group(self, level, project, side, slicetype, tool, vuln_id):
+        return project, side, slicetype, (tool if level == 'tool' else vuln_id)
+
+    def rows(self, level):
+        # Report rows with the ids decoded, in sorted order
+        string = self.index.string
+        if level == 'alert':
+            yield ['project', 'vuln_id', 'side', 'slicetype', 'tool', 'file', 'alert_lines', 'ground_truth_lines',
+                   'overlap', 'precision', 'recall']
+            for position, slicetype, alert, hit in self.alert_scores():
+                if alert is not None:
+                    yield [string(alert.project), string(alert.vuln_id), string(alert.side), slicetype,
+                           string(alert.tool), string(alert.file), alert.alert_lines, alert.ground_truth_lines,
+                           alert.overlap, format_ratio(alert.precision), format_ratio(alert.recall)]
+            return
+        yield ['project', 'side', 'slicetype', level if level == 'tool' else 'vuln_id', 'alerts', 'hits', 'filtered',
+               'unsliced', 'hit_rate', 'precision', 'recall', 'alert_lines', 'overlap', 'ground_truth_lines',
+               'covered_lines']
+        rows = []
+        for (project, side, slicetype, value), score in self.scores(level).items():
+            rows.append([string(project), string(side), slicetype, string(value), score.alerts, score.hits,
+                         score.filtered, score.unsliced, format_ratio(score.hit_rate), format_ratio(score.precision),
+                         format_ratio(score.recall), score.alert_lines, score.overlap, score.ground_truth_lines,
+                         score.covered_lines])
+        rows.sort(key=lambda row: (row[0], row[1], SLICE_TYPES.index(row[2]), row[3]))
+        for row in rows:
+            yield row
+
+
+def format_ratio(value):
+    return '' if value is None else '{:.4f}'.format(value)
+
+
+def score_dataset(dataset_file=AUGMENTED_DATASET, level='tool', slice_types=SLICE_TYPES, output=None):
+    # Writes the scores of the dataset at one level as CSV to output, stdout by default. The combined dataset can
+    # be scored too, its alerts only have 'raw' lines.
+    with open_dataset(dataset_file) as index:
+        scorer = Scorer(index, slice_types)
+        if output is None:
+            csv.writer(sys.stdout, delimiter=';').writerows(scorer.rows(level))
+            return
+        with open(output, 'w', newline='', encoding='utf8') as f_out:
+            csv.writer(f_out, delimiter=';').writerows(scorer.rows(level))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scores the tool alerts of the dataset against its ground truth')
+    parser.add_argument('dataset', nargs='?', default=AUGMENTED_DATASET)
+    parser.add_argument('--level', choices=LEVELS, default='tool', help='score every alert, or totals per tool or CVE')
+    parser.add_argument('--slice-types', default=','.join(SLICE_TYPES),
+                        help='comma separated among {}'.format(', '.join(SLICE_TYPES)))
+    parser.add_argument('--output', help='CSV file to write, stdout by default')
+    args = parser.parse_args()
+    logging.basicConfig(level='INFO', format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    slice_types = args.slice_types.split(',')
+    for slicetype in slice_types:
+        if slicetype not in SLICE_TYPES:
+            parser.error('unknown slice type {}'.format(slicetype))
+    score_dataset(args.dataset, level=args.level, slice_types=slice_types, output=args.output)
@@ -0,0 +1,135 @@
+import os, sqlite3, time
+from scripts.lines import parse_lines, encode_lines
+
+SLICE_CACHE_FILE = 'slices.sqlite'
+MAX_CACHE_SIZE = 512 * 1024 * 1024
+SCHEMA_VERSION = 1
+
+
+def decode_slice(value):
+    if value == '':
+        return []
+    return [int(line) for line in value.split(',')]
+
+
+class SliceCache:
+    # Persistent memo of slicer answers keyed by (sha of the file contents, seed lines, slice type, repoman jar sha).
+    # Seed and slice lines are the 1-based lines the slicer sees. Seeds are stored in the compact encode_lines form,
+    # so the same lines asked in another order or with another starting index share an entry; slices keep the
+    # order the slicer answered in, which shows in the sets written to the dataset. Entries are evicted least
+    # recently used first once the stored lines take more than max_size bytes.
+    # With superset_hits=True a seed set that has no entry of its own is answered from cached subsets of it
+    # covering all its lines: the union of their slices. That is only right for slicers whose slice of a set of
+    # lines is the union of the slices of its lines, so it is off by default.
+    # Hits only read: their access times are kept in memory and written with the new entries by commit(), so no
+    # write transaction is held while the slicer runs and other processes can store their slices meanwhile.
+    def __init__(self, cache_folder, max_size=MAX_CACHE_SIZE, superset_hits=False):
+        self.db_file = os.path.join(cache_folder, SLICE_CACHE_FILE)
+        self.max_size = max_size
+        self.superset_hits = superset_hits
+        self.size = None
+        self._touched = dict()
+        self._connection = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        state['_pid'] = None
+        state['size'] = None
+        state['_touched'] = dict()
+        return state
+
+    @property
+    def connection(self):
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.db_file, timeout=60)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            if self._connection.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+                self._connection.execute('DROP TABLE IF EXISTS slices')
+                self._connection.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+            self._connection.execute('CREATE TABLE IF NOT EXISTS slices '
+                                     '(content_sha TEXT, slicetype TEXT, jar_sha TEXT, seed TEXT, slice TEXT, '
+                                     'size INTEGER, last_used REAL, '
+                                     'PRIMARY KEY (content_sha, slicetype, jar_sha, seed))')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS slices_used ON slices (last_used)')
+            self._connection.commit()
+            self._pid = os.getpid()
+            self.size = None
+        return self._connection
+
+    def get(self, content_sha, slicetype, jar_sha, seed_lines):
+        # Returns the sliced lines as a list, or None when nothing cached answers that seed
+        seed = encode_lines(seed_lines)
+        row = self.connection.execute('SELECT slice FROM slices WHERE content_sha = ? AND slicetype = ? AND '
+                                      'jar_sha = ? AND seed = ?', (content_sha, slicetype, jar_sha, seed)).fetchone()
+        if row is not None:
+            self.touch(content_sha, slicetype, jar_sha, [seed])
+            return decode_slice(row[0])
+        if self.superset_hits:
+            return self.get_from_subsets(content_sha, slicetype, jar_sha, parse_lines(seed_lines))
+        return None
+
+    def get_from_subsets(self, content_sha, slicetype, jar_sha, seed_lines):
+        wanted = set(seed_lines)
+        covered = set()
+        sliced = dict()
+        used = []
+        for seed, slice_lines in self.connection.execute('SELECT seed, slice FROM slices WHERE content_sha = ? AND '
+                                                         'slicetype = ? AND jar_sha = ?',
+                                                         (content_sha, slicetype, jar_sha)):
+            lines = set(parse_lines(seed))
+            if lines <= wanted:
+                covered |= lines
+                sliced.update(dict.fromkeys(decode_slice(slice_lines)))
+                used.append(seed)
+        if len(used) == 0 or covered != wanted:
+            return None
+        self.touch(content_sha, slicetype, jar_sha, used)
+        return list(sliced)
+
+    def touch(self, content_sha, slicetype, jar_sha, seeds):
+        now = time.time()
+        for seed in seeds:
+            self._touched[(content_sha, slicetype, jar_sha, seed)] = now
+
+    def put(self, content_sha, slicetype, jar_sha, seed_lines, slice_lines):
+        seed = encode_lines(seed_lines)
+        slice_lines = ','.join(str(line) for line in slice_lines)
+        size = len(seed) + len(slice_lines)
+        self.connection.execute('INSERT OR REPLACE INTO slices VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                (content_sha, slicetype, jar_sha, seed, slice_lines, size, time.time()))
+        if self.size is not None:
+            self.size += size
+
+    def commit(self):
+        if len(self._touched) > 0:
+            self.connection.executemany('UPDATE slices SET last_used = ? WHERE content_sha = ? AND slicetype = ? AND '
+                                        'jar_sha = ? AND seed = ?',
+                                        [(used,) + key for key, used in self._touched.items()])
+            self._touched = dict()
+        self.connection.commit()
+        if self.size is None or self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM slices').fetchone()[0]
+        if total > self.max_size:
+            for content_sha, slicetype, jar_sha, seed, size in self.connection.execute(
+                    'SELECT content_sha, slicetype, jar_sha, seed, size FROM slices ORDER BY last_used').fetchall():
+                if total <= self.max_size * 0.9:
+                    break
+                self.connection.execute('DELETE FROM slices WHERE content_sha = ? AND slicetype = ? AND jar_sha = ? '
+                                        'AND seed = ?', (content_sha, slicetype, jar_sha, seed))
+                total -= size
+            self.connection.commit()
+        self.size = total
+
+    def invalidate(self, jar_sha=None):
+        # Drops everything, or everything computed with another jar than jar_sha
+        if jar_sha is None:
+            self.connection.execute('DELETE FROM slices')
+        else:
+            self.connection.execute('DELETE FROM slices WHERE jar_sha != ?', (jar_sha,))
+        self.connection.commit()
+        self.size = None
@@ -0,0 +1,140 @@
+import os, subprocess, select, queue, threading, atexit
+from scripts.metrics import metrics
+
+REQUEST_TIMEOUT = 120
+SERVER_SOURCE = 'SlicerServer.java'
+
+_pools = dict()
+
+
+class SlicerServerError(Exception):
+    pass
+
+
+class SlicerServer:
+    def __init__(self, slicer_folder, timeout=REQUEST_TIMEOUT):
+        self.slicer_folder = slicer_folder
+        self.timeout = timeout
+        self.process = None
+        self._buffer = b''
+
+    def start(self):
+        classpath = os.pathsep.join([os.path.join(self.slicer_folder, 'repoman-1.0-SNAPSHOT.jar'),
+                                     os.path.join(self.slicer_folder, 'libs', '*')])
+        cmd = ['java', '-cp', classpath, os.path.join(self.slicer_folder, SERVER_SOURCE)]
+        metrics.count('subprocess.slicer_server')
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, cwd=self.slicer_folder)
+        self._buffer = b''
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def restart(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+        self.start()
+
+    def _read_line(self):
+        fd = self.process.stdout.fileno()
+        while b'\n' not in self._buffer:
+            ready, _, _ = select.select([fd], [], [], self.timeout)
+            if not ready:
+                self.restart()
+                raise SlicerServerError('slicer request timed out after {}s'.format(self.timeout))
+            chunk = os.read(fd, 65536)
+            if chunk == b'':
+                raise SlicerServerError('slicer server exited')
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return line.decode()
+
+    def request(self, content, queries):
+        # content is the Java source as bytes, parsed once by the JVM for all queries = [(slicetype, lines)].
+        # Returns [(output, error)] in the order of the queries.
+        if not self.is_alive():
+            self.start()
+        request = '{}\t{}\n'.format(len(content), len(queries))
+        for slicetype, lines in queries:
+            request += '{}\t{}\n'.format(slicetype, ' '.join(lines))
+        try:
+            self.process.stdin.write(request.encode() + content)
+            self.process.stdin.flush()
+            responses = [self._read_line() for _ in queries]
+        except (BrokenPipeError, SlicerServerError) as e:
+            if not self.is_alive():
+                self.restart()
+            raise SlicerServerError(str(e))
+
+        to_return = []
+        for response in responses:
+            status, _, payload = response.partition(' ')
+            if status == 'OK':
+                to_return.append((payload, ''))
+            else:
+                to_return.append(('', payload or 'malformed response from slicer server'))
+        return to_return
+
+
+class SlicerServerPool:
+    def __init__(self, slicer_folder, workers=1, timeout=REQUEST_TIMEOUT, retries=1):
+        self.retries = retries
+        self.servers = [SlicerServer(slicer_folder, timeout=timeout) for _ in range(workers)]
+        self.idle = queue.Queue()
+        for server in self.servers:
+            self.idle.put(server)
+        self._closed = False
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def slice(self, content, slicetype, lines):
+        # Returns (output, error) like Popen.communicate() on the one-shot jar
+        return self.slice_batch(content, [(slicetype, lines)])[0]
+
+    def slice_batch(self, content, queries):
+        server = self.idle.get()
+        try:
+            attempt = 0
+            while True:
+                try:
+                    return server.request(content, queries)
+                except SlicerServerError as e:
+                    metrics.error('slicer_timeout' if 'timed out' in str(e) else 'slicer_crash')
+                    attempt += 1
+                    if 'timed out' in str(e) or attempt > self.retries:
+                        return [('', str(e))] * len(queries)
+        finally:
+            self.idle.put(server)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        for server in self.servers:
+            server.stop()
+
+
+def get_server_pool(slicer_folder, workers=1, timeout=REQUEST_TIMEOUT):
+    # One pool per process and configuration: the Slicer copies pool workers get with every task share the JVMs
+    # their process already started instead of starting new ones
+    key = (os.getpid(), os.path.abspath(slicer_folder), workers, timeout)
+    if key not in _pools:
+        _pools[key] = SlicerServerPool(slicer_folder, workers=workers, timeout=timeout)
+    return _pools[key]
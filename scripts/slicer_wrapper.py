@@ -1,76 +1,241 @@
-import os, subprocess, re, shutil, random
-import urllib.request
+import os, subprocess, re, shutil, tempfile, logging
+from scripts.slicer_server import get_server_pool, REQUEST_TIMEOUT, SERVER_SOURCE
+from scripts.blob_store import BlobStore, MAX_STORE_SIZE, git_blob_sha
+from scripts.remote_fetcher import RemoteFetcher, CONCURRENCY
+from scripts.slice_cache import SliceCache, MAX_CACHE_SIZE
+from scripts.git_reader import get_reader
+from scripts.mapping_cache import MappingCache
+from scripts.lines import parse_lines
+from scripts.ground_truth import parse_unified_diff
+from scripts.line_mapper import track_lines
+from scripts.fingerprints import fingerprint, file_sha
+from scripts.metrics import metrics
 
 cwd = os.path.dirname(__file__)
 DATA_FOLDER = os.path.normpath(os.path.join(cwd, '..', 'data'))
 SLICER_FOLDER = os.path.normpath(os.path.join(cwd, '..', 'slicer'))
 CACHE_FOLDER = os.path.normpath(os.path.join(DATA_FOLDER, 'cache'))
 
-GITHUB_FILE_RAW_START = 'https://raw.githubusercontent.com'
+# Where raw files are downloaded from; a local folder laid out as <user>/<project>/<commit>/<path> or an HTTP
+# stand-in such as scripts/raw_file_server.py can be used instead
+GITHUB_FILE_RAW_START = os.environ.get('GITHUB_FILE_RAW_START', 'https://raw.githubusercontent.com')
 
 WORKERS = 6
+# lhdiff.jar stays the default until scripts/compare_line_mappers.py shows the python mapper agrees with it
+LINE_MAPPERS = ['lhdiff', 'python']
+
+logger = logging.getLogger(__name__)
 
 if not os.path.exists(CACHE_FOLDER):
     os.makedirs(CACHE_FOLDER)
 
 
 class Slicer:
-    def __init__(self, slicer_folder=SLICER_FOLDER, cache_folder=CACHE_FOLDER):
+    def __init__(self, slicer_folder=SLICER_FOLDER, cache_folder=CACHE_FOLDER, use_server=True, server_workers=1,
+                 server_timeout=REQUEST_TIMEOUT, blob_store_size=MAX_STORE_SIZE, line_mapper='lhdiff',
+                 raw_file_start=GITHUB_FILE_RAW_START, remote=False, fetch_concurrency=CONCURRENCY,
+                 use_slice_cache=True, slice_cache_size=MAX_CACHE_SIZE, superset_hits=False):
+        if line_mapper not in LINE_MAPPERS:
+            raise ValueError('unknown line mapper {}, expected one of {}'.format(line_mapper, LINE_MAPPERS))
         self.slicer_folder = slicer_folder
+        self.line_mapper = line_mapper
+        self.raw_file_start = raw_file_start
+        # remote=True reads file revisions from raw_file_start instead of the local clone, commits and
+        # ground truth still come from the clone (or the mapping cache)
+        self.remote = remote
+        self.fetch_concurrency = fetch_concurrency
+        self.fetcher = None
         self.cache_folder = cache_folder
+        self.blob_store = BlobStore(cache_folder, max_size=blob_store_size)
+        self.mapping_cache = MappingCache(cache_folder)
+        self.use_slice_cache = use_slice_cache
+        self.slice_cache = SliceCache(cache_folder, max_size=slice_cache_size, superset_hits=superset_hits)
         self.slice_lines = set()
+        self.use_server = use_server
+        self.server_workers = server_workers
+        self.server_timeout = server_timeout
+        self.server_pool = None
+        self.jar_shas = dict()
+
+    def __getstate__(self):
+        # JVM handles cannot cross process boundaries, every worker process starts its own pool
+        state = self.__dict__.copy()
+        state['server_pool'] = None
+        state['fetcher'] = None
+        return state
+
+    def get_jar_sha(self):
+        # Slices depend on the repoman build and, when the server answers them, on SlicerServer.java reimplementing
+        # its Main; results are fingerprinted with both
+        if self.use_server not in self.jar_shas:
+            jar_sha = file_sha(os.path.join(self.slicer_folder, 'repoman-1.0-SNAPSHOT.jar'))
+            if self.use_server:
+                jar_sha = fingerprint(jar_sha, file_sha(os.path.join(self.slicer_folder, SERVER_SOURCE)))
+            self.jar_shas[self.use_server] = jar_sha
+        return self.jar_shas[self.use_server]
+
+    def get_server_pool(self):
+        if self.server_pool is None:
+            self.server_pool = get_server_pool(self.slicer_folder, workers=self.server_workers,
+                                               timeout=self.server_timeout)
+        return self.server_pool
+
+    def get_fetcher(self):
+        if self.fetcher is None or self.fetcher.raw_file_start != self.raw_file_start:
+            self.fetcher = RemoteFetcher(self.raw_file_start, self.blob_store, concurrency=self.fetch_concurrency,
+                                         resolve=self.resolve_revision)
+        return self.fetcher
+
+    def resolve_revision(self, repo, commit):
+        # Full sha of commit when there is a clone to ask, None otherwise
+        if not os.path.exists(self.repo_folder(repo)):
+            return None
+        return self.get_reader(repo).resolve(commit)
+
+    def prefetch_remote(self, revisions_paths):
+        # revisions_paths = [(repo, commit, path)], downloaded concurrently before the files are needed
+        return self.get_fetcher().prefetch(revisions_paths)
+
+    def scratch_folder(self):
+        # Unique per task, so any number of processes can slice and map at the same time
+        return tempfile.TemporaryDirectory(prefix='scratch_', dir=self.cache_folder)
+
+    def run_slicer(self, content, slicetype, lines):
+        if self.use_server:
+            with metrics.timer('slicer'):
+                return self.get_server_pool().slice(content, slicetype, lines)
+        metrics.count('subprocess.repoman')
+        with metrics.timer('slicer'), self.scratch_folder() as scratch:
+            file_path = os.path.join(scratch, 'Slice.java')
+            with open(file_path, 'wb') as f_out:
+                f_out.write(content)
+            cmd = 'java -jar {}/repoman-1.0-SNAPSHOT.jar -f {} -s {} -l {}'.format(self.slicer_folder, file_path, slicetype, ' '.join(lines)).split()
+            p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            output, error = p.communicate()
+        return output.decode(), error.decode()
+
+    def run_slicer_batch(self, content, queries):
+        if self.use_server:
+            metrics.count('slicer.queries', len(queries))
+            with metrics.timer('slicer'):
+                return self.get_server_pool().slice_batch(content, queries)
+        return [self.run_slicer(content, slicetype, lines) for slicetype, lines in queries]
 
     def get_slice(self, repo, path, lines, commit=None, path_relative=True, checkouted=False, slicetype='lightweight', starting_index=1):
         # if (not checkouted) and (not commit is None):
         #     self.checkout(repo, commit)
         # if path_relative:
-        save_filename = os.path.join(self.cache_folder, '{}_{}_{}'.format(commit, os.path.basename(path), random.randrange(1000)))
-
-        file_path = self.checkout_file_github(repo=repo, commit=commit, file=path, save_filename=save_filename)
-
-        if 'error' in file_path:
-            return 'error file'
-
-        lines_to_return = set()
-        lines = re.sub(r"[\[\]',;]", '', lines).split(' ')
-
-        for i in range(len(lines)):
-            try:
-                lines[i] = str(int(lines[i]) - starting_index + 1)
-            except Exception as e:
-                print(str(e))
-                return lines_to_return
-
-        cmd = 'java -jar {}/repoman-1.0-SNAPSHOT.jar -f {} -s {} -l {}'.format(self.slicer_folder, file_path, slicetype, ' '.join(lines)).split()
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        output, error = p.communicate()
-        error = error.decode().strip()
-
-        os.remove(file_path)
+        return self.get_slices_batch(repo, commit, path, [(lines, slicetype, starting_index)])[0]
+
+    def get_slices_batch(self, repo, commit, path, requests):
+        # requests = [(lines, slicetype, starting_index)]; the file is read once and the slicer parses it once
+        # for all of them. Every result follows the get_slice contract.
+        content = self.get_file_content(repo=repo, commit=commit, file=path)
+
+        if content is None:
+            return ['error file'] * len(requests)
+
+        results = [None] * len(requests)
+        queries = []
+        positions = []
+        for i, (lines, slicetype, starting_index) in enumerate(requests):
+            seed_lines = self.get_seed_lines(lines, starting_index)
+            if seed_lines is None:
+                results[i] = set()
+                continue
+            queries.append((slicetype, seed_lines))
+            positions.append(i)
 
+        if len(queries) > 0:
+            for position, lines in zip(positions, self.slice_queries(content, queries)):
+                if lines is None:
+                    results[position] = 'error file'
+                else:
+                    results[position] = set(line - 1 + requests[position][2] for line in lines)
+        return results
+
+    def slice_queries(self, content, queries):
+        # Sliced lines (1-based, as the slicer answers) of every (slicetype, seed_lines) query or None when slicing
+        # failed. Queries already answered for the same file contents and jar come from the slice cache, the others
+        # go to the slicer in one batch, each distinct one once, and the successful answers are cached.
+        if not self.use_slice_cache:
+            return [self.slice_output_lines(output, error) for output, error in self.run_slicer_batch(content, queries)]
+        content_sha = git_blob_sha(content)
+        jar_sha = self.get_jar_sha()
+        answers = [None] * len(queries)
+        missing = dict()
+        for i, (slicetype, seed_lines) in enumerate(queries):
+            key = (slicetype, tuple(seed_lines))
+            if key in missing:
+                missing[key].append(i)
+                continue
+            cached = self.slice_cache.get(content_sha, slicetype, jar_sha, seed_lines)
+            if cached is None:
+                missing[key] = [i]
+            else:
+                answers[i] = cached
+        metrics.count('slice_cache.hits', len(queries) - sum(len(positions) for positions in missing.values()))
+        metrics.count('slice_cache.misses', len(missing))
+        if len(missing) > 0:
+            keys = list(missing)
+            outputs = self.run_slicer_batch(content, [(slicetype, list(seed_lines)) for slicetype, seed_lines in keys])
+            for (slicetype, seed_lines), (output, error) in zip(keys, outputs):
+                lines = self.slice_output_lines(output, error)
+                for i in missing[(slicetype, seed_lines)]:
+                    answers[i] = lines
+                if lines is not None:
+                    self.slice_cache.put(content_sha, slicetype, jar_sha, seed_lines, lines)
+        self.slice_cache.commit()
+        return answers
+
+    def slice_output_lines(self, output, error):
+        error = error.strip()
         if error != '':
-            return 'error file'
+            metrics.error('slice')
+            return None
 
-        output = re.sub(r'[\[\] ]', '', output.decode().strip())
+        output = re.sub(r'[\[\] ]', '', output.strip())
         if 'error' in output.lower():
-            print(output)
+            logger.warning(output)
+            metrics.error('slice')
+            return None
+        if output == '':
+            return []
+        return [int(line) for line in output.split(',')]
+
+    def get_seed_lines(self, lines, starting_index):
+        lines = parse_lines(lines)
+        if len(lines) == 0:
+            return None
+        return [str(line - starting_index + 1) for line in lines]
+
+    def parse_slice_output(self, output, error, starting_index):
+        lines = self.slice_output_lines(output, error)
+        if lines is None:
             return 'error file'
-        if output != '':
-            for line in output.split(','):
-                lines_to_return.add(int(line) - 1 + starting_index)
+        return set(line - 1 + starting_index for line in lines)
 
-        return lines_to_return
+    def repo_folder(self, repo):
+        return os.path.join(self.cache_folder, os.path.basename(repo.split('.git')[0]))
 
     def clone(self, repo):
-        cmd = 'git clone {}'.format(repo)
-        folder = os.path.join(self.cache_folder, os.path.basename(repo.split('.git')[0]))
-        p = subprocess.Popen(cmd.split(), cwd=folder)
-        p.wait()
-
-    def checkout(self, repo, commit):
-        folder = os.path.join(self.cache_folder, os.path.basename(repo.split('.git')[0]))
+        cmd = 'git clone {} {}'.format(repo, self.repo_folder(repo))
+        metrics.count('subprocess.git')
+        with metrics.timer('git_clone'):
+            p = subprocess.Popen(cmd.split(), cwd=self.cache_folder)
+            p.wait()
+
+    def get_reader(self, repo):
+        folder = self.repo_folder(repo)
         if not os.path.exists(folder):
             self.clone(repo)
+        return get_reader(folder)
+
+    def checkout(self, repo, commit):
+        folder = self.repo_folder(repo)
+        reader = self.get_reader(repo)
+        if reader.resolve('HEAD') is not None and reader.resolve('HEAD') == reader.resolve(commit):
+            return
         cmd = 'git stash'
         p0 = subprocess.Popen(cmd.split(), cwd=folder)
         p0.wait()
@@ -78,113 +243,170 @@ class Slicer:
         p = subprocess.Popen(cmd.split(), cwd=folder)
         p.wait()
 
+    def get_ground_truth_pair(self, repo, commit_old, commit_new):
+        # Changed lines of both revisions out of a single 'git diff -U0 old new', cached per commit pair:
+        # returns (vuln_lines, fix_lines), the '-' side keyed by old path and the '+' side keyed by new path
+        folder = self.repo_folder(repo)
+        reader = self.get_reader(repo)
+        commit_old = reader.resolve(commit_old) or commit_old
+        commit_new = reader.resolve(commit_new) or commit_new
+        cached = self.mapping_cache.get_ground_truth(repo, commit_old, commit_new)
+        if cached is not None:
+            metrics.count('ground_truth.cache_hits')
+            return cached
+        metrics.count('ground_truth.cache_misses')
+
+        cmd = 'git diff --no-color --no-ext-diff -U0 {} {}'.format(commit_old, commit_new)
+        metrics.count('subprocess.git')
+        with metrics.timer('ground_truth'):
+            p = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=folder)
+            output, error = p.communicate()
+            if p.returncode != 0:
+                logger.warning('git diff %s %s failed: %s', commit_old, commit_new, error.decode().strip())
+                metrics.error('ground_truth')
+                return 'error getting lines for {} {}'.format(commit_old, commit_new)
+            vuln_lines, fix_lines = parse_unified_diff(output.decode('utf8', errors='replace'))
+        self.mapping_cache.put_ground_truth(repo, commit_old, commit_new, vuln_lines, fix_lines)
+        return vuln_lines, fix_lines
+
     def get_ground_truth(self, repo, commit_old, commit_new, vuln_revision=True):
-        folder = os.path.join(self.cache_folder, os.path.basename(repo.split('.git')[0]))
+        ground_truth = self.get_ground_truth_pair(repo, commit_old, commit_new)
+        if isinstance(ground_truth, str):
+            return ground_truth
+        return ground_truth[0] if vuln_revision else ground_truth[1]
+
+    def get_file_content(self, repo, commit, file):
+        # Reads the file from the blob store backed by the local clone, no network access involved unless remote
+        if self.remote:
+            with metrics.timer('file_content'):
+                content = self.get_fetcher().get(repo, commit, file)
+            if content is not None:
+                metrics.count('bytes_read', len(content))
+            return content
+        folder = self.repo_folder(repo)
         if not os.path.exists(folder):
             self.clone(repo)
-        linenum_script = os.path.join(self.slicer_folder, 'showlinenum.awk')
-
-        if vuln_revision:
-            cmd1 = 'git diff {} {}'.format(commit_new, commit_old)
+        with metrics.timer('file_content'):
+            content = self.blob_store.get(folder, commit, file)
+        if content is None:
+            logger.warning('%s does not exist at %s in %s', file, commit, folder)
+            metrics.error('missing_file')
+            return None
+        metrics.count('bytes_read', len(content))
+        return content
+
+    def file_size(self, repo, commit, file):
+        # Size in bytes of the file at that commit without reading it, 0 when unknown (not fetched yet when remote)
+        if self.remote:
+            size = self.get_fetcher().cached_size(repo, commit, file)
         else:
-            cmd1 = 'git diff {} {}'.format(commit_old, commit_new)
-        cmd2 = '{}'.format(linenum_script)
-
-        p1 = subprocess.Popen(cmd1.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=folder)
-        p2 = subprocess.Popen(cmd2.split(), stdin=p1.stdout, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        p1.stdout.close()  # Allow p1 to receive a SIGPIPE if p2 exits.
-
-        # p1_output, p1_error = p1.communicate()
-        p2_output, p2_error = p2.communicate()
-
-        # p1_error = p1_error.decode().strip()
-        p2_error = p2_error.decode().strip()
-        if p2_error != '':
-            # print(p1_error)
-            # print(p2_error)
-            return 'error getting lines for {} {}'.format(commit_old, commit_new)
-
-        output = p2_output.decode().splitlines()
-        to_return = dict()  # to_return[file] = [lines]
-        current_file = ''
-        for line in output:
-            if line.startswith('+++'):
-                if line.strip().endswith('.java'):
-                    current_file = line.split(' b/')[-1].strip()
-                    to_return[current_file] = []
-                else:
-                    current_file = ''
-            if current_file == '':
-                continue
-            if ':+ ' in line:
-                to_return[current_file].append(line[:line.index(':')])
-        return to_return
+            info = self.get_reader(repo).info('{}:{}'.format(commit, file))
+            size = None if info is None else info[2]
+        return size or 0
+
+    def checkout_file(self, repo, commit, file, save_filename):
+        content = self.get_file_content(repo, commit, file)
+        if content is None:
+            return 'error'
+        with open(save_filename, 'wb') as f_out:
+            f_out.write(content)
+        return save_filename
 
     def checkout_file_github(self, repo, commit, file, save_filename):
         # https://raw.githubusercontent.com/apache/tomcat/f00ac55c3b1dfa426967f7e657d1c0ef1aa07e51/TOMCAT-NEXT.txt
-        user = os.path.basename(os.path.dirname(repo))
-        project = os.path.basename(repo.split('.git')[0])
-        url = '{}/{}/{}/{}/{}'.format(GITHUB_FILE_RAW_START, user, project, commit, file)
-        # url = re.sub('//', '/', url)
-        try:
-            urllib.request.urlretrieve(url, save_filename)
-        except Exception as e:
-            print('An exeption occured, while trying to download {} {} from Github'.format(commit, file))
-            print('Download link tryied: {}'.format(url))
-            print(str(e))
+        content = self.get_fetcher().get(repo, commit, file)
+        if content is None:
             return 'error'
+        with open(save_filename, 'wb') as f_out:
+            f_out.write(content)
         return save_filename
 
-    def get_previous_commit_hash(self, repo, commit):
-        # git rev-list --parents -n 1 <commit>
-        folder = os.path.join(self.cache_folder, os.path.basename(repo.split('.git')[0]))
-        if not os.path.exists(folder):
-            self.clone(repo)
-        cmd = 'git rev-list --parents -n 1 {}'.format(commit)
-        p = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=folder)
-        output, error = p.communicate()
+    def resolve_commit_and_parent(self, repo, commit):
+        cached = self.mapping_cache.get_parent(repo, commit)
+        if cached is not None:
+            return cached
+        reader = self.get_reader(repo)
+        commit_hash = reader.resolve(commit)
+        previous = reader.previous_commit(commit)
+        if commit_hash is None or previous is None:
+            return commit, ''
+        self.mapping_cache.put_parent(repo, commit, commit_hash, previous)
+        return commit_hash, previous
 
-        return output.decode().split(' ')[-1].strip()
+    def get_previous_commit_hash(self, repo, commit):
+        # equivalent of git rev-list --parents -n 1 <commit>, answered by the repository's cat-file session
+        return self.resolve_commit_and_parent(repo, commit)[1]
 
-    def get_line_mapping(self, repo, commit_new, file_old, file_new, start_index=1, reversed=False):
-        folder = os.path.join(self.cache_folder, os.path.basename(repo.split('.git')[0]))
-        if not os.path.exists(folder):
-            self.clone(repo)
-        commit_old = self.get_previous_commit_hash(repo, commit_new)
+    def line_mapping_revisions(self, repo, commit_new, reversed=False):
+        # (commit_old, commit_new) a mapping is computed between, file_old is read at the first one
+        commit_new, commit_old = self.resolve_commit_and_parent(repo, commit_new)
         if reversed:
             commit_old, commit_new = commit_new, commit_old
-        #
-        # print(commit_old)
-        # print(commit_new)
+        return commit_old, commit_new
+
+    def get_line_mapping(self, repo, commit_new, file_old, file_new, start_index=1, reversed=False):
+        commit_old, commit_new = self.line_mapping_revisions(repo, commit_new, reversed)
+
+        mapping = self.mapping_cache.get_mapping(repo, commit_old, commit_new, file_old, file_new, start_index,
+                                                 reversed, self.line_mapper)
+        if mapping is not None:
+            metrics.count('line_mapping.cache_hits')
+            return mapping
+        metrics.count('line_mapping.cache_misses')
+        with metrics.timer('line_mapping'):
+            mapping = self.compute_line_mapping(repo, commit_old, commit_new, file_old, file_new, start_index)
+        if 'error' in mapping:
+            metrics.error('line_mapping')
+        else:
+            self.mapping_cache.put_mapping(repo, commit_old, commit_new, file_old, file_new, start_index, reversed,
+                                           self.line_mapper, mapping)
+        return mapping
+
+    def compute_line_mapping(self, repo, commit_old, commit_new, file_old, file_new, start_index=1):
         try:
-            old_filename = 'old.java'
-            response = self.checkout_file_github(repo, commit_old, file_old, os.path.join(self.cache_folder, old_filename))
-            if response == 'error':
+            # Same blob on both sides, nothing to read or diff
+            if not self.remote:
+                reader = self.get_reader(repo)
+                old_sha = reader.blob_sha(commit_old, file_old)
+                if old_sha is not None and old_sha == reader.blob_sha(commit_new, file_new):
+                    return 'equals'
+
+            old_content = self.get_file_content(repo, commit_old, file_old)
+            if old_content is None:
                 return 'error mapping'
 
-            new_filename = 'new.java'
-            response = self.checkout_file_github(repo, commit_new, file_new, os.path.join(self.cache_folder, new_filename))
-            if response == 'error':
+            new_content = self.get_file_content(repo, commit_new, file_new)
+            if new_content is None:
                 return 'error mapping'
 
         except Exception as e:
-            print('An error occurred while trying to get line mapping for {} {} {}'.format(repo, commit_new, file_new))
-            print(str(e))
+            logger.error('An error occurred while trying to get line mapping for %s %s %s', repo, commit_new, file_new)
+            logger.error(str(e))
             return 'error mapping'
 
-        cmd = 'diff {} {}'.format(old_filename, new_filename)
-        p = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=self.cache_folder)
-        output, error = p.communicate()
-        if output.decode().strip() == '':
+        if old_content == new_content:
             return 'equals'
-        # print(output.decode().strip())
 
-        cmd = 'java -jar {}/lhdiff.jar {} {}'.format(self.slicer_folder, old_filename, new_filename).split()
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=self.cache_folder)
-        output, error = p.communicate()
+        if self.line_mapper == 'lhdiff':
+            return self.run_lhdiff(old_content, new_content, start_index)
+        return dict((str(old + start_index), str(new + start_index))
+                    for old, new in track_lines(old_content, new_content).items())
+
+    def run_lhdiff(self, old_content, new_content, start_index=1):
+        with self.scratch_folder() as scratch:
+            old_filename = os.path.join(scratch, 'old.java')
+            new_filename = os.path.join(scratch, 'new.java')
+            with open(old_filename, 'wb') as f_out:
+                f_out.write(old_content)
+            with open(new_filename, 'wb') as f_out:
+                f_out.write(new_content)
+            cmd = 'java -jar {}/lhdiff.jar {} {}'.format(self.slicer_folder, old_filename, new_filename).split()
+            metrics.count('subprocess.lhdiff')
+            p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=scratch)
+            output, error = p.communicate()
         error = error.decode().strip()
         if error != '':
-            print('LHDiff error: {}'.format(error))
+            logger.error('LHDiff error: %s', error)
             return 'error mapping'
 
         output = re.sub(r'[\[\] ]', '', output.decode())
@@ -199,6 +421,4 @@ class Slicer:
                 except:
                     continue
 
-        os.remove(os.path.join(self.cache_folder, old_filename))
-        os.remove(os.path.join(self.cache_folder, new_filename))
         return to_return
@@ -0,0 +1,297 @@
+import os, json, time, socket, sqlite3, threading, logging
+from scripts.fingerprints import fingerprint
+from scripts.metrics import metrics
+
+QUEUE_FILE = 'queue.sqlite'
+RESULTS_FOLDER = 'results'
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+POLL_SECONDS = 5
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+logger = logging.getLogger(__name__)
+
+
+class TaskError(Exception):
+    # Raised by a handler whose result must not be kept, the task is failed and retried instead
+    pass
+
+
+def worker_name():
+    return '{}:{}:{}'.format(socket.gethostname(), os.getpid(), threading.get_ident())
+
+
+class Task:
+    __slots__ = ('id', 'kind', 'key', 'payload', 'attempts', 'owner')
+
+    def __init__(self, id, kind, key, payload, attempts, owner):
+        self.id = id
+        self.kind = kind
+        self.key = key
+        self.payload = payload
+        self.attempts = attempts
+        self.owner = owner
+
+
+class SqliteWorkQueue:
+    # Work queue in a folder on storage shared by every node: queue.sqlite holds the tasks, results/<kind>/ what
+    # they returned. Every lease (attempt and owner) writes its own result file and only the one still holding the
+    # lease gets the task marked done, so a worker that lost its lease cannot overwrite the result of the worker
+    # that took the task over. SQLite's file locks serialise the leases, so the journal
+    # stays in the default rollback mode; WAL needs shared memory that network filesystems do not provide.
+    # A task is leased for lease_seconds and the worker has to heartbeat before that runs out, otherwise the task
+    # is given to another worker. Every lease counts as an attempt, a task failing max_attempts times stays failed.
+    # Tasks are identified by (kind, key); enqueueing the same key again only resets it when its payload changed
+    # or it failed, so a coordinator rerun takes over what is already done.
+    def __init__(self, folder, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.folder = folder
+        self.db_file = os.path.join(folder, QUEUE_FILE)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        os.makedirs(folder, exist_ok=True)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_local'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        # One connection per process and thread, heartbeats run on their own thread
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.db_file, timeout=60, isolation_level=None)
+            connection.execute('CREATE TABLE IF NOT EXISTS tasks '
+                               '(id INTEGER PRIMARY KEY, kind TEXT, key TEXT, sequence INTEGER, payload TEXT, '
+                               'fingerprint TEXT, state TEXT, attempts INTEGER, owner TEXT, lease_expires REAL, '
+                               'error TEXT, UNIQUE (kind, key))')
+            connection.execute('CREATE INDEX IF NOT EXISTS tasks_state ON tasks (kind, state, sequence)')
+            connection.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def result_file(self, kind, task_id, attempt, owner):
+        return os.path.join(self.folder, RESULTS_FOLDER, kind,
+                            '{}.{}.json'.format(task_id, fingerprint(attempt, owner)[:16]))
+
+    def enqueue(self, kind, tasks):
+        # tasks = [(key, payload)] in the order their results are merged, payloads must be JSON serialisable.
+        # Returns how many tasks are (again) pending.
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute("DELETE FROM meta WHERE name = 'finished'")
+            pending = 0
+            for sequence, (key, payload) in enumerate(tasks):
+                payload_fingerprint = fingerprint(payload)
+                row = connection.execute('SELECT fingerprint, state FROM tasks WHERE kind = ? AND key = ?',
+                                         (kind, key)).fetchone()
+                if row is None:
+                    connection.execute('INSERT INTO tasks (kind, key, sequence, payload, fingerprint, state, attempts) '
+                                       'VALUES (?, ?, ?, ?, ?, ?, 0)',
+                                       (kind, key, sequence, json.dumps(payload), payload_fingerprint, PENDING))
+                elif row[0] != payload_fingerprint or row[1] == FAILED:
+                    connection.execute('UPDATE tasks SET sequence = ?, payload = ?, fingerprint = ?, state = ?, '
+                                       'attempts = 0, owner = NULL, lease_expires = NULL, error = NULL '
+                                       'WHERE kind = ? AND key = ?',
+                                       (sequence, json.dumps(payload), payload_fingerprint, PENDING, kind, key))
+                else:
+                    connection.execute('UPDATE tasks SET sequence = ? WHERE kind = ? AND key = ?',
+                                       (sequence, kind, key))
+                    continue
+                pending += 1
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        metrics.count('queue.enqueued', pending)
+        return pending
+
+    def lease(self, owner, kinds=None):
+        # The next pending task of one of kinds (any kind if None), or a task whose lease ran out; None if there is none
+        now = time.time()
+        query = 'SELECT id, kind, key, payload, attempts FROM tasks WHERE (state = ? OR (state = ? AND lease_expires < ?))'
+        parameters = [PENDING, LEASED, now]
+        if kinds is not None:
+            query += ' AND kind IN ({})'.format(', '.join('?' * len(kinds)))
+            parameters.extend(kinds)
+        query += ' ORDER BY sequence LIMIT 1'
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            expired = connection.execute('UPDATE tasks SET state = ?, error = ? WHERE state = ? AND lease_expires < ? '
+                                         'AND attempts >= ?', (FAILED, 'lease expired', LEASED, now,
+                                                               self.max_attempts)).rowcount
+            row = connection.execute(query, parameters).fetchone()
+            if row is not None:
+                connection.execute('UPDATE tasks SET state = ?, owner = ?, lease_expires = ?, attempts = ? '
+                                   'WHERE id = ?', (LEASED, owner, now + self.lease_seconds, row[4] + 1, row[0]))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        if expired > 0:
+            logger.warning('%d tasks failed after their last lease expired', expired)
+            metrics.count('queue.failed', expired)
+        if row is None:
+            return None
+        if row[4] > 0:
+            metrics.count('queue.retries')
+        metrics.count('queue.leased')
+        return Task(row[0], row[1], row[2], json.loads(row[3]), row[4] + 1, owner)
+
+    def heartbeat(self, task):
+        # Extends the lease, False if the task was given to another worker meanwhile
+        return self.connection.execute('UPDATE tasks SET lease_expires = ? WHERE id = ? AND owner = ? AND attempts = ? '
+                                       'AND state = ?', (time.time() + self.lease_seconds, task.id, task.owner,
+                                                         task.attempts, LEASED)).rowcount == 1
+
+    def complete(self, task, result):
+        # The result file of the attempt is in place before the task is marked done, so a done task always has its
+        # result. Returns False, and drops the file, when the lease was lost meanwhile.
+        filename = self.result_file(task.kind, task.id, task.attempts, task.owner)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp_filename = '{}.{}.{}.tmp'.format(filename, socket.gethostname(), os.getpid())
+        with open(tmp_filename, 'w', encoding='utf8') as f_out:
+            json.dump(result, f_out)
+        os.replace(tmp_filename, filename)
+        done = self.connection.execute('UPDATE tasks SET state = ?, lease_expires = NULL, error = NULL '
+                                       'WHERE id = ? AND owner = ? AND attempts = ? AND state = ?',
+                                       (DONE, task.id, task.owner, task.attempts, LEASED)).rowcount == 1
+        if not done:
+            logger.warning('Lease of task %s %s was lost before it completed', task.kind, task.key)
+            os.remove(filename)
+        return done
+
+    def fail(self, task, error):
+        # Back to pending for another attempt, or failed for good once max_attempts are used up
+        state = FAILED if task.attempts >= self.max_attempts else PENDING
+        failed = self.connection.execute('UPDATE tasks SET state = ?, owner = NULL, lease_expires = NULL, error = ? '
+                                         'WHERE id = ? AND owner = ? AND attempts = ? AND state = ?',
+                                         (state, error, task.id, task.owner, task.attempts, LEASED)).rowcount == 1
+        if not failed:
+            logger.warning('Lease of task %s %s was lost before it failed', task.kind, task.key)
+        elif state == FAILED:
+            logger.error('Task %s %s failed %d times: %s', task.kind, task.key, task.attempts, error)
+            metrics.count('queue.failed')
+
+    def counts(self, kind=None):
+        # {state: number of tasks}
+        query = 'SELECT state, COUNT(*) FROM tasks'
+        parameters = []
+        if kind is not None:
+            query += ' WHERE kind = ?'
+            parameters.append(kind)
+        return dict(self.connection.execute(query + ' GROUP BY state', parameters))
+
+    def unfinished(self, kind=None):
+        counts = self.counts(kind)
+        return counts.get(PENDING, 0) + counts.get(LEASED, 0)
+
+    def result(self, kind, key):
+        # What the task returned, None unless it is done
+        row = self.connection.execute('SELECT id, attempts, owner FROM tasks WHERE kind = ? AND key = ? AND state = ?',
+                                      (kind, key, DONE)).fetchone()
+        if row is None:
+            return None
+        with open(self.result_file(kind, row[0], row[1], row[2]), 'r', encoding='utf8') as f_in:
+            return json.load(f_in)
+
+    def results(self, kind):
+        # (key, result) of the done tasks of a kind in the order they were enqueued
+        for task_id, key, attempts, owner in self.connection.execute('SELECT id, key, attempts, owner FROM tasks '
+                                                                     'WHERE kind = ? AND state = ? ORDER BY sequence',
+                                                                     (kind, DONE)).fetchall():
+            with open(self.result_file(kind, task_id, attempts, owner), 'r', encoding='utf8') as f_in:
+                yield key, json.load(f_in)
+
+    def finish(self):
+        # Tells the workers nothing more will be enqueued, they stop once the queue is empty
+        self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('finished', '1')")
+
+    def finished(self):
+        return self.connection.execute("SELECT 1 FROM meta WHERE name = 'finished'").fetchone() is not None
+
+
+QUEUE_BACKENDS = {'sqlite': SqliteWorkQueue}
+
+
+def open_queue(location, **kwargs):
+    # location is <backend>://<address>, a plain path is a folder for the sqlite backend
+    backend, separator, address = location.partition('://')
+    if separator == '':
+        backend, address = 'sqlite', location
+    if backend not in QUEUE_BACKENDS:
+        raise ValueError('Unknown work queue backend {}, one of {} expected'.format(backend,
+                                                                                  ', '.join(sorted(QUEUE_BACKENDS))))
+    return QUEUE_BACKENDS[backend](address, **kwargs)
+
+
+class Heartbeat:
+    # Keeps the lease of a task alive from a background thread while it runs
+    def __init__(self, queue, task, interval=None):
+        self.queue = queue
+        self.task = task
+        self.interval = queue.lease_seconds / 3 if interval is None else interval
+        self.stopped = threading.Event()
+        self.lost = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if not self.queue.heartbeat(self.task):
+                self.lost = True
+                return
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        return False
+
+
+def work(queue, handler, kinds=None, owner=None, poll=POLL_SECONDS, idle_timeout=None, stop=None):
+    # Leases tasks and runs handler(kind, payload) on them until the coordinator has finished and the queue is
+    # empty, idle_timeout seconds passed without a task, or stop() is true. Returns how many tasks were completed.
+    owner = worker_name() if owner is None else owner
+    completed = 0
+    idle_since = time.monotonic()
+    while stop is None or not stop():
+        task = queue.lease(owner, kinds)
+        if task is None:
+            if queue.finished() and queue.unfinished() == 0:
+                break
+            if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                logger.info('No task for %ss, stopping', idle_timeout)
+                break
+            time.sleep(poll)
+            continue
+        logger.debug('Running task %s %s (attempt %d)', task.kind, task.key, task.attempts)
+        try:
+            with Heartbeat(queue, task) as heartbeat:
+                result = handler(task.kind, task.payload)
+        except TaskError as e:
+            logger.warning('Task %s %s failed: %s', task.kind, task.key, e)
+            queue.fail(task, '{}: {}'.format(type(e).__name__, e))
+        except Exception as e:
+            logger.exception('Task %s %s failed', task.kind, task.key)
+            queue.fail(task, '{}: {}'.format(type(e).__name__, e))
+        else:
+            if heartbeat.lost:
+                logger.warning('Lease of task %s %s was lost while it ran, its result is dropped', task.kind, task.key)
+            elif queue.complete(task, result):
+                completed += 1
+        idle_since = time.monotonic()
+    return completed
@@ -0,0 +1,160 @@
+import java.io.BufferedInputStream;
+import java.io.BufferedReader;
+import java.io.ByteArrayOutputStream;
+import java.io.DataInputStream;
+import java.io.EOFException;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.PrintStream;
+import java.io.StringReader;
+import java.nio.charset.StandardCharsets;
+import java.util.LinkedHashSet;
+import java.util.Set;
+
+import it.unitn.repoman.core.lang.LanguageFactory;
+import it.unitn.repoman.core.slicers.LightweightSlice;
+import it.unitn.repoman.core.slicers.LightweightSlicePessimist;
+import it.unitn.repoman.core.utils.printers.ConsolePrinterListener;
+
+// Long-lived front end for repoman: keeps one JVM warm and answers slice requests read from stdin.
+// The Java source is streamed in with the request, so no temporary files are involved, and it is parsed
+// once for all the slices requested on it.
+// Request:  <content length in bytes>\t<number of queries N>\n
+//           N times <slicetype>\t<line numbers separated with spaces>\n
+//           <content>
+// Response: N times  OK <repoman output>\n  or  ERROR <message>\n
+// A header that does not parse is answered with a single ERROR line and the server exits.
+// Run with: java -cp repoman-1.0-SNAPSHOT.jar SlicerServer.java (JDK 11+)
+public class SlicerServer {
+
+    private static String readHeader(DataInputStream in) throws IOException {
+        ByteArrayOutputStream header = new ByteArrayOutputStream();
+        int b;
+        while ((b = in.read()) != -1) {
+            if (b == '\n') {
+                return header.toString("UTF-8");
+            }
+            header.write(b);
+        }
+        return header.size() == 0 ? null : header.toString("UTF-8");
+    }
+
+    // -1 unless the field is a number of zero or more
+    private static int parseCount(String field) {
+        try {
+            int value = Integer.parseInt(field.trim());
+            return value < 0 ? -1 : value;
+        } catch (NumberFormatException e) {
+            return -1;
+        }
+    }
+
+    // Same normalisation as Main.readFile: every line terminated with a single '\n'
+    private static String normalise(String content) throws IOException {
+        BufferedReader reader = new BufferedReader(new StringReader(content));
+        StringBuffer buffer = new StringBuffer();
+        String line;
+        while ((line = reader.readLine()) != null) {
+            buffer.append(line);
+            buffer.append('\n');
+        }
+        return buffer.toString();
+    }
+
+    private static String slice(String sliceType, String lineNumbers) throws Exception {
+        Set<Integer> lines = new LinkedHashSet<>();
+        for (String line : lineNumbers.trim().split(" ")) {
+            lines.add(Integer.valueOf(Integer.parseInt(line)));
+        }
+        LightweightSlice slice;
+        if (sliceType.toLowerCase().equals("lightweight")) {
+            slice = new LightweightSlice(LanguageFactory.getRoot(), lines);
+        } else if (sliceType.toLowerCase().equals("pessimist")) {
+            slice = new LightweightSlicePessimist(LanguageFactory.getRoot(), lines);
+        } else {
+            return "ERROR: I do not recognise the requested slice type " + sliceType;
+        }
+        return new ConsolePrinterListener(LanguageFactory.getParser(), slice).toString();
+    }
+
+    private static String response(ByteArrayOutputStream stdout, ByteArrayOutputStream stderr) throws IOException {
+        String error = stderr.toString("UTF-8").trim();
+        if (!error.isEmpty()) {
+            return "ERROR " + error.replace('\n', ' ').replace('\r', ' ');
+        }
+        return "OK " + stdout.toString("UTF-8").trim().replace('\n', ' ').replace('\r', ' ');
+    }
+
+    public static void main(String[] args) throws Exception {
+        DataInputStream in = new DataInputStream(new BufferedInputStream(System.in));
+        PrintStream out = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        PrintStream originalErr = System.err;
+
+        String request;
+        while ((request = readHeader(in)) != null) {
+            if (request.isEmpty()) {
+                continue;
+            }
+            String[] header = request.split("\t", -1);
+            int length = parseCount(header[0]);
+            int count = header.length == 2 ? parseCount(header[1]) : -1;
+            if (length < 0 || count < 0) {
+                // Where the request ends is unknown, so the rest of the stream cannot be trusted: answer and exit,
+                // the client starts a new server
+                out.println("ERROR malformed request " + request);
+                return;
+            }
+            String[][] queries = new String[count][];
+            for (int i = 0; i < count; i++) {
+                String query = readHeader(in);
+                if (query == null) {
+                    return;
+                }
+                queries[i] = query.split("\t", -1);
+            }
+            // The content is always consumed before any query is answered, errors included
+            byte[] content = new byte[length];
+            try {
+                in.readFully(content);
+            } catch (EOFException e) {
+                return;
+            }
+
+            ByteArrayOutputStream parseErrors = new ByteArrayOutputStream();
+            System.setOut(new PrintStream(new ByteArrayOutputStream(), true, "UTF-8"));
+            System.setErr(new PrintStream(parseErrors, true, "UTF-8"));
+            try {
+                LanguageFactory.init("Java", normalise(new String(content, StandardCharsets.UTF_8)));
+            } catch (Throwable e) {
+                System.err.println(e);
+            } finally {
+                System.setOut(out);
+                System.setErr(originalErr);
+            }
+
+            for (String[] query : queries) {
+                ByteArrayOutputStream stdout = new ByteArrayOutputStream();
+                ByteArrayOutputStream stderr = new ByteArrayOutputStream();
+                stderr.write(parseErrors.toByteArray());
+                if (query.length != 2) {
+                    out.println("ERROR malformed query");
+                    continue;
+                }
+                if (parseErrors.size() == 0) {
+                    System.setOut(new PrintStream(stdout, true, "UTF-8"));
+                    System.setErr(new PrintStream(stderr, true, "UTF-8"));
+                    try {
+                        System.out.println(slice(query[0], query[1]));
+                    } catch (Throwable e) {
+                        System.err.println(e);
+                    } finally {
+                        System.setOut(out);
+                        System.setErr(originalErr);
+                    }
+                }
+                out.println(response(stdout, stderr));
+            }
+        }
+    }
+}
@@ -0,0 +1,22 @@
+import csv
+from scripts.dataset_index import open_dataset
+from scripts.metrics import metrics
+
+HEADER = ['project', 'repo', 'commit', 'vuln_id', 'vul_or_fix', 'tool', 'file', 'lines', 'lightweight', 'pessimist']
+
+
+def test_blank_and_malformed_rows_are_skipped(tmp_path):
+    dataset_file = str(tmp_path / 'dataset.csv')
+    with open(dataset_file, 'w', encoding='utf8', newline='') as f_out:
+        writer = csv.writer(f_out, delimiter=';')
+        writer.writerow(HEADER)
+        writer.writerow(['tomcat', 'repo', 'abc', 'CVE-1', 'vuln', 'Tool_A', 'A.java', "['3']", '{3, 4}', '{3}'])
+        f_out.write('\r\n')
+        writer.writerow(['tomcat', 'repo', 'abc', 'CVE-1', 'vuln', 'Tool_B'])
+        writer.writerow(['tomcat', 'repo', 'abc', 'CVE-1', 'vuln', 'Tool_C', 'A.java', "['5']", 'error file', '{5}'])
+    before = metrics.counters.get('error.dataset_index', 0)
+    with open_dataset(dataset_file) as index:
+        rows = [row.as_row() for row in index]
+    assert [row[5] for row in rows] == ['Tool_A', 'Tool_C']
+    assert rows[1][-2:] == ['error file', '{5}']
+    assert metrics.counters.get('error.dataset_index', 0) == before + 1
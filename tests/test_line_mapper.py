@@ -0,0 +1,73 @@
+import random
+from scripts.line_mapper import lcs_matches, track_lines
+
+OLD = '''class A {
+    int count = 0;
+
+    void add(int value) {
+        count += value;
+    }
+
+    int get() {
+        return count;
+    }
+}
+'''
+
+NEW = '''class A {
+    private int count = 0;
+
+    int get() {
+        return count;
+    }
+
+    void add(int value) {
+        count  +=  value;
+        log(value);
+    }
+}
+'''
+
+
+def lcs_length(a, b):
+    previous = [0] * (len(b) + 1)
+    for item in a:
+        current = [0]
+        for j, other in enumerate(b):
+            current.append(previous[j] + 1 if item == other else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+def test_lcs_matches_known_example():
+    # Example of Myers' paper, an edit script of 5
+    assert lcs_matches(list('abcabba'), list('cbabac')) == [(2, 0), (3, 2), (4, 3), (6, 4)]
+
+
+def test_lcs_matches_empty_and_equal():
+    assert lcs_matches([], ['a']) == []
+    assert lcs_matches(['a'], []) == []
+    assert lcs_matches(['a', 'b'], ['a', 'b']) == [(0, 0), (1, 1)]
+
+
+def test_lcs_matches_is_a_longest_common_subsequence():
+    generator = random.Random(4)
+    for _ in range(200):
+        a = [generator.choice('abcd') for _ in range(generator.randint(0, 30))]
+        b = [generator.choice('abcd') for _ in range(generator.randint(0, 30))]
+        matches = lcs_matches(a, b)
+        assert all(a[i] == b[j] for i, j in matches)
+        assert all(i1 < i2 and j1 < j2 for (i1, j1), (i2, j2) in zip(matches, matches[1:]))
+        assert len(matches) == lcs_length(a, b)
+
+
+def test_track_lines_mapping():
+    assert track_lines(OLD, NEW) == {0: 0, 1: 1, 2: 2, 3: 7, 4: 8, 5: 5, 7: 3, 8: 4, 9: 10, 10: 11}
+
+
+def test_track_lines_ignores_whitespace_and_accepts_bytes():
+    assert track_lines(b'a = 1;\nb = 2;\n', b'a  =  1;\n\tb = 2;\n') == {0: 0, 1: 1}
+
+
+def test_track_lines_leaves_unrelated_lines_unmapped():
+    assert track_lines('x();\n', 'throw new IllegalStateException("message");\n') == {}
@@ -0,0 +1,77 @@
+import csv
+from scripts.dataset_generator import DatasetGenerator
+from scripts.dataset_index import open_dataset
+from scripts.lines import ZERO_BASED_TOOLS
+from scripts.scoring import Scorer
+from scripts.slicer_wrapper import Slicer
+
+HEADER = ['project', 'repo', 'commit', 'vuln_id', 'vul_or_fix', 'tool', 'file', 'LoC_vuln', 'LoC_sliced_lightweight',
+          'LoC_sliced_pessimist']
+
+
+def write_dataset(path, rows):
+    with open(path, 'w', newline='', encoding='utf8') as f_out:
+        writer = csv.writer(f_out, delimiter=';')
+        writer.writerow(HEADER)
+        for tool, lines, lightweight, pessimist in rows:
+            writer.writerow(['tomcat', 'repo', 'c0ffee', 'CVE-1', 'vuln', tool, 'java/A.java', lines, lightweight,
+                             pessimist])
+
+
+def overlaps(tmp_path, rows):
+    dataset = str(tmp_path / 'alerts-dataset.csv')
+    write_dataset(dataset, rows)
+    with open_dataset(dataset) as index:
+        scorer = Scorer(index)
+        return [(index.string(alert.tool), alert.slicetype, alert.overlap)
+                for position, slicetype, alert, hit in scorer.alert_scores()]
+
+
+def test_zero_based_tools_are_shifted_onto_the_ground_truth(tmp_path):
+    # The ground truth is lines 10 and 11, counted from 1. Tool_A reports them as 9 and 10, Tool_C as 10 and 11.
+    zero_based = ZERO_BASED_TOOLS[0]
+    rows = [('ground_truth', "['10', '11']", 'error file', 'error file'),
+            (zero_based, "['9', '10']", '{9, 10, 20}', '{9}'),
+            ('Tool_C', "['10', '11']", '{10, 11, 21}', '{10}')]
+    assert overlaps(tmp_path, rows) == [(zero_based, 'raw', 2), (zero_based, 'lightweight', 2),
+                                        (zero_based, 'pessimist', 1), ('Tool_C', 'raw', 2),
+                                        ('Tool_C', 'lightweight', 2), ('Tool_C', 'pessimist', 1)]
+
+
+def test_zero_based_line_past_the_ground_truth_misses(tmp_path):
+    # Line 11 of a zero-based tool is line 12 of the file
+    rows = [('ground_truth', "['11']", 'error file', 'error file'),
+            (ZERO_BASED_TOOLS[0], "['11']", '{11}', '{11}')]
+    assert [overlap for tool, slicetype, overlap in overlaps(tmp_path, rows)] == [0, 0, 0]
+
+
+class StubSlicer(Slicer):
+    # Answers every query with lines 10 and 20 of the file, counted from 1 like the slicer does
+    def __init__(self, cache_folder):
+        super().__init__(cache_folder=cache_folder, use_server=False, use_slice_cache=False)
+        self.seeds = []
+
+    def get_file_content(self, repo, commit, file):
+        return b'class A {}'
+
+    def run_slicer_batch(self, content, queries):
+        self.seeds.extend(seed_lines for slicetype, seed_lines in queries)
+        return [('[10, 20]', '')] * len(queries)
+
+
+def test_zero_based_rows_are_sliced_and_scored_on_the_lines_of_the_file(tmp_path):
+    # Line 10 of the file is reported as 9 by Tool_A and as 10 by Tool_C, both must seed and hit line 10
+    generator = DatasetGenerator(input_revisions=str(tmp_path / 'revisions.csv'),
+                                 input_ground_truth=str(tmp_path / 'ground_truth.csv'),
+                                 intermediate_store=str(tmp_path / 'store.sqlite'),
+                                 alerts_folder=str(tmp_path / 'alerts'), cache_folder=str(tmp_path))
+    generator.slicer = StubSlicer(str(tmp_path))
+    zero_based = ZERO_BASED_TOOLS[0]
+    block = [(['tomcat', 'repo', 'c0ffee', 'CVE-1', 'vuln', tool, 'java/A.java', lines], None)
+             for tool, lines in [(zero_based, "['9']"), ('Tool_C', "['10']")]]
+    rows = generator._augment_helper(block)
+    assert generator.slicer.seeds == [['10']] * 4
+    assert [row[-2:] for row in rows] == [['{9, 19}', '{9, 19}'], ['{10, 20}', '{10, 20}']]
+    scored = [('ground_truth', "['10']", 'error file', 'error file')] + [tuple(row[5:6] + row[7:]) for row in rows]
+    assert overlaps(tmp_path, scored) == [(tool, slicetype, 1) for tool in [zero_based, 'Tool_C']
+                                          for slicetype in ['raw', 'lightweight', 'pessimist']]
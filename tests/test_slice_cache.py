@@ -0,0 +1,30 @@
+import time
+from scripts.slice_cache import SliceCache
+
+
+def test_hit_holds_no_write_transaction(tmp_path):
+    # Two workers on one cache: a hit of the first must not keep the second from storing while the first slices
+    first = SliceCache(str(tmp_path))
+    second = SliceCache(str(tmp_path))
+    second.connection.execute('PRAGMA busy_timeout = 100')
+    first.put('content', 'lightweight', 'jar', ['3'], [3, 4])
+    first.commit()
+    assert first.get('content', 'lightweight', 'jar', ['3']) == [3, 4]
+    assert not first.connection.in_transaction
+    second.put('content', 'pessimist', 'jar', ['3'], [1, 3])
+    second.commit()
+    assert first.get('content', 'pessimist', 'jar', ['3']) == [1, 3]
+    first.commit()
+
+
+def test_hits_are_recorded_on_commit(tmp_path):
+    cache = SliceCache(str(tmp_path))
+    cache.put('content', 'lightweight', 'jar', ['3'], [3])
+    cache.commit()
+    used = cache.connection.execute('SELECT last_used FROM slices').fetchone()[0]
+    time.sleep(0.01)
+    cache.get('content', 'lightweight', 'jar', [3])
+    other = SliceCache(str(tmp_path))
+    assert other.connection.execute('SELECT last_used FROM slices').fetchone()[0] == used
+    cache.commit()
+    assert other.connection.execute('SELECT last_used FROM slices').fetchone()[0] > used
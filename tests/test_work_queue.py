@@ -0,0 +1,134 @@
+import os, time
+from scripts.work_queue import SqliteWorkQueue, Heartbeat, TaskError, work, open_queue, PENDING, LEASED, DONE, FAILED
+
+
+def make_queue(tmp_path, **kwargs):
+    return SqliteWorkQueue(str(tmp_path / 'queue'), **kwargs)
+
+
+def test_lease_complete_and_results_in_enqueue_order(tmp_path):
+    queue = make_queue(tmp_path)
+    assert queue.enqueue('kind', [('b', [1]), ('a', [2])]) == 2
+    first = queue.lease('worker')
+    assert (first.key, first.payload, first.attempts) == ('b', [1], 1)
+    second = queue.lease('worker')
+    assert second.key == 'a'
+    assert queue.lease('worker') is None
+    assert queue.counts() == {LEASED: 2}
+    assert queue.complete(second, 'second')
+    assert queue.complete(first, 'first')
+    assert queue.result('kind', 'a') == 'second'
+    assert list(queue.results('kind')) == [('b', 'first'), ('a', 'second')]
+    assert queue.unfinished() == 0
+
+
+def test_lease_only_the_kinds_asked_for(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue('one', [('a', None)])
+    queue.enqueue('two', [('b', None)])
+    assert queue.lease('worker', kinds=['two']).kind == 'two'
+    assert queue.lease('worker', kinds=['two']) is None
+
+
+def test_enqueue_again_keeps_done_tasks_unless_their_payload_changed(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue('kind', [('a', 1), ('b', 1)])
+    for _ in range(2):
+        task = queue.lease('worker')
+        queue.complete(task, task.key)
+    assert queue.enqueue('kind', [('a', 1), ('b', 2)]) == 1
+    assert queue.result('kind', 'a') == 'a'
+    assert queue.result('kind', 'b') is None
+    assert queue.lease('worker').payload == 2
+
+
+def test_fail_retries_until_max_attempts(tmp_path):
+    queue = make_queue(tmp_path, max_attempts=2)
+    queue.enqueue('kind', [('a', None)])
+    task = queue.lease('worker')
+    queue.fail(task, 'first')
+    assert queue.counts() == {PENDING: 1}
+    task = queue.lease('worker')
+    assert task.attempts == 2
+    queue.fail(task, 'second')
+    assert queue.counts() == {FAILED: 1}
+    assert queue.lease('worker') is None
+    # A failed task is pending again once enqueued again
+    assert queue.enqueue('kind', [('a', None)]) == 1
+    assert queue.lease('worker').attempts == 1
+
+
+def test_expired_lease_goes_to_another_worker_and_the_first_result_is_dropped(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=0.05)
+    queue.enqueue('kind', [('a', None)])
+    lost = queue.lease('slow')
+    time.sleep(0.1)
+    taken_over = queue.lease('fast')
+    assert (taken_over.key, taken_over.attempts) == ('a', 2)
+    assert not queue.heartbeat(lost)
+    assert queue.heartbeat(taken_over)
+    assert queue.complete(taken_over, 'fast')
+    assert not queue.complete(lost, 'slow')
+    assert queue.result('kind', 'a') == 'fast'
+    assert len(os.listdir(os.path.dirname(queue.result_file('kind', taken_over.id, 2, 'fast')))) == 1
+
+
+def test_lost_lease_cannot_fail_the_task_of_its_new_owner(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=0.05)
+    queue.enqueue('kind', [('a', None)])
+    lost = queue.lease('slow')
+    time.sleep(0.1)
+    queue.lease('fast')
+    queue.fail(lost, 'too late')
+    assert queue.counts() == {LEASED: 1}
+
+
+def test_last_attempt_expiring_fails_the_task(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=0.05, max_attempts=1)
+    queue.enqueue('kind', [('a', None)])
+    queue.lease('worker')
+    time.sleep(0.1)
+    assert queue.lease('worker') is None
+    assert queue.counts() == {FAILED: 1}
+
+
+def test_heartbeat_keeps_the_lease(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=0.2)
+    queue.enqueue('kind', [('a', None)])
+    task = queue.lease('worker')
+    with Heartbeat(queue, task, interval=0.05) as heartbeat:
+        time.sleep(0.4)
+        assert queue.lease('other') is None
+    assert not heartbeat.lost
+    assert queue.complete(task, None)
+
+
+def test_finish_is_cleared_by_enqueue(tmp_path):
+    queue = make_queue(tmp_path)
+    assert not queue.finished()
+    queue.finish()
+    assert queue.finished()
+    queue.enqueue('kind', [('a', None)])
+    assert not queue.finished()
+
+
+def test_work_runs_until_finished_and_failed_handlers_are_retried(tmp_path):
+    queue = make_queue(tmp_path, max_attempts=2)
+    queue.enqueue('kind', [('ok', 1), ('error', 2), ('broken', 3)])
+    queue.finish()
+
+    def handler(kind, payload):
+        if payload == 2:
+            raise TaskError('result not kept')
+        if payload == 3:
+            raise ValueError('bug')
+        return payload * 10
+
+    assert work(queue, handler, owner='worker', poll=0.01) == 1
+    assert queue.counts() == {DONE: 1, FAILED: 2}
+    assert queue.result('kind', 'ok') == 10
+
+
+def test_open_queue(tmp_path):
+    assert isinstance(open_queue(str(tmp_path / 'a')), SqliteWorkQueue)
+    assert isinstance(open_queue('sqlite://{}'.format(tmp_path / 'b')), SqliteWorkQueue)